@@ -4,6 +4,7 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.fsm.storage.memory import MemoryStorage  # 👈 добавляем
 from config import CFG
 import storage
+import price_store
 from handlers import router
 from handlers_extra_sections import router as extra_sections
 from login_pass import router as logpass
@@ -11,6 +12,7 @@ import asyncio
 import logging
 from logging.handlers import RotatingFileHandler
 from update_all_cookies import schedule_daily_cookie_refresh
+from roblox_client import schedule_price_refresh, flush_price_writes
 LOG_PATH = "bot_sections.log"
 
 
@@ -29,6 +31,8 @@ async def main():
     _setup_logging()
 
     await storage.init_db()
+    # разбор старых prices.csv — один раз на старте и не в цикле событий
+    await asyncio.to_thread(price_store.import_legacy_csvs)
     bot = Bot(
         token=CFG.BOT_TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
@@ -42,8 +46,15 @@ async def main():
     dp.include_router(extra_sections)
     dp.include_router(logpass)
     asyncio.create_task(schedule_daily_cookie_refresh(hour=20, minute=58))
+    asyncio.create_task(storage.schedule_metrics_compaction())
+    asyncio.create_task(storage.schedule_snapshot_compaction())
+    asyncio.create_task(schedule_price_refresh())
     print('✅ bot started (polling)')
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await flush_price_writes()
+        await storage.close_db()
 
 
 if __name__ == '__main__':
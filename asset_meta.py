@@ -0,0 +1,205 @@
+"""
+Общее хранилище метаданных ассетов: имя, тип, флаг collectible, URL превью (по размерам).
+
+Раньше каждый модуль держал свои копии (детали каталога в roblox_client, services_collectibles_pipeline,
+public_api, bulk_dump; URL превью в roblox_imagegen) — один и тот же ассет запрашивался заново
+в каждой фиче. Теперь все читают отсюда и докачивают только недостающее.
+
+Строка на (assetId, поле) со своим fetched_at, у каждого поля свой TTL (FIELD_TTL): тип ассета не
+меняется, а URL превью протухают за сутки. Цены живут отдельно, в price_store — они меняются
+постоянно и обновляются по популярности. Имена интернируются при чтении.
+"""
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+ASSET_META_DB_PATH = Path(os.getenv('ASSET_META_DB', 'data/assets.db'))
+ASSET_META_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+
+# TTL по полю, сек; для превью ключ поля — 'thumb:<размер>', TTL общий ('thumb')
+FIELD_TTL: Dict[str, int] = {
+    'name': int(os.getenv('ASSET_NAME_TTL', str(7 * 86400))),
+    'asset_type': int(os.getenv('ASSET_TYPE_TTL', str(365 * 86400))),
+    'collectible': int(os.getenv('ASSET_COLLECTIBLE_TTL', str(86400))),
+    'thumb': int(os.getenv('ASSET_THUMB_URL_TTL', str(86400))),
+}
+_INT_FIELDS = ('asset_type', 'collectible')
+
+_CHUNK = 500  # параметров в одном IN (...)
+
+CREATE_ASSET_META_SQL = '''
+CREATE TABLE IF NOT EXISTS asset_meta (
+  asset_id   INTEGER NOT NULL,
+  field      TEXT NOT NULL,
+  value      TEXT,
+  fetched_at REAL NOT NULL,
+  PRIMARY KEY (asset_id, field)
+) WITHOUT ROWID;
+'''
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.RLock()
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is not None:
+        return _conn
+    with _lock:
+        if _conn is None:
+            conn = sqlite3.connect(str(ASSET_META_DB_PATH), check_same_thread=False, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(CREATE_ASSET_META_SQL)
+            conn.commit()
+            _conn = conn
+    return _conn
+
+
+def close() -> None:
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+def thumb_field(size: str) -> str:
+    return f'thumb:{size}'
+
+
+def ttl_for(field: str) -> int:
+    return FIELD_TTL.get(field.split(':', 1)[0], FIELD_TTL['name'])
+
+
+def _decode(field: str, value: Optional[str]) -> Any:
+    if field in _INT_FIELDS:
+        try:
+            return int(value or 0)
+        except Exception:
+            return 0
+    if field == 'name':
+        return sys.intern(value) if value else ''
+    return value or ''
+
+
+# ====== чтение ======
+
+def get_many(asset_ids: Iterable[int], fields: Iterable[str],
+             ttl: Optional[Dict[str, int]] = None) -> Dict[int, Dict[str, Any]]:
+    """
+    {assetId: {поле: значение}} — только поля, которые моложе своего TTL (ttl переопределяет FIELD_TTL).
+    Ассеты без единого свежего поля в ответ не попадают.
+    """
+    ids = sorted({int(a) for a in asset_ids if a})
+    fields = list(dict.fromkeys(fields))
+    if not ids or not fields:
+        return {}
+    now = time.time()
+    since = {f: now - (ttl or {}).get(f, ttl_for(f)) for f in fields}
+    out: Dict[int, Dict[str, Any]] = {}
+    db = _db()
+    fmarks = ','.join('?' * len(fields))
+    with _lock:
+        for part in (ids[i:i + _CHUNK] for i in range(0, len(ids), _CHUNK)):
+            marks = ','.join('?' * len(part))
+            rows = db.execute(
+                f'SELECT asset_id, field, value, fetched_at FROM asset_meta '
+                f'WHERE asset_id IN ({marks}) AND field IN ({fmarks})',
+                [*part, *fields]
+            )
+            for aid, field, value, ts in rows:
+                if ts >= since[field]:
+                    out.setdefault(int(aid), {})[field] = _decode(field, value)
+    return out
+
+
+def missing(asset_ids: Iterable[int], fields: Iterable[str]) -> List[int]:
+    """assetId (в исходном порядке, без повторов), у которых нет хотя бы одного свежего поля из fields."""
+    ids = list(dict.fromkeys(int(a) for a in asset_ids if a))
+    fields = list(fields)
+    known = get_many(ids, fields)
+    return [a for a in ids if any(f not in known.get(a, {}) for f in fields)]
+
+
+# ====== запись ======
+
+def put_many(records: Dict[int, Dict[str, Any]], fetched_at: Optional[float] = None) -> int:
+    """records — {assetId: {поле: значение}}; None и пустые имена/URL не пишутся. Возвращает число полей."""
+    ts = time.time() if fetched_at is None else float(fetched_at)
+    rows = []
+    for aid, rec in (records or {}).items():
+        try:
+            aid = int(aid)
+        except Exception:
+            continue
+        if not aid:
+            continue
+        for field, value in (rec or {}).items():
+            if value is None or value == '':
+                continue
+            if field in _INT_FIELDS:
+                try:
+                    value = int(value)
+                except Exception:
+                    continue
+            rows.append((aid, field, str(value), ts))
+    if not rows:
+        return 0
+    db = _db()
+    with _lock:
+        try:
+            with db:
+                db.executemany(
+                    'INSERT OR REPLACE INTO asset_meta (asset_id, field, value, fetched_at) VALUES (?, ?, ?, ?)',
+                    rows
+                )
+        except Exception as e:
+            logging.error(f"[ASSET_META] put_many() error: {e}")
+            return 0
+    return len(rows)
+
+
+def is_collectible(detail: Dict[str, Any]) -> bool:
+    """Флаг collectible по детали каталога (itemRestrictions) или строке дампа (Collectible) — одно правило на все модули."""
+    if not isinstance(detail, dict):
+        return False
+    for key in ('itemRestrictions', 'Collectible'):
+        v = detail.get(key)
+        if isinstance(v, list) and any(str(x).strip().lower() == 'collectible' for x in v if x is not None):
+            return True
+        if isinstance(v, str) and v.strip().lower() == 'collectible':
+            return True
+        if isinstance(v, bool) and v:
+            return True
+    return False
+
+
+def records_from_catalog(details: Iterable[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """Метаданные из ответа catalog/items/details (только поля, которые в ответе есть)."""
+    out: Dict[int, Dict[str, Any]] = {}
+    for d in details or []:
+        if not isinstance(d, dict) or d.get('_from_store'):
+            continue
+        try:
+            aid = int(d.get('id') or d.get('assetId') or 0)
+        except Exception:
+            continue
+        if not aid:
+            continue
+        rec: Dict[str, Any] = {'name': str(d.get('name') or '').strip()}
+        if d.get('assetType') is not None:
+            rec['asset_type'] = d.get('assetType')
+        if 'itemRestrictions' in d or 'Collectible' in d:
+            rec['collectible'] = 1 if is_collectible(d) else 0
+        out[aid] = rec
+    return out
+
+
+def put_catalog(details: Iterable[Dict[str, Any]]) -> int:
+    return put_many(records_from_catalog(details))
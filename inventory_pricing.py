@@ -0,0 +1,158 @@
+"""
+Пакетный подсчёт цен инвентаря: цены нормализуются один раз в колонку, дальше суммы по категориям,
+уровни (tiers) и порядок сортировки считаются над колонкой целиком.
+
+С NumPy (необязательная зависимость, `pip install numpy`) — векторно: np.add.reduceat по смещениям
+категорий, searchsorted по порогам, argsort. Без него — те же функции обычными циклами по array('q'),
+результат одинаковый. Колонки CompactInventory читаются без копирования (np.frombuffer).
+"""
+from array import array
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # векторный путь выключен, работают циклы
+    np = None
+
+HAS_NUMPY = np is not None
+
+# строки цен из каталога: "1 200 R$", "350,5" и т.п.
+_CURRENCY_TOKENS = ('R$', '₽', 'RBX', 'robux', 'руб', '$')
+
+
+def norm_price(v) -> int:
+    """Цена из числа или строки с валютой/пробелами; всё нечитаемое — 0."""
+    try:
+        if v is None or isinstance(v, bool):
+            return 0
+        if isinstance(v, (int, float)):
+            return int(v)
+        if isinstance(v, str):
+            s = v.strip().replace(',', '.').replace(' ', '')
+            for token in _CURRENCY_TOKENS:
+                s = s.replace(token, '')
+            return int(float(s))
+    except Exception:
+        return 0
+    return 0
+
+
+def price_value(info: Optional[Dict[str, Any]], fallback: bool = True) -> int:
+    """
+    Цена предмета из priceInfo: value, а если его нет и fallback — lowestResalePrice/recentAveragePrice
+    (source=resale-data) или lowest (source=resellers).
+    """
+    if not info:
+        return 0
+    v = info.get('value')
+    if isinstance(v, (int, float)):
+        return int(v)
+    if isinstance(v, str) and v.strip():
+        return norm_price(v)
+    if not fallback:
+        return 0
+    src = info.get('source')
+    if src == 'resale-data':
+        rs = info.get('resale') or {}
+        p = rs.get('lowestResalePrice') or rs.get('recentAveragePrice')
+        return int(p) if isinstance(p, (int, float)) else 0
+    if src == 'resellers':
+        low = info.get('lowest')
+        return int(low) if isinstance(low, (int, float)) else 0
+    return 0
+
+
+# ====== колонки ======
+
+def price_column(items: Iterable[Dict[str, Any]], fallback: bool = True):
+    """Цены предметов одной колонкой (ndarray int64 или array('q')) — dict'ы обходятся ровно один раз."""
+    col = array('q', (price_value(it.get('priceInfo'), fallback) for it in items or []))
+    return np.frombuffer(col, dtype=np.int64) if HAS_NUMPY else col
+
+
+def pick_prices(details: Sequence[Dict[str, Any]],
+                fields: Tuple[str, ...] = ('price', 'lowestPrice', 'lowestResalePrice', 'highestResalePrice')):
+    """Цена по деталям каталога: максимум из fields (как roblox_client._price_pick), пачкой."""
+    cols = [array('q', (norm_price(d.get(f)) for d in details)) for f in fields]
+    if HAS_NUMPY:
+        if not details:
+            return np.zeros(0, dtype=np.int64)
+        return np.max(np.stack([np.frombuffer(c, dtype=np.int64) for c in cols]), axis=0)
+    return array('q', (max(vals) for vals in zip(*cols))) if details else array('q')
+
+
+def _as_numpy(prices):
+    if isinstance(prices, array):
+        return np.frombuffer(prices, dtype=np.int64) if prices.typecode == 'q' else np.asarray(prices, dtype=np.int64)
+    return np.asarray(prices, dtype=np.int64)
+
+
+# ====== агрегаты ======
+
+def segment_sums(prices, offsets: Sequence[int]) -> List[int]:
+    """Суммы отрезков prices[offsets[i]:offsets[i+1]] (offsets начинается с 0, длина = сегментов + 1)."""
+    n = len(offsets) - 1
+    if n <= 0:
+        return []
+    if HAS_NUMPY:
+        p = _as_numpy(prices)
+        starts = np.asarray(offsets[:-1], dtype=np.int64)
+        nonempty = starts < np.asarray(offsets[1:], dtype=np.int64)
+        out = np.zeros(n, dtype=np.int64)
+        if nonempty.any():
+            # reduceat на пустом отрезке вернул бы элемент, а не 0 — считаем только непустые
+            out[nonempty] = np.add.reduceat(p, starts[nonempty])
+        return out.tolist()
+    return [sum(prices[offsets[i]:offsets[i + 1]]) for i in range(n)]
+
+
+def category_sums(by_cat: Dict[str, Iterable[Dict[str, Any]]], fallback: bool = True) -> Dict[str, int]:
+    """{категория: сумма цен} — одна колонка на все категории и одна редукция."""
+    cats: List[str] = []
+    offsets = [0]
+    flat: List[Dict[str, Any]] = []
+    for cat, arr in (by_cat or {}).items():
+        flat.extend(arr or [])
+        cats.append(cat)
+        offsets.append(len(flat))
+    return dict(zip(cats, segment_sums(price_column(flat, fallback), offsets)))
+
+
+def total(prices) -> int:
+    """Сумма всех цен колонки."""
+    return int(_as_numpy(prices).sum()) if HAS_NUMPY else sum(prices)
+
+
+def positive_total(prices) -> int:
+    """Сумма положительных цен."""
+    if HAS_NUMPY:
+        p = _as_numpy(prices)
+        return int(p[p > 0].sum())
+    return sum(v for v in prices if v > 0)
+
+
+def sort_order(prices, descending: bool = True) -> List[int]:
+    """Индексы по цене (стабильно: при равной цене — исходный порядок)."""
+    if HAS_NUMPY:
+        p = _as_numpy(prices)
+        return np.argsort(-p if descending else p, kind='stable').tolist()
+    return sorted(range(len(prices)), key=(lambda i: -prices[i]) if descending else prices.__getitem__)
+
+
+def tier_indices(prices, mins: Sequence[int]) -> List[int]:
+    """
+    Номер уровня для каждой цены: mins — пороги по возрастанию, результат i — последний порог <= цены,
+    -1 — цена ниже всех порогов.
+    """
+    if HAS_NUMPY:
+        return (np.searchsorted(np.asarray(mins, dtype=np.int64), _as_numpy(prices), side='right') - 1).tolist()
+    return [bisect_right(mins, v) - 1 for v in prices]
+
+
+def tier_names(prices, thresholds: Iterable[Tuple[int, str]], default: str) -> List[str]:
+    """Имя уровня по цене; thresholds — (минимум, имя) в любом порядке, ниже всех — default."""
+    ordered = sorted(thresholds)
+    mins = [m for m, _ in ordered]
+    names = [nm for _, nm in ordered]
+    return [names[i] if i >= 0 else default for i in tier_indices(prices, mins)]
@@ -0,0 +1,330 @@
+"""
+Единое хранилище цен ассетов вместо prices.csv.
+
+SQLite-файл (PRICE_DB, по умолчанию data/prices.db): строка на assetId с ценой, именем, флагом collectible,
+источником и fetched_at. Запись — upsert, более свежая цена вытесняет старую (не наоборот),
+чтение — пачкой по id с max_age, чтобы устаревшие цены перезапрашивались.
+Старые CSV (корневой prices.csv из bulk_dump и logs/prices.csv из roblox_client) импортируются
+на старте бота (import_legacy_csvs из app.py, в потоке) и повторно — когда файл меняется.
+
+Запросы точечные по первичному ключу на локальном файле, поэтому API синхронный.
+"""
+import csv
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+PRICE_DB_PATH = Path(os.getenv('PRICE_DB', 'data/prices.db'))
+PRICE_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+PRICE_TTL = int(os.getenv('PRICE_TTL', str(6 * 3600)))  # цена старше — устарела, сек
+
+# CSV, которые раньше были хранилищем цен (схемы assetId/price/collectible и itemId/pricePicked)
+LEGACY_PRICE_CSVS = [
+    os.getenv('PRICE_CSV_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prices.csv')),
+    os.getenv('PRICE_DUMP_PATH', os.path.join(os.getenv('IMAGEGEN_LOG_DIR', 'logs'), 'prices.csv')),
+]
+
+_CHUNK = 500  # параметров в одном IN (...)
+
+# популярность ассетов для фонового обновления цен (в памяти, с затуханием)
+PRICE_POP_HALFLIFE = float(os.getenv('PRICE_POP_HALFLIFE', str(6 * 3600)))  # за столько сек счётчик падает вдвое
+PRICE_POP_MAX = int(os.getenv('PRICE_POP_MAX', '50000'))  # сколько ассетов помнить
+
+CREATE_PRICES_SQL = '''
+CREATE TABLE IF NOT EXISTS asset_prices (
+  asset_id    INTEGER PRIMARY KEY,
+  name        TEXT,
+  price       INTEGER NOT NULL DEFAULT 0,
+  collectible INTEGER NOT NULL DEFAULT 0,
+  source      TEXT,
+  fetched_at  REAL NOT NULL
+);
+'''
+
+# какие CSV уже импортированы и в каком виде (mtime) — чтобы не перечитывать их на каждом старте
+CREATE_IMPORTS_SQL = '''
+CREATE TABLE IF NOT EXISTS price_imports (
+  path        TEXT PRIMARY KEY,
+  mtime       REAL,
+  rows        INTEGER,
+  imported_at REAL
+);
+'''
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.RLock()
+
+_views: Dict[int, float] = {}
+_views_decayed_at = time.time()
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is not None:
+        return _conn
+    with _lock:
+        if _conn is None:
+            conn = sqlite3.connect(str(PRICE_DB_PATH), check_same_thread=False, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(CREATE_PRICES_SQL)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_asset_prices_name ON asset_prices(name COLLATE NOCASE)')
+            conn.execute(CREATE_IMPORTS_SQL)
+            conn.commit()
+            _conn = conn
+    return _conn
+
+
+def close() -> None:
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+def _chunks(seq: List[Any]) -> Iterable[List[Any]]:
+    for i in range(0, len(seq), _CHUNK):
+        yield seq[i:i + _CHUNK]
+
+
+def _row_dict(r: tuple) -> Dict[str, Any]:
+    return {
+        'price': int(r[2] or 0),
+        'name': sys.intern(r[1]) if r[1] else '',
+        'collectible': bool(r[3]),
+        'source': r[4],
+        'fetched_at': float(r[5] or 0),
+    }
+
+
+# ====== чтение ======
+
+def get_many(asset_ids: Iterable[int], max_age: Optional[float] = None) -> Dict[int, Dict[str, Any]]:
+    """
+    {assetId: {"price", "name", "collectible", "source", "fetched_at"}} для известных id.
+    max_age (сек) — только цены не старше; None — любые.
+    """
+    ids = sorted({int(a) for a in asset_ids if a})
+    if not ids:
+        return {}
+    since = time.time() - max_age if max_age is not None else None
+    out: Dict[int, Dict[str, Any]] = {}
+    db = _db()
+    with _lock:
+        for part in _chunks(ids):
+            marks = ','.join('?' * len(part))
+            sql = f'SELECT asset_id, name, price, collectible, source, fetched_at FROM asset_prices WHERE asset_id IN ({marks})'
+            args: List[Any] = list(part)
+            if since is not None:
+                sql += ' AND fetched_at >= ?'
+                args.append(since)
+            for r in db.execute(sql, args):
+                out[int(r[0])] = _row_dict(r)
+    return out
+
+
+def get(asset_id: int, max_age: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    return get_many([asset_id], max_age).get(int(asset_id))
+
+
+def get_by_names(names: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """{имя в нижнем регистре: запись + "assetId"} — самая свежая запись с таким именем."""
+    keys = sorted({str(n).strip() for n in names if n and str(n).strip()})
+    out: Dict[str, Dict[str, Any]] = {}
+    if not keys:
+        return out
+    db = _db()
+    with _lock:
+        for part in _chunks(keys):
+            marks = ','.join('?' * len(part))
+            rows = db.execute(
+                f'''
+                SELECT asset_id, name, price, collectible, source, fetched_at FROM asset_prices
+                WHERE name COLLATE NOCASE IN ({marks}) ORDER BY fetched_at
+                ''',
+                part
+            )
+            for r in rows:
+                rec = _row_dict(r)
+                rec['assetId'] = int(r[0])
+                out[str(r[1]).lower()] = rec
+    return out
+
+
+# ====== запись ======
+
+def upsert_many(rows: Iterable[Tuple[int, str, int, bool]], source: str = 'catalog',
+                fetched_at: Optional[float] = None) -> int:
+    """
+    rows — (assetId, name, price, collectible). Повторы assetId в пачке схлопываются (последний выигрывает).
+    Запись заменяет существующую, только если не старее её; пустое имя не затирает известное.
+    """
+    ts = time.time() if fetched_at is None else float(fetched_at)
+    batch: Dict[int, tuple] = {}
+    for aid, name, price, collectible in rows:
+        try:
+            aid = int(aid)
+        except Exception:
+            continue
+        if aid:
+            batch[aid] = (aid, str(name or '').strip(), int(price or 0), 1 if collectible else 0, source, ts)
+    if not batch:
+        return 0
+    db = _db()
+    with _lock:
+        try:
+            with db:
+                db.executemany(
+                    '''
+                    INSERT INTO asset_prices (asset_id, name, price, collectible, source, fetched_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(asset_id) DO UPDATE SET
+                        name = COALESCE(NULLIF(excluded.name, ''), asset_prices.name),
+                        price = excluded.price,
+                        collectible = excluded.collectible,
+                        source = excluded.source,
+                        fetched_at = excluded.fetched_at
+                    WHERE excluded.fetched_at >= asset_prices.fetched_at
+                    ''',
+                    list(batch.values())
+                )
+        except Exception as e:
+            logging.error(f"[PRICES] upsert_many() error: {e}")
+            return 0
+    return len(batch)
+
+
+# ====== импорт CSV ======
+
+def _to_int(v) -> int:
+    try:
+        return int(float(str(v).strip().replace(',', '.')))
+    except Exception:
+        return 0
+
+
+def _read_csv_rows(path: str) -> List[Tuple[int, str, int, bool]]:
+    out: List[Tuple[int, str, int, bool]] = []
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            return out
+        cols = [(h or '').strip().lower() for h in header]
+
+        def _col(*names: str) -> Optional[int]:
+            for n in names:
+                if n in cols:
+                    return cols.index(n)
+            return None
+
+        i_id = _col('assetid', 'itemid', 'collectibleitemid', 'collectibleid', 'id')
+        i_price = _col('pricepicked', 'price', 'lowestprice', 'value', 'cost')
+        i_name = _col('name')
+        i_col = _col('collectible')
+        if i_id is None:
+            # без заголовка: id,name,price[,collectible]
+            i_id, i_name, i_price, i_col = 0, 1, 2, 3
+            f.seek(0)
+            reader = csv.reader(f)
+        for row in reader:
+            if not row or len(row) <= i_id:
+                continue
+            aid = _to_int(row[i_id])
+            if not aid:
+                continue
+            name = row[i_name].strip() if i_name is not None and len(row) > i_name else ''
+            price = _to_int(row[i_price]) if i_price is not None and len(row) > i_price else 0
+            flag = row[i_col].strip().lower() if i_col is not None and len(row) > i_col else ''
+            out.append((aid, name, price, flag in ('1', 'true', 'yes', 'collectible')))
+    return out
+
+
+def import_csv(path: str, source: Optional[str] = None) -> int:
+    """Импорт CSV любой из старых схем. fetched_at = mtime файла: более свежие цены из каталога он не затрёт."""
+    try:
+        mtime = os.path.getmtime(path)
+        rows = _read_csv_rows(path)
+    except Exception as e:
+        logging.warning(f"[PRICES] import {path} failed: {e}")
+        return 0
+    n = upsert_many(rows, source=source or f'csv:{os.path.basename(path)}', fetched_at=mtime)
+    db = _db()
+    with _lock, db:
+        db.execute(
+            'INSERT OR REPLACE INTO price_imports (path, mtime, rows, imported_at) VALUES (?, ?, ?, ?)',
+            (os.path.abspath(path), mtime, n, time.time())
+        )
+    logging.info(f"[PRICES] imported {n} rows from {path}")
+    return n
+
+
+def import_legacy_csvs(force: bool = False) -> int:
+    """Импортирует LEGACY_PRICE_CSVS, которые ещё не импортированы или изменились с прошлого раза."""
+    total = 0
+    db = _db()
+    for path in dict.fromkeys(os.path.abspath(p) for p in LEGACY_PRICE_CSVS):
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        with _lock:
+            row = db.execute('SELECT mtime FROM price_imports WHERE path=?', (path,)).fetchone()
+        if force or row is None or float(row[0] or 0) != mtime:
+            total += import_csv(path)
+    return total
+
+
+# ====== популярность ======
+
+def note_views(asset_ids: Iterable[int]) -> None:
+    """Засчитывает показ ассетов в отрисованном инвентаре (каждый id — один раз за вызов)."""
+    ids = set()
+    for a in asset_ids:
+        try:
+            a = int(a)
+        except Exception:
+            continue
+        if a:
+            ids.add(a)
+    if not ids:
+        return
+    with _lock:
+        for a in ids:
+            _views[a] = _views.get(a, 0.0) + 1.0
+
+
+def decay_views(now: Optional[float] = None) -> int:
+    """
+    Затухание счётчиков по PRICE_POP_HALFLIFE с прошлого вызова; почти нулевые и лишние сверх
+    PRICE_POP_MAX (самые холодные) выбрасываются. Возвращает, сколько ассетов осталось.
+    """
+    global _views_decayed_at
+    now = time.time() if now is None else float(now)
+    with _lock:
+        elapsed = max(0.0, now - _views_decayed_at)
+        _views_decayed_at = now
+        k = 0.5 ** (elapsed / PRICE_POP_HALFLIFE) if PRICE_POP_HALFLIFE > 0 else 1.0
+        for a, v in list(_views.items()):
+            v *= k
+            if v < 0.05:
+                del _views[a]
+            else:
+                _views[a] = v
+        if len(_views) > PRICE_POP_MAX:
+            for a in sorted(_views, key=_views.__getitem__)[:len(_views) - PRICE_POP_MAX]:
+                del _views[a]
+        return len(_views)
+
+
+def hot_assets(limit: int) -> List[int]:
+    """Самые часто показываемые assetId, по убыванию популярности."""
+    with _lock:
+        ranked = sorted(_views.items(), key=lambda kv: kv[1], reverse=True)
+    return [a for a, _ in ranked[:max(0, int(limit))]]
@@ -5,6 +5,8 @@ from typing import Dict, Any, List, Tuple
 from config import CFG
 from http_shared import get_client, PROXY_POOL
 import cache
+import price_store
+import asset_meta
 PROFILE_TTL = int(getattr(CFG, 'PUBLIC_PROFILE_TTL', 1800))
 INV_TTL = int(getattr(CFG, 'PUBLIC_INV_TTL', 1800))
 CATALOG_RETRIES = int(getattr(CFG, 'CATALOG_RETRIES', 8))
@@ -98,10 +100,34 @@ async def _fetch_inventory_for_type(client: httpx.AsyncClient, user_id: int, ass
             break
     return items
 
+def _store_catalog_details(details: List[Dict[str, Any]]) -> None:
+    rows = []
+    for d in details:
+        try:
+            rows.append((int(d['id']), d.get('name') or '', _price_info_from_detail(d)['value'],
+                         asset_meta.is_collectible(d)))
+        except Exception:
+            continue
+    price_store.upsert_many(rows, source='public_api')
+    asset_meta.put_catalog(details)
+
+def _read_known_prices(asset_ids: List[int]) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, Dict[str, Any]]]:
+    known = price_store.get_many(asset_ids, max_age=price_store.PRICE_TTL)
+    return known, asset_meta.get_many(known, ('name',))
+
 async def _fetch_catalog_prices(client_seed: httpx.AsyncClient, asset_ids: List[int]) -> Dict[int, Dict[str, Any]]:
     out: Dict[int, Dict[str, Any]] = {}
     if not asset_ids:
         return out
+    # общие хранилища цен и метаданных: в каталог идут только неизвестные и устаревшие id
+    known, names = await asyncio.to_thread(_read_known_prices, asset_ids)
+    for aid, rec in known.items():
+        out[aid] = {'priceInfo': {'value': rec['price'], 'source': 'store'},
+                    'name': names.get(aid, {}).get('name') or rec['name'] or str(aid)}
+    asset_ids = [a for a in dict.fromkeys(int(x) for x in asset_ids) if a not in out]
+    if not asset_ids:
+        return out
+    fetched: List[Dict[str, Any]] = []
     url = 'https://catalog.roblox.com/v1/catalog/items/details'
     chunks = [asset_ids[i:i + CATALOG_BATCH_SIZE] for i in range(0, len(asset_ids), CATALOG_BATCH_SIZE)]
     sem = asyncio.Semaphore(CATALOG_CONCURRENCY)
@@ -140,11 +166,12 @@ async def _fetch_catalog_prices(client_seed: httpx.AsyncClient, asset_ids: List[
                             continue
                     r.raise_for_status()
                     js = r.json()
-                for d in js or []:
+                for d in (js.get('data') if isinstance(js, dict) else js) or []:
                     aid = d.get('id')
                     if aid is None:
                         continue
                     out[int(aid)] = {'priceInfo': _price_info_from_detail(d), 'name': d.get('name') or str(aid)}
+                    fetched.append(d)
                 return
             except httpx.HTTPStatusError as e:
                 code = e.response.status_code
@@ -157,7 +184,11 @@ async def _fetch_catalog_prices(client_seed: httpx.AsyncClient, asset_ids: List[
                     await asyncio.sleep(0.3 * (attempt + 1))
                     continue
                 raise
-    await asyncio.gather(*(one(i, ch) for i, ch in enumerate(chunks)))
+    try:
+        await asyncio.gather(*(one(i, ch) for i, ch in enumerate(chunks)))
+    finally:
+        if fetched:
+            await asyncio.to_thread(_store_catalog_details, fetched)
     return out
 
 async def fetch_public_inventory(user_id: int) -> Dict[str, Any]:
@@ -48,13 +48,14 @@ def _to_int(v):
 
 
 import asyncio
-import csv
+import atexit
 import hashlib
 import logging
 import os
 import random
 import time
-from typing import Optional, Dict, Any, List
+from collections import OrderedDict, deque
+from typing import Optional, Dict, Any, List, Callable, Awaitable, AsyncIterator, Tuple
 
 import httpx
 logger = logging.getLogger('roblox_client')
@@ -63,10 +64,15 @@ logger = logging.getLogger('roblox_client')
 from http_shared import get_client, PROXY_POOL
 from config import CFG
 import storage
-from util.crypto import decrypt_text
 import cache
+from cache_locks import get_lock
+from inventory_compact import CompactInventory
+import price_store
+import asset_meta
+import inventory_pricing
 
 INVENTORY_URL = "https://inventory.roblox.com/v2/users/{uid}/inventory/{asset_type}"
+CAN_VIEW_INVENTORY_URL = "https://inventory.roblox.com/v1/users/{uid}/can-view-inventory"
 CATALOG_DETAILS_URL = "https://catalog.roblox.com/v1/catalog/items/details"
 CSRF_HEADER = "x-csrf-token"
 BATCH_SIZE = 120
@@ -74,8 +80,19 @@ BATCH_SIZE = 120
 INV_TTL = int(getattr(CFG, "CACHE_INV_TTL", 1800))  # уменьшил для скорости
 CATALOG_CONCURRENCY = int(getattr(CFG, "CATALOG_CONCURRENCY", 64))  # увеличил
 CATALOG_RETRIES = int(getattr(CFG, "CATALOG_RETRIES", 2))  # уменьшил
+CATALOG_AGG_WINDOW_MS = float(os.getenv("CATALOG_AGG_WINDOW_MS", "5"))  # сколько копим неполный батч деталей, мс
+# фоновое обновление цен популярных ассетов (см. schedule_price_refresh)
+PRICE_REFRESH_INTERVAL = int(os.getenv("PRICE_REFRESH_INTERVAL", "300"))  # сек между проходами
+PRICE_REFRESH_BATCHES = int(os.getenv("PRICE_REFRESH_BATCHES", "5"))  # бюджет запросов каталога за проход
+PRICE_REFRESH_AGE = int(os.getenv("PRICE_REFRESH_AGE", str(price_store.PRICE_TTL // 2)))  # цена старше — обновляем заранее
+PRICE_WRITE_DELAY = float(os.getenv("PRICE_WRITE_DELAY", "1.0"))  # сколько копим цены перед записью, сек
+PRICE_WRITE_BATCH = int(os.getenv("PRICE_WRITE_BATCH", "2000"))  # при таком объёме пишем сразу
 SPENDING_TTL = int(getattr(CFG, "CACHE_SPENDING_TTL", 3600))  # кэш трат — 1 час
 ENABLE_SPENDING_CACHE: bool = True  # toggle cache read/write for spending
+SPENDING_SYNC_INTERVAL = int(os.getenv("SPENDING_SYNC_INTERVAL", "15"))  # чаще журнал трат не синхронизируем, сек
+SPENDING_SYNC_MAX_PAGES = int(os.getenv("SPENDING_SYNC_MAX_PAGES", "2000"))  # страниц за одну синхронизацию
+SPENDING_SUMMARY_MAX = int(os.getenv("SPENDING_SUMMARY_MAX", "64"))  # сколько сводок трат держать в памяти
+SPENDING_SUMMARY_TTL = int(os.getenv("SPENDING_SUMMARY_TTL", "900"))  # сводка старше — собирается заново, сек
 
 # Log initial cache settings after constants are loaded
 try:
@@ -92,11 +109,17 @@ INV_BACKOFF_BASE_MS = int(os.getenv("INV_BACKOFF_BASE_MS", "150"))  # умень
 INV_BACKOFF_CAP_MS = int(os.getenv("INV_BACKOFF_CAP_MS", "1000"))  # уменьшил
 
 # === Новые настройки для скорости ===
-INV_PARALLEL_TYPES = int(os.getenv("INV_PARALLEL_TYPES", "16"))  # параллелизм типов
+INV_PARALLEL_TYPES = int(os.getenv("INV_PARALLEL_TYPES", "16"))  # сколько типов одного юзера качается одновременно
+INV_GLOBAL_CONCURRENCY = int(os.getenv("INV_GLOBAL_CONCURRENCY", "32"))  # страниц в полёте на весь процесс
 INV_BATCH_SIZE = int(os.getenv("INV_BATCH_SIZE", "200"))  # размер батча
 INV_TIMEOUT_PER_PAGE = float(os.getenv("INV_TIMEOUT_PER_PAGE", "4.0"))  # таймаут страницы
+INV_USER_BUDGET = float(os.getenv("INV_USER_BUDGET", "25.0"))  # бюджет на все страницы одного юзера, сек
+INV_FULL_RESYNC_TTL = int(os.getenv("INV_FULL_RESYNC_TTL", str(6 * 3600)))  # после этого refresh снова полный, сек
+INV_EMPTY_RECHECK = int(os.getenv("INV_EMPTY_RECHECK", str(24 * 3600)))  # пустой у юзера тип перепроверяем не чаще, сек (0 — всегда)
 PUBLIC_MODE_MAX_COOKIES = int(os.getenv("PUBLIC_MODE_MAX_COOKIES", "5"))  # максимум куки
 PUBLIC_MODE_TIMEOUT = float(os.getenv("PUBLIC_MODE_TIMEOUT", "8.0"))  # общий таймаут
+PUBLIC_PROBE_TIMEOUT = float(os.getenv("PUBLIC_PROBE_TIMEOUT", "2.5"))  # таймаут пробы куки, сек
+PUBLIC_PROBE_HEAD_START = float(os.getenv("PUBLIC_PROBE_HEAD_START", "0.3"))  # фора привязанной куке, сек
 
 log = logging.getLogger("roblox_client")
 os.makedirs('logs', exist_ok=True)
@@ -172,7 +195,6 @@ LOG_DIR = os.getenv("IMAGEGEN_LOG_DIR", "logs")
 os.makedirs(LOG_DIR, exist_ok=True)
 
 PRICE_LOG_PATH = os.path.join(LOG_DIR, "pricing.log")
-PRICE_DUMP_PATH = os.getenv("PRICE_DUMP_PATH", os.path.join(LOG_DIR, "prices.csv"))
 
 _price_logger = logging.getLogger("pricing")
 if not _price_logger.handlers:
@@ -219,138 +241,311 @@ async def _sleep_backoff(attempt: int) -> None:
     await asyncio.sleep(delay)
 
 
-async def _get_inventory_pages_fast(
+async def _fetch_inventory_page(
         uid: int,
         asset_type: int,
         cookie: Optional[str],
+        cursor: Optional[str],
         limit: int = INV_BATCH_SIZE,
-) -> List[int]:
+        page_num: int = 0,
+):
     """
-    БЫСТРАЯ версия - с уменьшенными таймаутами и лимитами
+    Одна страница инвентаря с ретраями.
+    Возвращает (ids, next_cursor, err): err=None — успех, "fatal" — нет смысла продолжать (не 2xx/429/5xx/403),
+    "error" — ретраи исчерпаны.
     """
     endpoint = INVENTORY_URL.format(uid=uid, asset_type=asset_type)
-    items: List[int] = []
-    cursor: Optional[str] = None
+    params = {"limit": limit, "sortOrder": "Desc"}
+    if cursor:
+        params["cursor"] = cursor
 
-    log.info(f"[inv_fast] begin uid={uid} type={asset_type} limit={limit}")
-    t_start = time.time()
-
-    max_pages = 3  # максимум страниц для скорости
+    last_err: Optional[str] = None
+    for attempt in range(1, INV_MAX_RETRIES + 1):
+        proxy = PROXY_POOL.any()
+        client = await get_client(proxy)
+        try:
+            t_req = time.time()
+            resp = await client.get(
+                endpoint,
+                params=params,
+                headers=_cookie_headers(cookie),
+                timeout=httpx.Timeout(INV_TIMEOUT_PER_PAGE, connect=1.2, read=3.0),  # уменьшил таймауты
+            )
+            status = resp.status_code
+            dt = time.time() - t_req
+            # 403 здесь чаще значит приватный инвентарь цели, а не мёртвую куку — его не учитываем
+            if status != 403:
+                storage.note_cookie_result(cookie, status, dt * 1000)
+
+            if status == 200:
+                js = resp.json() or {}
+                data = js.get("data") or []
+                ids: List[int] = []
+                for it in data:
+                    aid = it.get("assetId") or it.get("id")
+                    try:
+                        if aid is not None:
+                            ids.append(int(aid))
+                    except Exception:
+                        pass
+                nxt = js.get("nextPageCursor")
+                log.info(
+                    f"[inv_fast] page uid={uid} type={asset_type} page={page_num + 1} items={len(data)} next={bool(nxt)} dt={dt:.3f}s")
+                return ids, nxt, None
+
+            # временные статусы — повторяем
+            if status in (429, 500, 502, 503, 504):
+                last_err = f"http {status}"
+                log.warning(f"[inv_fast] uid={uid} type={asset_type} {last_err}, attempt={attempt}")
+                await _sleep_backoff(attempt)
+                continue
 
-    for page_num in range(max_pages):
-        params = {"limit": limit, "sortOrder": "Desc"}
-        if cursor:
-            params["cursor"] = cursor
+            # 403 — может быть как временным (proxy/geo), так и из-за куки
+            if status == 403:
+                last_err = "http 403"
+                log.warning(f"[inv_fast] uid={uid} type={asset_type} {last_err}, attempt={attempt}")
+                await _sleep_backoff(attempt)
+                continue
 
-        ok = False
-        last_err: Optional[str] = None
+            # остальное — считаем фаталом
+            log.error(f"[inv_fast] uid={uid} type={asset_type} fatal http {status}")
+            return [], None, "fatal"
 
-        for attempt in range(1, INV_MAX_RETRIES + 1):
-            proxy = PROXY_POOL.any()
-            client = await get_client(proxy)
-            try:
-                t_req = time.time()
-                resp = await client.get(
-                    endpoint,
-                    params=params,
-                    headers=_cookie_headers(cookie),
-                    timeout=httpx.Timeout(INV_TIMEOUT_PER_PAGE, connect=1.2, read=3.0),  # уменьшил таймауты
-                )
-                status = resp.status_code
-                dt = time.time() - t_req
-
-                if status == 200:
-                    js = resp.json() or {}
-                    data = js.get("data") or []
-                    for it in data:
-                        aid = it.get("assetId") or it.get("id")
-                        try:
-                            if aid is not None:
-                                items.append(int(aid))
-                        except Exception:
-                            pass
-                    cursor = js.get("nextPageCursor")
-                    ok = True
-                    log.info(
-                        f"[inv_fast] page uid={uid} type={asset_type} page={page_num + 1} items={len(data)} next={bool(cursor)} dt={dt:.3f}s")
-                    break
+        except Exception as e:
+            last_err = f"exc {type(e).__name__}: {e}"
+            log.warning(f"[inv_fast] uid={uid} type={asset_type} {last_err}, attempt={attempt}")
+            await _sleep_backoff(attempt)
 
-                # временные статусы — повторяем
-                if status in (429, 500, 502, 503, 504):
-                    last_err = f"http {status}"
-                    log.warning(f"[inv_fast] uid={uid} type={asset_type} {last_err}, attempt={attempt}")
-                    await _sleep_backoff(attempt)
-                    continue
+    log.error(f"[inv_fast] uid={uid} type={asset_type} giving up on page {page_num + 1} ({last_err})")
+    return [], None, "error"
 
-                # 403 — может быть как временным (proxy/geo), так и из-за куки
-                if status == 403:
-                    last_err = "http 403"
-                    log.warning(f"[inv_fast] uid={uid} type={asset_type} {last_err}, attempt={attempt}")
-                    await _sleep_backoff(attempt)
-                    continue
 
-                # остальное — считаем фаталом
-                last_err = f"http {status}"
-                log.error(f"[inv_fast] uid={uid} type={asset_type} fatal {last_err}")
-                return items
+class _InventoryPageScheduler:
+    """
+    Общая очередь страниц инвентаря на весь процесс.
+    Единица работы — одна страница одного типа: следующая страница типа ставится в очередь,
+    когда пришла предыдущая (курсор), так что медленный тип занимает один слот и не держит остальные.
+    Воркеров INV_GLOBAL_CONCURRENCY на все запросы всех пользователей; очередь выбирается
+    по кругу между пользователями — большой инвентарь не вытесняет маленькие.
+    """
 
+    def __init__(self, workers: int):
+        self.workers = max(1, int(workers))
+        self._queues: Dict[Any, deque] = {}
+        self._ring: deque = deque()
+        self._ready: Optional[asyncio.Semaphore] = None
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_workers(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is self._loop and self._tasks:
+            return
+        # новый event loop (скрипты с asyncio.run) — старая очередь к нему не относится
+        self._loop = loop
+        self._queues.clear()
+        self._ring.clear()
+        self._ready = asyncio.Semaphore(0)
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, owner: Any, job: Callable[[], Awaitable[None]]) -> None:
+        self._ensure_workers()
+        q = self._queues.get(owner)
+        if q is None:
+            q = self._queues[owner] = deque()
+            self._ring.append(owner)
+        q.append(job)
+        self._ready.release()
+
+    async def _worker(self) -> None:
+        while True:
+            await self._ready.acquire()
+            owner = self._ring.popleft()
+            q = self._queues[owner]
+            job = q.popleft()
+            if q:
+                self._ring.append(owner)
+            else:
+                del self._queues[owner]
+            try:
+                await job()
             except Exception as e:
-                last_err = f"exc {type(e).__name__}: {e}"
-                log.warning(f"[inv_fast] uid={uid} type={asset_type} {last_err}, attempt={attempt}")
-                await _sleep_backoff(attempt)
+                log.error(f"[inv_sched] job failed owner={owner}: {type(e).__name__}: {e}")
 
-        if not ok:
-            log.error(f"[inv_fast] uid={uid} type={asset_type} giving up; collected={len(items)}")
-            return items
 
-        # следующая страница?
-        if not cursor:
-            break
-
-    # uniq
-    seen = set()
-    out: List[int] = []
-    for a in items:
-        if a not in seen:
-            out.append(a)
-            seen.add(a)
-    log.info(
-        f"[inv_fast] end uid={uid} type={asset_type} collected={len(items)} uniq={len(out)} dt={time.time() - t_start:.3f}s")
-    return out
+_INV_SCHEDULER = _InventoryPageScheduler(INV_GLOBAL_CONCURRENCY)
 
 
-async def fetch_full_inventory_parallel_fast(uid: int, asset_types: List[int], cookie: Optional[str]) -> Dict[
-    int, List[int]]:
+async def _schedule_inventory(
+        uid: int,
+        asset_types: List[int],
+        cookie: Optional[str],
+        *,
+        limit: int = INV_BATCH_SIZE,
+        deadline: Optional[float] = None,
+        on_page: Optional[Callable[[int, List[int]], None]] = None,
+        known: Optional[Dict[int, set]] = None,
+        on_type_done: Optional[Callable[[int], None]] = None,
+) -> Dict[int, dict]:
     """
-    БЫСТРАЯ версия - грузит типы ассетов чанками с ограничением параллелизма
+    Качает все страницы asset_types через _INV_SCHEDULER.
+    Одновременно активны не больше INV_PARALLEL_TYPES типов этого юзера (у типа в полёте максимум одна страница),
+    остальные типы стартуют по мере завершения. Возвращает {type: {"ids", "pages", "truncated", "reason", "synced"}}.
+    known — delta-режим: {type: assetIds с прошлого раза}; страницы идут от новых к старым, поэтому на первом
+    знакомом assetId тип останавливается (synced=True), а в ids попадает только то, что было до него.
+    on_type_done(type) — тип докачан (или брошен): новых страниц по нему не будет.
     """
-    sem = asyncio.Semaphore(INV_PARALLEL_TYPES)
-
-    async def task(t: int):
-        async with sem:
+    types = list(dict.fromkeys(int(t) for t in asset_types))
+    known = known or {}
+    state: Dict[int, dict] = {t: {"ids": [], "seen": set(), "pages": 0, "reason": None, "synced": False}
+                              for t in types}
+    if not types:
+        return {}
+    pending = deque(types)
+    remaining = len(types)
+    done = asyncio.Event()
+    aborted = False
+
+    def _finish(t: int) -> None:
+        nonlocal remaining
+        remaining -= 1
+        if on_type_done is not None:
             try:
-                t0 = time.time()
-                log.info(f"[inv_par_fast] start uid={uid} type={t}")
-                lst = await _get_inventory_pages_fast(uid, t, cookie, limit=INV_BATCH_SIZE)
-                log.info(f"[inv_par_fast] done uid={uid} type={t} items={len(lst)} dt={time.time() - t0:.3f}s")
-                return (t, lst)
+                on_type_done(t)
             except Exception as e:
-                log.error(f"[inv_par_fast] crashed uid={uid} type={t}: {e}")
-                return (t, [])
+                log.warning(f"[inv_fast] on_type_done failed uid={uid} type={t}: {e}")
+        if pending and not aborted:
+            _start(pending.popleft())
+        if remaining == 0:
+            done.set()
+
+    def _start(t: int, cursor: Optional[str] = None) -> None:
+        _INV_SCHEDULER.submit(uid, lambda: _page(t, cursor))
+
+    async def _page(t: int, cursor: Optional[str]) -> None:
+        st = state[t]
+        try:
+            if aborted:
+                st["reason"] = "cancelled"
+                _finish(t)
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                st["reason"] = "budget"
+                log.warning(f"[inv_fast] uid={uid} type={t} budget exhausted after {st['pages']} pages")
+                _finish(t)
+                return
+
+            ids, nxt, err = await _fetch_inventory_page(uid, t, cookie, cursor, limit, st["pages"])
+            if err:
+                # первая страница с фаталом (нет доступа/нет типа) — это не обрезка, а пустой тип
+                if not (err == "fatal" and st["pages"] == 0):
+                    st["reason"] = err
+                _finish(t)
+                return
+
+            st["pages"] += 1
+            seen_before = known.get(t)
+            if seen_before:
+                cut = next((i for i, a in enumerate(ids) if a in seen_before), None)
+                if cut is not None:
+                    ids, nxt = ids[:cut], None
+                    st["synced"] = True
+            fresh = [a for a in ids if a not in st["seen"]]
+            st["seen"].update(fresh)
+            st["ids"].extend(fresh)
+            if fresh and on_page is not None:
+                try:
+                    on_page(t, fresh)
+                except Exception as e:
+                    log.warning(f"[inv_fast] on_page failed uid={uid} type={t}: {e}")
+
+            if nxt and not aborted:
+                _start(t, nxt)
+            else:
+                _finish(t)
+        except Exception as e:
+            log.error(f"[inv_fast] uid={uid} type={t} crashed: {type(e).__name__}: {e}")
+            st["reason"] = "error"
+            _finish(t)
+
+    for _ in range(min(max(1, INV_PARALLEL_TYPES), len(types))):
+        _start(pending.popleft())
+    try:
+        await done.wait()
+    finally:
+        # вызывающего отменили (wait_for и т.п.) — оставшиеся страницы не качаем
+        aborted = True
+
+    return {
+        t: {"ids": st["ids"], "pages": st["pages"], "truncated": st["reason"] is not None,
+            "reason": st["reason"], "synced": st["synced"]}
+        for t, st in state.items()
+    }
+
 
-    # Разбиваем на чанки для лучшего контроля
-    chunks = [asset_types[i:i + INV_PARALLEL_TYPES] for i in range(0, len(asset_types), INV_PARALLEL_TYPES)]
-    all_results = {}
+async def _get_inventory_pages_fast(
+        uid: int,
+        asset_type: int,
+        cookie: Optional[str],
+        limit: int = INV_BATCH_SIZE,
+        *,
+        deadline: Optional[float] = None,
+        on_page: Optional[Callable[[List[int]], None]] = None,
+        meta: Optional[dict] = None,
+) -> List[int]:
+    """
+    Идёт по nextPageCursor до конца (без лимита страниц), пока не истёк deadline (time.monotonic()).
+    on_page(new_ids) вызывается на каждую страницу с ещё не встречавшимися assetId —
+    чтобы детали каталога грузились, пока качаются следующие страницы.
+    В meta пишется {"pages", "truncated", "reason"}: truncated=True, если курсор остался недокачанным
+    (reason="budget" — кончилось время, "error" — страница так и не загрузилась).
+    Страницы идут через общую очередь _INV_SCHEDULER.
+    """
+    t_start = time.time()
+    log.info(f"[inv_fast] begin uid={uid} type={asset_type} limit={limit}")
+    res = await _schedule_inventory(
+        uid, [asset_type], cookie, limit=limit, deadline=deadline,
+        on_page=(lambda _t, ids: on_page(ids)) if on_page else None,
+    )
+    st = res[int(asset_type)]
+    if meta is not None:
+        meta.update(pages=st["pages"], truncated=st["truncated"], reason=st["reason"])
+    log.info(
+        f"[inv_fast] end uid={uid} type={asset_type} pages={st['pages']} uniq={len(st['ids'])} "
+        f"truncated={st['reason'] or False} dt={time.time() - t_start:.3f}s")
+    return st["ids"]
 
-    for chunk in chunks:
-        chunk_results = await asyncio.gather(*[task(t) for t in chunk])
-        for t, lst in chunk_results:
-            if lst:
-                all_results[t] = lst
-        # Небольшая пауза между чанками
-        await asyncio.sleep(0.05)
 
-    return all_results
+async def fetch_full_inventory_parallel_fast(
+        uid: int,
+        asset_types: List[int],
+        cookie: Optional[str],
+        *,
+        budget: Optional[float] = None,
+        on_page: Optional[Callable[[int, List[int]], None]] = None,
+        meta: Optional[dict] = None,
+        on_type_done: Optional[Callable[[int], None]] = None,
+) -> Dict[int, List[int]]:
+    """
+    Все типы ассетов юзера через общую очередь страниц (см. _InventoryPageScheduler).
+    budget — общий бюджет времени на юзера (по умолчанию INV_USER_BUDGET), on_page(asset_type, ids) —
+    поток страниц, on_type_done(asset_type) — тип закончен,
+    meta["truncated"]/meta["truncatedTypes"] — какие типы докачать не успели.
+    """
+    t0 = time.time()
+    deadline = time.monotonic() + (INV_USER_BUDGET if budget is None else float(budget))
+    res = await _schedule_inventory(uid, asset_types, cookie, deadline=deadline, on_page=on_page,
+                                    on_type_done=on_type_done)
+
+    truncated_types = sorted(t for t, st in res.items() if st["truncated"])
+    if meta is not None:
+        meta["truncated"] = bool(truncated_types)
+        meta["truncatedTypes"] = truncated_types
+    if truncated_types:
+        log.warning(f"[inv_par_fast] uid={uid} truncated types={truncated_types}")
+    log.info(f"[inv_par_fast] done uid={uid} types={len(res)} "
+             f"items={sum(len(st['ids']) for st in res.values())} dt={time.time() - t0:.3f}s")
+    return {t: st["ids"] for t, st in res.items() if st["ids"]}
 
 
 async def _post_catalog_details_once(items, cookie, proxy, csrf=None):
@@ -399,83 +594,226 @@ async def _catalog_batch_fast(items, cookie, retries: int) -> List[Dict[str, Any
     return []
 
 
-# ==== Local price cache (prices.csv) ====
-_price_cache = None
-
+class _CatalogDetailsAggregator:
+    """
+    Общий на процесс сборщик запросов деталей каталога перед _catalog_batch_fast.
+    assetId от всех одновременных вызовов складываются в одну очередь без повторов (уже запрошенный id
+    ждёт тот же результат), полные батчи по BATCH_SIZE уходят сразу, остаток — через CATALOG_AGG_WINDOW_MS.
+    Результат раздаётся каждому ждущему. Батч идёт с кукой первого запросившего (детали от куки не зависят).
+    """
 
-def _load_prices_csv(path: str = PRICE_DUMP_PATH):
-    global _price_cache
-    if _price_cache is not None:
-        return _price_cache
-    _price_cache = {}
-    try:
-        if not os.path.exists(path):
-            return _price_cache
-        with open(path, "r", encoding="utf-8") as f:
-            import csv as _csv
-            r = _csv.DictReader(f)
-            for row in r:
+    def __init__(self, window_ms: float):
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self._pending: deque = deque()  # (assetId, cookie) ещё не отправленные
+        self._futures: Dict[int, asyncio.Future] = {}  # assetId -> результат (в очереди или в полёте)
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._tasks: set = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _bind(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # новый event loop (скрипты с asyncio.run) — старые future к нему не относятся
+            self._loop = loop
+            self._pending.clear()
+            self._futures.clear()
+            self._tasks.clear()
+            self._timer = None
+            self._sem = asyncio.Semaphore(CATALOG_CONCURRENCY)
+        return loop
+
+    async def fetch(self, asset_ids: List[int], cookie: Optional[str]) -> List[Dict[str, Any]]:
+        loop = self._bind()
+        futs: List[asyncio.Future] = []
+        for aid in dict.fromkeys(int(a) for a in asset_ids):
+            fut = self._futures.get(aid)
+            if fut is None:
+                fut = self._futures[aid] = loop.create_future()
+                self._pending.append((aid, cookie))
+            futs.append(fut)
+        while len(self._pending) >= BATCH_SIZE:
+            self._send()
+        if self._pending and self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        if not futs:
+            return []
+        # asyncio.wait, а не gather: отмена одного вызывающего не должна отменять общий результат
+        await asyncio.wait(futs)
+        return [f.result() for f in futs if f.result() is not None]
+
+    def _flush(self) -> None:
+        self._timer = None
+        while self._pending:
+            self._send()
+
+    def _send(self) -> None:
+        batch = [self._pending.popleft() for _ in range(min(BATCH_SIZE, len(self._pending)))]
+        ids = [aid for aid, _ in batch]
+        cookie = next((c for _, c in batch if c), None)
+        task = self._loop.create_task(self._run(ids, cookie))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, ids: List[int], cookie: Optional[str]) -> None:
+        res: List[Dict[str, Any]] = []
+        try:
+            async with self._sem:
+                res = await _catalog_batch_fast([{"id": aid, "itemType": "Asset"} for aid in ids], cookie,
+                                                CATALOG_RETRIES)
+        except Exception as e:
+            log.warning(f"[catalog_agg] batch of {len(ids)} failed: {type(e).__name__}: {e}")
+        finally:
+            got: Dict[int, Dict[str, Any]] = {}
+            for d in res or []:
                 try:
-                    aid = int(row.get("assetId") or row.get("id") or 0)
-                    if not aid:
-                        continue
-                    price_raw = row.get("price") or row.get("lowestPrice") or "0"
-                    price = int(float(price_raw)) if str(price_raw).strip() else 0
-                    col_raw = (row.get("Collectible") or row.get("collectible") or "").strip().lower()
-                    collectible = col_raw in ("1", "true", "yes")
-                    _price_cache[aid] = {"price": price, "collectible": collectible}
+                    got[int(d.get("id"))] = d
                 except Exception:
                     continue
-    except Exception as e:
-        logging.warning(f"prices.csv load failed: {e}")
-    return _price_cache
+            for aid in ids:
+                fut = self._futures.pop(aid, None)
+                if fut is not None and not fut.done():
+                    fut.set_result(got.get(aid))
+        log.info(f"[catalog_agg] batch size={len(ids)} got={len(got)}")
 
 
-def _ensure_prices_csv_header(path: str) -> None:
-    try:
-        need_header = not os.path.exists(path) or os.path.getsize(path) == 0
-        if need_header:
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            with open(path, "a", encoding="utf-8", newline="") as f:
-                w = csv.writer(f)
-                w.writerow(["id", "name", "price", "collectible"])
-    except Exception as e:
-        log.warning(f"prices.csv header init failed: {e}")
+_CATALOG_AGG = _CatalogDetailsAggregator(CATALOG_AGG_WINDOW_MS)
 
 
-def _append_prices_csv_bulk(details: list, path: str = PRICE_DUMP_PATH) -> int:
-    """Append fetched price details to CSV (id,name,price,collectible) if missing in local cache."""
-    try:
-        _ensure_prices_csv_header(path)
-        local = _load_prices_csv(path)
-        cnt = 0
-        with open(path, "a", encoding="utf-8", newline="") as f:
-            w = csv.writer(f)
-            for d in details:
-                try:
-                    aid = int(d.get("id") or 0)
-                    if not aid or aid in local:
-                        continue
-                    price = _price_pick(d)
-                    name = str(d.get("name") or "").strip()
-                    collectible = 1 if _is_collectible(d) else 0
-                    w.writerow([aid, name, price, collectible])
-                    local[aid] = {"price": price, "collectible": bool(collectible)}
-                    _price_log(f"[CSV_APPEND] id={aid} price={price} collectible={collectible}")
-                    cnt += 1
-                except Exception:
-                    continue
-        return cnt
-    except Exception as e:
-        log.warning(f"prices.csv append failed: {e}")
-        return 0
+# ==== Local price cache (price_store) ====
+class _PriceWriter:
+    """
+    Фоновая запись цен в price_store (и метаданных деталей в asset_meta): вызывающий только кладёт строки
+    в очередь (последняя по assetId выигрывает), пачка уходит через PRICE_WRITE_DELAY или сразу при
+    PRICE_WRITE_BATCH строках — одним upsert в потоке, не на event loop. flush() — дописать всё
+    (при остановке); при выходе интерпретатора остаток пишется синхронно (atexit).
+    """
+
+    def __init__(self, delay: float, max_batch: int):
+        self.delay = max(0.0, float(delay))
+        self.max_batch = max(1, int(max_batch))
+        self._pending: Dict[int, tuple] = {}  # assetId -> (assetId, name, price, collectible, fetched_at)
+        self._meta: Dict[int, Dict[str, Any]] = {}  # assetId -> поля asset_meta
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def put(self, rows: List[tuple], meta: Optional[Dict[int, Dict[str, Any]]] = None) -> int:
+        now = time.time()
+        for aid, name, price, collectible in rows:
+            self._pending[aid] = (aid, name, price, collectible, now)
+        for aid, rec in (meta or {}).items():
+            self._meta.setdefault(aid, {}).update(rec)
+        if not self._pending:
+            return 0
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_sync()
+            return len(rows)
+        if loop is not self._loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._wake = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        if len(self._pending) >= self.max_batch:
+            self._wake.set()
+        return len(rows)
+
+    def _take(self) -> List[tuple]:
+        batch, self._pending = self._pending, {}
+        meta, self._meta = self._meta, {}
+        return [(list(batch.values()), meta)] if batch or meta else []
+
+    @staticmethod
+    def _write(batch: List[tuple]) -> int:
+        n = 0
+        for rows, meta in batch:
+            if rows:
+                # fetched_at в одной пачке почти одинаковый — берём самый ранний, свежесть это не завышает
+                ts = min(r[4] for r in rows)
+                n += price_store.upsert_many((r[:4] for r in rows), source="catalog", fetched_at=ts)
+            if meta:
+                asset_meta.put_many(meta)
+        if n:
+            _price_log(f"[PRICE_STORE] upserted {n} prices")
+        return n
+
+    async def _run(self) -> None:
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            batch = self._take()
+            if not batch:
+                continue
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception as e:
+                log.warning(f"[PRICE_STORE] write failed: {type(e).__name__}: {e}")
+
+    async def flush(self) -> int:
+        """Дописывает очередь и ждёт текущую запись. Возвращает, сколько строк было в очереди."""
+        queued = len(self._pending)
+        task = self._task
+        if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+            self._wake.set()
+            await asyncio.wait([task])
+        batch = self._take()
+        if batch:
+            await asyncio.to_thread(self._write, batch)
+        return queued
+
+    def flush_sync(self) -> int:
+        batch = self._take()
+        if not batch:
+            return 0
+        try:
+            return self._write(batch)
+        except Exception as e:
+            log.warning(f"[PRICE_STORE] write failed: {type(e).__name__}: {e}")
+            return 0
+
+
+_PRICE_WRITER = _PriceWriter(PRICE_WRITE_DELAY, PRICE_WRITE_BATCH)
+atexit.register(_PRICE_WRITER.flush_sync)
+
+
+async def flush_price_writes() -> int:
+    """Дописывает отложенные цены в price_store (вызывать при остановке бота/скрипта)."""
+    return await _PRICE_WRITER.flush()
+
+
+def _store_prices_bulk(details: list) -> int:
+    """Ставит цены и метаданные из деталей каталога в очередь записи (см. _PriceWriter)."""
+    fresh = []
+    for d in details:
+        try:
+            aid = int(d.get("id") or 0)
+        except Exception:
+            continue
+        if aid and not d.get("_from_store"):
+            fresh.append((aid, d))
+    # цены всей пачки — одной колонкой (inventory_pricing.pick_prices), а не _price_pick на каждый dict
+    picked = inventory_pricing.pick_prices([d for _, d in fresh])
+    rows = [(aid, str(d.get("name") or "").strip(), int(p), asset_meta.is_collectible(d)) for (aid, d), p in zip(fresh, picked)]
+    return _PRICE_WRITER.put(rows, asset_meta.records_from_catalog(details))
+
+
+def _read_local_prices(asset_ids: List[int]) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, Dict[str, Any]]]:
+    prices = price_store.get_many(asset_ids, max_age=price_store.PRICE_TTL)
+    meta = asset_meta.get_many(prices, ("asset_type",)) if prices else {}
+    return prices, meta
 
 
 async def fetch_catalog_details_fast(asset_ids: List[int], cookie: Optional[str]) -> List[Dict[str, Any]]:
     if not asset_ids:
         return []
 
-    local_prices = _load_prices_csv()
+    # свежие (не старше PRICE_TTL) цены из price_store — без запроса в каталог;
+    # хранилища синхронные и делят блокировку с фоновым писателем, поэтому читаем в потоке
+    local_prices, local_meta = await asyncio.to_thread(_read_local_prices, asset_ids)
     found_local = []
     need_fetch = []
 
@@ -494,57 +832,87 @@ async def fetch_catalog_details_fast(asset_ids: List[int], cookie: Optional[str]
             found_local.append({
                 "id": aid,
                 "itemType": "Asset",
+                "name": pinfo.get("name", ""),
                 "price": pinfo.get("price", 0),
                 "lowestPrice": pinfo.get("price", 0),
                 "itemRestrictions": ["Collectible"] if pinfo.get("collectible") else [],
+                "_from_store": True,
             })
+            if "asset_type" in local_meta.get(aid, {}):
+                found_local[-1]["assetType"] = local_meta[aid]["asset_type"]
         else:
             need_fetch.append(aid)
 
     out = []
     if need_fetch:
-        sem = asyncio.Semaphore(CATALOG_CONCURRENCY)
-
-        async def run(items):
-            async with sem:
-                return await _catalog_batch_fast(items, cookie, CATALOG_RETRIES)
-
-        tasks = []
-        for i in range(0, len(need_fetch), BATCH_SIZE):
-            items = [{"id": int(aid), "itemType": "Asset"} for aid in need_fetch[i:i + BATCH_SIZE]]
-            tasks.append(asyncio.create_task(run(items)))
-
-        res = await asyncio.gather(*tasks, return_exceptions=True)
-        for r in res:
-            if isinstance(r, list):
-                out.extend(r)
+        # батчи общие с другими одновременными вызовами (см. _CatalogDetailsAggregator)
+        out.extend(await _CATALOG_AGG.fetch(need_fetch, cookie))
 
     # append local cached results last (or merge if duplicates)
     if found_local:
         out.extend(found_local)
 
-    # persist fetched prices to CSV (skip ones already present)
+    # запись цен — в фоне, пачками (upsert обновляет и устаревшие)
     try:
-        _append_prices_csv_bulk(out, path=PRICE_DUMP_PATH)
-    except Exception:
-        pass
+        _store_prices_bulk(out)
+    except Exception as e:
+        log.warning(f"price_store write failed: {e}")
     return out
 
 
-def _norm_price(v) -> int:
-    try:
-        if v is None:
-            return 0
-        if isinstance(v, (int, float)):
-            return int(v)
-        if isinstance(v, str):
-            s = v.strip().replace(",", ".").replace(" ", "")
-            for token in ("R$", "₽", "RBX", "robux", "руб", "$"):
-                s = s.replace(token, "")
-            return int(float(s))
-    except Exception:
+async def refresh_hot_prices(budget: Optional[int] = None) -> int:
+    """
+    Один проход фонового обновления: самые показываемые ассеты (price_store.note_views), чья цена старше
+    PRICE_REFRESH_AGE, перезапрашиваются в каталоге полными батчами по BATCH_SIZE — не больше budget батчей.
+    Неполный последний батч добирается следующими по популярности ассетами с самой старой ценой.
+    Возвращает число обновлённых цен.
+    """
+    budget = PRICE_REFRESH_BATCHES if budget is None else int(budget)
+    if budget <= 0:
         return 0
-    return 0
+    hot = await asyncio.to_thread(price_store.hot_assets, budget * BATCH_SIZE * 4)
+    if not hot:
+        return 0
+    known = await asyncio.to_thread(price_store.get_many, hot)
+    now = time.time()
+    age = {aid: now - known.get(aid, {}).get("fetched_at", 0.0) for aid in hot}
+    stale = [aid for aid in hot if age[aid] >= PRICE_REFRESH_AGE]
+    if not stale:
+        return 0
+    n_batches = min(budget, -(-len(stale) // BATCH_SIZE))
+    picked = stale[:n_batches * BATCH_SIZE]
+    if len(picked) % BATCH_SIZE:
+        taken = set(picked)
+        rest = sorted((aid for aid in hot if aid not in taken), key=age.__getitem__, reverse=True)
+        picked += rest[:BATCH_SIZE - len(picked) % BATCH_SIZE]
+
+    updated = 0
+    for i in range(0, len(picked), BATCH_SIZE):
+        ids = picked[i:i + BATCH_SIZE]
+        try:
+            details = await _catalog_batch_fast([{"id": aid, "itemType": "Asset"} for aid in ids], None,
+                                                CATALOG_RETRIES)
+            updated += _store_prices_bulk(details)
+        except Exception as e:
+            log.warning(f"[PRICE_REFRESH] batch of {len(ids)} failed: {type(e).__name__}: {e}")
+    log.info(f"[PRICE_REFRESH] hot={len(hot)} stale={len(stale)} sent={len(picked)} updated={updated}")
+    return updated
+
+
+async def schedule_price_refresh(interval: Optional[int] = None) -> None:
+    """Фоновая задача: раз в interval секунд гасит счётчики популярности и обновляет горячие цены."""
+    every = PRICE_REFRESH_INTERVAL if interval is None else int(interval)
+    while True:
+        await asyncio.sleep(every)
+        try:
+            await asyncio.to_thread(price_store.decay_views)
+            await refresh_hot_prices()
+        except Exception:
+            log.exception("[PRICE_REFRESH] failed")
+
+
+def _norm_price(v) -> int:
+    return inventory_pricing.norm_price(v)
 
 
 def _price_pick(detail: dict) -> int:
@@ -558,19 +926,6 @@ def _price_pick(detail: dict) -> int:
     return mx
 
 
-def _is_collectible(detail: dict) -> bool:
-    """Return True only if itemRestrictions explicitly contain 'Collectible'."""
-    if not isinstance(detail, dict):
-        return False
-    ir = detail.get("itemRestrictions") or []
-    if not isinstance(ir, list):
-        return False
-    try:
-        return any(str(x).strip().lower() == "collectible" for x in ir)
-    except Exception:
-        return False
-
-
 def _parse_asset_types_from_cfg() -> List[int]:
     ats = getattr(CFG, "ASSET_TYPES", None)
     if isinstance(ats, (list, tuple)) and ats:
@@ -616,48 +971,15 @@ async def get_social_links(uid: int) -> dict:
 
 
 async def get_total_spent_robux(uid: int, cookie: str) -> int:
-    """Return lifetime spent Robux based on Economy transactions."""
-    total = 0
-    cursor = None
-    pages = 0
-    consecutive_errors = 0
-    while pages < 2000:
-        proxy = PROXY_POOL.any()
-        client = await get_client(proxy)
-        try:
-            r = await client.get(
-                ECON_TX_URL.format(uid=uid),
-                params={"transactionType": "Purchase", "limit": 100, "cursor": cursor or ""},
-                headers=_cookie_headers(cookie),
-                timeout=httpx.Timeout(8.0, connect=1.5, read=6.5),
-            )
-            if r.status_code == 429:
-                await asyncio.sleep(0.6)
-                continue
-            if r.status_code in (401, 403):
-                # Not authorized / wrong cookie -> let caller decide, don't report 0
-                raise RuntimeError(f"Economy transactions auth failed: {r.status_code}")
-            r.raise_for_status()
-            js = r.json() or {}
-            pages += 1
-            consecutive_errors = 0
-            data = js.get("data") or []
-            for it in data:
-                try:
-                    amt = int(it.get("currencyAmount") or 0)
-                    if amt < 0:
-                        total += -amt
-                except Exception:
-                    pass
-            cursor = js.get("nextPageCursor")
-            if not cursor:
-                break
-        except Exception:
-            consecutive_errors += 1
-            if consecutive_errors >= 5:
-                break
-            await asyncio.sleep(0.3)
-            continue
+    """Return lifetime spent Robux based on Economy transactions (локальный журнал + досинхронизация)."""
+    try:
+        await sync_spending_ledger(uid, cookie)
+    except SpendingAuthError:
+        # Not authorized / wrong cookie -> let caller decide, don't report 0
+        raise
+    except Exception as e:
+        log.warning(f"[SPENDING] sync failed uid={uid}: {type(e).__name__}: {e}")
+    total, _ = await storage.get_spending_total(uid)
     return total
 
 
@@ -666,55 +988,267 @@ async def get_full_inventory(tg_id: int, roblox_id: int, force_refresh: bool = F
     Возвращает агрегированный инвентарь пользователя с ценами, сгруппированный по категориям.
     """
     try:
-        enc = await storage.get_encrypted_cookie(tg_id, roblox_id)
-        if not enc:
+        cookie = await storage.get_user_cookie_plain(tg_id, roblox_id)
+        if not cookie:
             return {"total": 0, "byCategory": {}}
-        cookie = decrypt_text(enc)
     except Exception:
         return {"total": 0, "byCategory": {}}
 
-    return await _build_full_inventory_for_cookie(roblox_id, cookie, force_refresh=force_refresh)
+    return await _inventory_engine(roblox_id, _CookieSource(cookie), force_refresh=force_refresh)
 
 
 
-async def _build_full_inventory_for_cookie(roblox_id: int, cookie: str, force_refresh: bool = False) -> dict:
-    asset_types = _parse_asset_types_from_cfg()
-    ats_hash = hashlib.sha1(",".join(map(str, asset_types)).encode()).hexdigest()[:8]
-    cache_key = f"inv:{roblox_id}:{ats_hash}"
+async def _collect_inventory_streaming(roblox_id: int, asset_types: List[int], cookie: str,
+                                      on_batch: Optional[Callable[[int, List[dict], bool], None]] = None):
+    """
+    Шаги 1+2 пайплайна внахлёст: каждая скачанная страница assetId сразу уходит в fetch_catalog_details_fast,
+    пока следующие страницы ещё грузятся. Возвращает (per_type, by_id, meta), meta — как у
+    fetch_full_inventory_parallel_fast (truncated/truncatedTypes).
+    on_batch(asset_type, items, done) — готовые (с ценами) предметы страницы, как только пришли её детали;
+    done=True — по этому типу больше ничего не придёт (items при этом может быть пустым).
+    """
+    detail_tasks: List[asyncio.Task] = []
+    in_flight: Dict[int, int] = {}  # тип -> страниц, детали которых ещё грузятся
+    paged: set = set()  # типы, все страницы которых уже скачаны
 
-    if not force_refresh:
-        cached = await cache.get_json(cache_key, INV_TTL)
-        if cached:
-            return cached
+    def _emit(at: int, items: List[dict]) -> None:
+        done = at in paged and not in_flight.get(at)
+        if on_batch is not None and (items or done):
+            try:
+                on_batch(at, items, done)
+            except Exception as e:
+                log.warning(f"[inv_stream] on_batch failed uid={roblox_id} type={at}: {e}")
+
+    async def _details(at: int, ids: List[int]):
+        res: Any = []
+        try:
+            res = await fetch_catalog_details_fast(ids, cookie)
+            return res
+        finally:
+            in_flight[at] -= 1
+            if on_batch is not None:
+                got = {int(d["id"]): d for d in (res if isinstance(res, list) else []) if d.get("id") is not None}
+                _emit(at, [_inventory_item(aid, at, got[int(aid)]) for aid in ids if got.get(int(aid))])
+
+    def _on_page(at: int, ids: List[int]) -> None:
+        in_flight[at] = in_flight.get(at, 0) + 1
+        detail_tasks.append(asyncio.create_task(_details(at, ids)))
+
+    def _on_type_done(at: int) -> None:
+        paged.add(at)
+        _emit(at, [])
+
+    meta: dict = {}
+    try:
+        per_type = await fetch_full_inventory_parallel_fast(roblox_id, asset_types, cookie, on_page=_on_page,
+                                                            meta=meta, on_type_done=_on_type_done)
+    except BaseException:
+        for t in detail_tasks:
+            t.cancel()
+        raise
+
+    by_id: Dict[int, Dict[str, Any]] = {}
+    for res in await asyncio.gather(*detail_tasks, return_exceptions=True):
+        if isinstance(res, list):
+            for d in res:
+                if d.get("id") is not None:
+                    by_id[int(d.get("id"))] = d
+    return per_type, by_id, meta
+
+
+def _truncation_fields(meta: dict) -> dict:
+    """Поля результата об обрезке по бюджету времени (пусто, если инвентарь докачан полностью)."""
+    if not meta.get("truncated"):
+        return {}
+    return {"truncated": True, "truncatedTypes": list(meta.get("truncatedTypes") or [])}
 
-    # 1) собираем assetIds по всем типам параллельно (БЫСТРАЯ версия)
-    per_type = await fetch_full_inventory_parallel_fast(roblox_id, asset_types, cookie)
-    all_ids = [a for ids in per_type.values() for a in ids]
-    if not all_ids:
-        data = {"total": 0, "byCategory": {}}
-        await cache.set_json(cache_key, data)
-        return data
 
-    # 2) тянем детали по всем assetId
-    details = await fetch_catalog_details_fast(all_ids, cookie)
-    by_id = {int(d.get("id")): d for d in details if d.get("id") is not None}
+def _inv_price_pick(detail: dict) -> int:
+    try:
+        p = detail.get("price")
+        lp = detail.get("lowestPrice")
+        lrp = detail.get("lowestResalePrice")
+        for v in (p, lp, lrp):
+            if v is not None:
+                return int(v)
+    except Exception:
+        pass
+    return 0
+
+
+def _inventory_item(aid: int, asset_type: int, detail: dict) -> dict:
+    return {
+        "assetId": int(aid),
+        "priceInfo": {"value": int(_inv_price_pick(detail))},  # 0 если цены нет
+        "name": detail.get("name") or "",
+        "assetType": int(asset_type),
+        'itemId': _to_int(detail.get('itemId') or detail.get('collectibleItemId') or 0),
+    }
+
+
+def _inventory_sync_key(roblox_id: int, ats_hash: str) -> str:
+    # assetIds по типам (новые первыми) с последней полной загрузки — база для delta-refresh
+    return f"invsync:{roblox_id}:{ats_hash}"
+
+
+_INV_EMPTY_KEEP = 30 * 86400  # сколько помним пустые типы юзера, сек
+
+
+def _inventory_empty_key(roblox_id: int) -> str:
+    # {asset_type: когда последний раз тип оказался пустым} — по roblox_id, общий для всех наборов типов
+    return f"invempty:{roblox_id}"
+
+
+async def _active_asset_types(roblox_id: int, asset_types: List[int]) -> List[int]:
+    """Типы для интерактивной загрузки: без тех, что недавно (< INV_EMPTY_RECHECK) оказались пустыми."""
+    if INV_EMPTY_RECHECK <= 0:
+        return list(asset_types)
+    empty = await cache.get_json(_inventory_empty_key(roblox_id), _INV_EMPTY_KEEP) or {}
+    now = time.time()
+    return [t for t in asset_types if now - float(empty.get(str(t)) or 0) >= INV_EMPTY_RECHECK]
+
+
+async def _remember_empty_types(roblox_id: int, checked: List[int], empty: List[int]) -> None:
+    """checked — типы, докачанные до конца; из них empty запоминаются пустыми, остальные из списка убираются."""
+    key = _inventory_empty_key(roblox_id)
+    state = await cache.get_json(key, _INV_EMPTY_KEEP) or {}
+    now = time.time()
+    empty_set = {int(t) for t in empty}
+    for t in checked:
+        if int(t) in empty_set:
+            state[str(int(t))] = now
+        else:
+            state.pop(str(int(t)), None)
+    await cache.set_json(key, state)
+
+
+async def _delta_refresh_inventory(roblox_id: int, asset_types: List[int], cookie: str,
+                                   cache_key: str, sync_key: str) -> Optional[dict]:
+    """
+    Delta-sync: по каждому типу качаем страницы (sortOrder=Desc) только до первого уже известного assetId,
+    цены тянем только для новых assetId и вливаем их в закэшированный инвентарь.
+    Обычно это одна страница на тип. Возвращает None, если нужна полная загрузка: нет базы,
+    база обрезана по бюджету, прошло INV_FULL_RESYNC_TTL (продажи/удаления delta не видит) или delta не докачалась.
+    """
+    sync = await cache.get_json(sync_key, INV_FULL_RESYNC_TTL)
+    base = await _load_inventory(cache_key, INV_FULL_RESYNC_TTL)
+    if not sync or not isinstance(base, dict) or base.get("truncated"):
+        return None
+    if time.time() - float(sync.get("full_at") or 0) > INV_FULL_RESYNC_TTL:
+        return None
+    prev: Dict[int, List[int]] = {int(t): [int(a) for a in ids] for t, ids in (sync.get("types") or {}).items()}
+    known = {t: set(ids) for t, ids in prev.items()}
+
+    detail_tasks: List[asyncio.Task] = []
+
+    def _on_page(at: int, ids: List[int]) -> None:
+        new = [a for a in ids if a not in known.get(at, ())]
+        if new:
+            detail_tasks.append(asyncio.create_task(fetch_catalog_details_fast(new, cookie)))
+
+    t0 = time.time()
+    res = await _schedule_inventory(
+        roblox_id, asset_types, cookie,
+        deadline=time.monotonic() + INV_USER_BUDGET, on_page=_on_page, known=known,
+    )
+    by_id: Dict[int, Dict[str, Any]] = {}
+    for r in await asyncio.gather(*detail_tasks, return_exceptions=True):
+        if isinstance(r, list):
+            for d in r:
+                if d.get("id") is not None:
+                    by_id[int(d.get("id"))] = d
+    if any(st["truncated"] for st in res.values()):
+        log.info(f"[inv_delta] uid={roblox_id} incomplete delta, falling back to full fetch")
+        return None
+
+    # типы, которые сейчас не качали (пропущены как пустые), остаются как были
+    fetched = {int(x) for x in asset_types}
+    merged: Dict[int, List[int]] = {t: ids for t, ids in prev.items() if t not in fetched}
+    replaced: Dict[int, set] = {}  # типы без якоря: список скачан целиком, старые отсутствующие — удалены
+    new_items: Dict[str, list] = {}
+    unresolved = 0
+    for t in asset_types:
+        t = int(t)
+        st = res.get(t) or {"ids": [], "synced": False}
+        fresh = st["ids"]
+        old = prev.get(t, [])
+        if st["synced"]:
+            fresh_set = set(fresh)
+            merged[t] = fresh + [a for a in old if a not in fresh_set]
+        else:
+            merged[t] = fresh
+            if old:
+                replaced[t] = set(fresh)
+        cat = _canon_cat(ASSET_TYPE_TO_CATEGORY.get(t, "Other"))
+        if not cat:
+            continue
+        for aid in fresh:
+            if aid in known.get(t, ()):
+                continue
+            d = by_id.get(aid)
+            if d:
+                new_items.setdefault(cat, []).append(_inventory_item(aid, t, d))
+            else:
+                unresolved += 1
+    if unresolved:
+        # id без деталей нельзя записывать в invsync: следующая delta сочтёт его известным,
+        # и предмет пропадёт до полной пересборки — поэтому сразу полная загрузка
+        log.info(f"[inv_delta] uid={roblox_id} details missing for {unresolved} new items, falling back to full fetch")
+        return None
+
+    by_cat: Dict[str, list] = {}
+    for cat, arr in (base.get("byCategory") or {}).items():
+        kept = [it for it in arr
+                if int(it.get("assetType") or 0) not in replaced
+                or int(it.get("assetId") or 0) in replaced[int(it.get("assetType") or 0)]]
+        by_cat[cat] = new_items.pop(cat, []) + kept
+    for cat, arr in new_items.items():
+        by_cat[cat] = arr
+    by_cat = {c: arr for c, arr in by_cat.items() if arr}
+
+    # сам инвентарь в cache_key пишет движок (_store_inventory)
+    data = {"total": sum(len(arr) for arr in by_cat.values()), "byCategory": by_cat}
+    if data["total"]:
+        await _remember_empty_types(roblox_id, asset_types, [t for t in asset_types if not merged.get(int(t))])
+    await cache.set_json(sync_key, {"full_at": sync.get("full_at"), "types": {str(t): ids for t, ids in merged.items()}})
+    log.info(f"[inv_delta] uid={roblox_id} new={sum(len(v['ids']) for v in res.values())} "
+             f"pages={sum(v['pages'] for v in res.values())} total={data['total']} dt={time.time() - t0:.3f}s")
+    return data
+
+
+async def _build_inventory_with_cookie(roblox_id: int, cookie: str, asset_types: List[int],
+                                      cache_key: str, sync_key: str, *, delta: bool,
+                                      on_batch: Optional[Callable[[int, List[dict], bool], None]] = None) -> dict:
+    """
+    Одна сборка инвентаря одной кукой (без чтения кэша): delta-sync, если можно, иначе полная загрузка.
+    on_batch — поток готовых предметов полной загрузки (см. _collect_inventory_streaming); delta его не зовёт.
+    """
+    # недавно пустые типы не качаем (см. _active_asset_types), ключи кэша — по полному набору типов
+    active = await _active_asset_types(roblox_id, asset_types)
+    if len(active) < len(asset_types):
+        log.info(f"[INV_ENGINE] uid={roblox_id} skipping {len(asset_types) - len(active)} known-empty types")
+
+    if delta:
+        data = await _delta_refresh_inventory(roblox_id, active, cookie, cache_key, sync_key)
+        if data is not None:
+            return data
+
+    if on_batch is not None:
+        for t in asset_types:
+            if t not in active:
+                try:
+                    on_batch(int(t), [], True)
+                except Exception as e:
+                    log.warning(f"[inv_stream] on_batch failed uid={roblox_id} type={t}: {e}")
+
+    # 1+2) assetIds по всем типам и детали по ним — потоком, страница за страницей
+    per_type, by_id, meta = await _collect_inventory_streaming(roblox_id, active, cookie, on_batch=on_batch)
+    sync = {"full_at": time.time(), "types": {str(t): ids for t, ids in per_type.items()}}
 
     # 3) собираем по категориям
     by_cat: dict[str, list] = {}
     total_count = 0
 
-    def _price_pick_local(detail: dict) -> int:
-        try:
-            p = detail.get("price")
-            lp = detail.get("lowestPrice")
-            lrp = detail.get("lowestResalePrice")
-            for v in (p, lp, lrp):
-                if v is not None:
-                    return int(v)
-        except Exception:
-            pass
-        return 0
-
     for at, ids in per_type.items():
         cat = _canon_cat(ASSET_TYPE_TO_CATEGORY.get(int(at), "Other"))
         arr = []
@@ -724,93 +1258,278 @@ async def _build_full_inventory_for_cookie(roblox_id: int, cookie: str, force_re
             d = by_id.get(int(aid))
             if not d:
                 continue
-            price = _price_pick_local(d)  # 0 если цены нет
-            arr.append({
-                "assetId": int(aid),
-                "priceInfo": {"value": int(price)},
-                "name": d.get("name") or "",
-                "assetType": int(at),
-                'itemId': _to_int(d.get('itemId') or d.get('collectibleItemId') or 0),
-            })
+            arr.append(_inventory_item(aid, at, d))
         if arr:
             by_cat.setdefault(cat, []).extend(arr)
             total_count += len(arr)
 
-    data = {"total": int(total_count), "byCategory": by_cat}
-    await cache.set_json(cache_key, data)
+    data = {"total": int(total_count), "byCategory": by_cat, **_truncation_fields(meta)}
+    if total_count:
+        await cache.set_json(sync_key, sync)
+        # пустой результат не запоминаем: чужой куке инвентарь мог быть просто не виден
+        checked = [t for t in active if t not in set(meta.get("truncatedTypes") or [])]
+        await _remember_empty_types(roblox_id, checked, [t for t in checked if not per_type.get(t)])
     return data
 
 
-async def get_full_inventory_with_cookie(roblox_id: int, cookie: str | None, force_refresh: bool = False) -> dict:
+# ===================== ЕДИНЫЙ ДВИЖОК ИНВЕНТАРЯ =====================
+# Private (кука владельца), enc-кука и public (куки из БД) идут через _inventory_engine:
+# общий кэш inv:{roblox_id}:{hash типов}, singleflight на этот ключ, различается только источник кук.
+
+class _CookieSource:
+    """Источник кук для движка: одна заранее известная кука (владельца или переданная явно)."""
+
+    # пустой результат кэшируем: кука владельца видит всё, пусто — значит пусто
+    cache_empty = True
+
+    def __init__(self, cookie: Optional[str]):
+        self._cookie = cookie
+
+    async def cookies(self) -> List[str]:
+        return [self._cookie] if self._cookie else []
+
+    async def note_success(self, cookie: str) -> None:
+        pass
+
+
+class _EncryptedCookieSource(_CookieSource):
+    """Одна зашифрованная кука из БД (расшифровка через vault в storage)."""
+
+    def __init__(self, enc_cookie: str):
+        super().__init__(None)
+        self._enc = enc_cookie
+
+    async def cookies(self) -> List[str]:
+        cookie = await storage.decrypt_cookie_cached(self._enc)
+        return [cookie] if cookie else []
+
+
+async def _probe_cookie(roblox_id: int, cookie: str) -> Optional[bool]:
     """
-    Public helper to fetch full inventory using a raw .ROBLOSECURITY cookie.
-    Uses the same cache key and aggregation logic as get_full_inventory.
+    Дешёвая проба для public-режима: видит ли кука инвентарь roblox_id (один запрос can-view-inventory).
+    True — видит, False — точно нет (мёртвая кука или скрытый для неё инвентарь), None — непонятно (сеть/429/5xx).
     """
-    if not cookie:
-        return {"total": 0, "byCategory": {}}
-    return await _build_full_inventory_for_cookie(roblox_id, cookie, force_refresh=force_refresh)
+    client = await get_client(PROXY_POOL.any())
+    try:
+        t0 = time.time()
+        resp = await client.get(
+            CAN_VIEW_INVENTORY_URL.format(uid=roblox_id),
+            headers=_cookie_headers(cookie),
+            timeout=httpx.Timeout(PUBLIC_PROBE_TIMEOUT, connect=1.2),
+        )
+    except Exception as e:
+        log.info(f"[INV_PROBE] uid={roblox_id} probe failed: {type(e).__name__}: {e}")
+        return None
+    status = resp.status_code
+    if status != 403:
+        storage.note_cookie_result(cookie, status, (time.time() - t0) * 1000)
+    if status == 200:
+        try:
+            return bool((resp.json() or {}).get("canView"))
+        except Exception:
+            return None
+    if status in (401, 403):
+        return False
+    return None
 
-# === Helper: fetch inventory for a target Roblox ID using a provided ENCRYPTED cookie ===
-async def get_full_inventory_by_encrypted_cookie(enc_cookie: str, roblox_id: int, force_refresh: bool = False) -> dict:
-    """Try to fetch full inventory for *roblox_id* using the given encrypted cookie."""
+
+async def _race_cookie_probes(roblox_id: int, cookies: List[str], preferred: Optional[str] = None) -> List[str]:
+    """
+    Пробует все куки параллельно и возвращает порядок для полной загрузки: первая ответившая True —
+    первой, за ней те, чьи пробы не успели ответить (они отменяются), а отказавшие (False) — выкидываются.
+    preferred (привязанная к roblox_id) стартует с форой PUBLIC_PROBE_HEAD_START: если она жива,
+    остальные куки запросов не тратят.
+    Если ни одна проба не дала ответа (сеть), возвращает исходный порядок без отказавших.
+    """
+    if len(cookies) <= 1:
+        return list(cookies)
+
+    tasks: Dict[asyncio.Task, str] = {}
+    rejected: set = set()
+
+    def _start(batch: List[str]) -> None:
+        for c in batch:
+            tasks[asyncio.create_task(_probe_cookie(roblox_id, c))] = c
+
+    rest = [c for c in cookies if c != preferred]
+    if preferred in cookies:
+        _start([preferred])
+        done, _ = await asyncio.wait(list(tasks), timeout=PUBLIC_PROBE_HEAD_START)
+        for t in done:
+            ok = t.result()
+            if ok:
+                log.info(f"[INV_PROBE] uid={roblox_id} affine cookie won without race")
+                return [preferred] + rest
+            if ok is False:
+                rejected.add(preferred)
+    _start(rest)
+
+    winner: Optional[str] = None
+    pending = {t for t in tasks if not t.done()}
     try:
-        # Декодируем куки
-        cookie = decrypt_text(enc_cookie) if 'decrypt_text' in globals() else enc_cookie
-        if not cookie:
-            return {"total": 0, "byCategory": {}}
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                ok = t.result()
+                if ok and winner is None:
+                    winner = tasks[t]
+                elif ok is False:
+                    rejected.add(tasks[t])
+    finally:
+        for t in pending:
+            t.cancel()
+
+    if winner is None:
+        log.info(f"[INV_PROBE] uid={roblox_id} no probe succeeded ({len(rejected)}/{len(cookies)} rejected)")
+        return [c for c in cookies if c not in rejected]
+    log.info(f"[INV_PROBE] uid={roblox_id} winner {cookies.index(winner) + 1}/{len(cookies)}, "
+             f"rejected={len(rejected)}")
+    return [winner] + [c for c in cookies if c != winner and c not in rejected]
+
+
+class _PublicCookieSource(_CookieSource):
+    """
+    Чужие куки из БД для public-режима: привязанная к этому roblox_id (cookie_affinity, в памяти — _COOKIE_CACHE),
+    потом лучшие по cookie_health. Кандидаты пробуются параллельно (_race_cookie_probes), полная загрузка
+    идёт первой сработавшей. Пустой результат не кэшируем — чужой куке инвентарь может быть не виден.
+    """
 
-        # Используем ТОЧНО ТУ ЖЕ ЛОГИКУ, что и в get_full_inventory
-        asset_types = _parse_asset_types_from_cfg()
+    cache_empty = False
 
-        # 1) собираем assetIds по всем типам параллельно (БЫСТРАЯ версия)
-        per_type = await fetch_full_inventory_parallel_fast(roblox_id, asset_types, cookie)
-        all_ids = [a for ids in per_type.values() for a in ids]
-        if not all_ids:
-            return {"total": 0, "byCategory": {}}
+    def __init__(self, roblox_id: int, limit: int = PUBLIC_MODE_MAX_COOKIES):
+        super().__init__(None)
+        self._rid = int(roblox_id)
+        self._limit = int(limit)
+        self._enc_by_plain: Dict[str, str] = {}
+        self._affine: Optional[str] = None
 
-        # 2) тянем детали по всем assetId
-        details = await fetch_catalog_details_fast(all_ids, cookie)
-        by_id = {int(d.get("id")): d for d in details if d.get("id") is not None}
+    async def _affine_enc(self) -> Optional[str]:
+        cached = _COOKIE_CACHE.get(self._rid)
+        if cached and (time.time() - _COOKIE_CACHE_TIME.get(self._rid, 0)) < COOKIE_CACHE_TTL:
+            return cached
+        return await storage.get_cookie_affinity(self._rid)
+
+    async def cookies(self) -> List[str]:
+        encs: List[str] = []
+        affine_enc = await self._affine_enc()
+        if affine_enc:
+            encs.append(affine_enc)
+        try:
+            encs += [e for e in await storage.get_multiple_cookies_quick(limit=self._limit) if e not in encs]
+        except Exception as e:
+            log.warning(f"[INV_ENGINE] storage.get_multiple_cookies_quick failed: {e}")
+        out: List[str] = []
+        for enc in encs:
+            plain = await storage.decrypt_cookie_cached(enc)
+            if plain and plain not in self._enc_by_plain:
+                self._enc_by_plain[plain] = enc
+                out.append(plain)
+                if enc == affine_enc:
+                    self._affine = plain
+        ordered = await _race_cookie_probes(self._rid, out, self._affine)
+        if self._affine and self._affine not in ordered:
+            # привязанная кука больше не видит этот инвентарь
+            _COOKIE_CACHE.pop(self._rid, None)
+            _COOKIE_CACHE_TIME.pop(self._rid, None)
+            await storage.drop_cookie_affinity(self._rid)
+        return ordered
+
+    async def note_success(self, cookie: str) -> None:
+        enc = self._enc_by_plain.get(cookie)
+        if enc:
+            _COOKIE_CACHE[self._rid] = enc
+            _COOKIE_CACHE_TIME[self._rid] = time.time()
+            await storage.set_cookie_affinity(self._rid, cookie)
+
+
+_INV_BUILT_AT: Dict[str, float] = {}  # cache_key -> когда движок последний раз собрал инвентарь
+
+
+async def _load_inventory(cache_key: str, ttl: int) -> Optional[CompactInventory]:
+    """Инвентарь из кэша (бинарный CompactInventory; старые JSON-записи тоже читаются)."""
+    return CompactInventory.load(await cache.get_bytes(cache_key, ttl))
+
+
+async def _store_inventory(cache_key: str, data: dict) -> CompactInventory:
+    inv = CompactInventory.from_dict(data)
+    await cache.set_bytes(cache_key, inv.to_bytes())
+    return inv
+
+
+def _inventory_keys(roblox_id: int, asset_types: List[int]):
+    ats_hash = hashlib.sha1(",".join(map(str, asset_types)).encode()).hexdigest()[:8]
+    return f"inv:{roblox_id}:{ats_hash}", _inventory_sync_key(roblox_id, ats_hash)
 
-        # 3) собираем по категориям (ТОЧНО КАК В ОСНОВНОЙ ФУНКЦИИ)
-        by_cat: dict[str, list] = {}
-        total_count = 0
 
-        def _price_pick_local(detail: dict) -> int:
-            try:
-                p = detail.get("price")
-                lp = detail.get("lowestPrice")
-                lrp = detail.get("lowestResalePrice")
-                for v in (p, lp, lrp):
-                    if v is not None:
-                        return int(v)
-            except Exception:
-                pass
-            return 0
+async def _inventory_engine(roblox_id: int, source: _CookieSource, force_refresh: bool = False,
+                            full_resync: bool = False,
+                            on_batch: Optional[Callable[[int, List[dict], bool], None]] = None) -> dict:
+    """
+    Инвентарь с ценами по категориям для любого источника кук.
+    Без force_refresh — из общего кэша (его же наполняют private и public запросы).
+    Параллельные запросы одного roblox_id ждут одну сборку (cache_locks), а не запускают свою:
+    дождавшийся отдаёт то, что собрал предыдущий, если сборка закончилась уже после начала его ожидания.
+    force_refresh — delta-sync (см. _delta_refresh_inventory), full_resync — полная загрузка.
+    on_batch — поток предметов, пока идёт полная загрузка (см. iter_inventory).
+    """
+    asset_types = _parse_asset_types_from_cfg()
+    cache_key, sync_key = _inventory_keys(roblox_id, asset_types)
+    empty = {"total": 0, "byCategory": {}}
 
-        for at, ids in per_type.items():
-            cat = _canon_cat(ASSET_TYPE_TO_CATEGORY.get(int(at), "Other"))
-            arr = []
-            if not cat:
+    if not force_refresh:
+        cached = await _load_inventory(cache_key, INV_TTL)
+        if cached:
+            return cached
+
+    asked_at = time.time()
+    async with get_lock(cache_key):
+        if _INV_BUILT_AT.get(cache_key, 0) >= asked_at:
+            cached = await _load_inventory(cache_key, INV_TTL)
+            if cached:
+                return cached
+        elif not force_refresh:
+            cached = await _load_inventory(cache_key, INV_TTL)
+            if cached:
+                return cached
+
+        cookies = await source.cookies()
+        if not cookies:
+            return empty
+        for idx, cookie in enumerate(cookies, start=1):
+            try:
+                data = await _build_inventory_with_cookie(
+                    roblox_id, cookie, asset_types, cache_key, sync_key,
+                    delta=force_refresh and not full_resync, on_batch=on_batch,
+                )
+            except Exception as e:
+                log.warning(f"[INV_ENGINE] uid={roblox_id} cookie {idx}/{len(cookies)} failed: {type(e).__name__}: {e}")
                 continue
-            for aid in ids:
-                d = by_id.get(int(aid))
-                if not d:
-                    continue
-                price = _price_pick_local(d)
-                arr.append({
-                    "assetId": int(aid),
-                    "priceInfo": {"value": int(price)},
-                    "name": d.get("name") or "",
-                    "assetType": int(at),
-                    'itemId': _to_int(d.get('itemId') or d.get('collectibleItemId') or 0)
-                })
-            if arr:
-                by_cat.setdefault(cat, []).extend(arr)
-                total_count += len(arr)
-
-        return {"total": int(total_count), "byCategory": by_cat}
+            if data.get("total") or source.cache_empty:
+                if data.get("total"):
+                    await source.note_success(cookie)
+                data = await _store_inventory(cache_key, data)
+                _INV_BUILT_AT[cache_key] = time.time()
+                return data
+            log.info(f"[INV_ENGINE] uid={roblox_id} cookie {idx}/{len(cookies)} returned empty/hidden inventory")
+
+    log.warning(f"[INV_ENGINE] uid={roblox_id} no cookie produced an inventory")
+    return empty
+
 
+async def get_full_inventory_with_cookie(roblox_id: int, cookie: str | None, force_refresh: bool = False) -> dict:
+    """
+    Public helper to fetch full inventory using a raw .ROBLOSECURITY cookie.
+    Uses the same cache key and aggregation logic as get_full_inventory.
+    """
+    if not cookie:
+        return {"total": 0, "byCategory": {}}
+    return await _inventory_engine(roblox_id, _CookieSource(cookie), force_refresh=force_refresh)
+
+# === Helper: fetch inventory for a target Roblox ID using a provided ENCRYPTED cookie ===
+async def get_full_inventory_by_encrypted_cookie(enc_cookie: str, roblox_id: int, force_refresh: bool = False) -> dict:
+    """Try to fetch full inventory for *roblox_id* using the given encrypted cookie (общий кэш движка)."""
+    try:
+        return await _inventory_engine(roblox_id, _EncryptedCookieSource(enc_cookie), force_refresh=force_refresh)
     except Exception as e:
         log.error(f"Failed to get inventory by encrypted cookie: {e}")
         return {"total": 0, "byCategory": {}}
@@ -842,65 +1561,20 @@ async def get_inventory_public_ultra_fast(roblox_id: int) -> dict:
 
 
 async def _get_inventory_public_ultra_fast_internal(roblox_id: int) -> dict:
-    now = time.time()
-
-    # 1. Проверяем кэш (самый быстрый путь)
-    cached_cookie = _COOKIE_CACHE.get(roblox_id)
-    if cached_cookie and (now - _COOKIE_CACHE_TIME.get(roblox_id, 0)) < COOKIE_CACHE_TTL:
-        try:
-            result = await get_full_inventory_by_encrypted_cookie(cached_cookie, roblox_id)
-            if result.get("total", 0) > 0:
-                log.info(f"[ULTRA_FAST] Cache HIT for {roblox_id}, items: {result['total']}")
-                return result
-            else:
-                log.info(f"[ULTRA_FAST] Cache MISS (no items) for {roblox_id}")
-        except Exception as e:
-            log.warning(f"[ULTRA_FAST] Cache FAIL for {roblox_id}: {e}")
-        # Удаляем нерабочую куки из кэша
-        _COOKIE_CACHE.pop(roblox_id, None)
-
-    # 2. Ищем новую рабочую куки
-    log.info(f"[ULTRA_FAST] Searching working cookie for {roblox_id}")
-    cookies = await storage.get_multiple_cookies_quick(limit=PUBLIC_MODE_MAX_COOKIES)
-
-    if not cookies:
-        log.error(f"[ULTRA_FAST] No cookies in DB for {roblox_id}")
-        return {"total": 0, "byCategory": {}}
-
-    # Пробуем куки по очереди
-    working_cookie = None
-    working_result = None
-
-    for i, enc_cookie in enumerate(cookies):
-        try:
-            log.info(f"[ULTRA_FAST] Trying cookie {i + 1}/{len(cookies)} for {roblox_id}")
-            result = await get_full_inventory_by_encrypted_cookie(enc_cookie, roblox_id)
-
-            if result.get("total", 0) > 0:
-                working_cookie = enc_cookie
-                working_result = result  # Сохраняем результат
-                log.info(f"[ULTRA_FAST] SUCCESS with cookie {i + 1}, items: {result['total']}")
-                break
-            else:
-                log.info(f"[ULTRA_FAST] Cookie {i + 1} worked but no items")
-        except Exception as e:
-            log.warning(f"[ULTRA_FAST] Cookie {i + 1} failed: {e}")
-            continue
-
-    # 3. Сохраняем в кэш и возвращаем результат
-    if working_cookie and working_result:
-        _COOKIE_CACHE[roblox_id] = working_cookie
-        _COOKIE_CACHE_TIME[roblox_id] = now
-        return working_result  # Возвращаем сохраненный результат
-
-    log.error(f"[ULTRA_FAST] ALL cookies failed for {roblox_id}")
-    return {"total": 0, "byCategory": {}}
+    # общий кэш (в т.ч. после private-запроса) -> привязанная кука / гонка проб лучших кук из БД
+    result = await _inventory_engine(roblox_id, _PublicCookieSource(roblox_id, PUBLIC_MODE_MAX_COOKIES))
+    if result.get("total", 0) > 0:
+        log.info(f"[ULTRA_FAST] {roblox_id} items: {result['total']}")
+    else:
+        log.error(f"[ULTRA_FAST] ALL cookies failed for {roblox_id}")
+    return result
 
 async def clear_cookie_cache(roblox_id: Optional[int] = None):
     """Очищает кэш куки (для дебага или принудительного обновления)"""
     if roblox_id:
         _COOKIE_CACHE.pop(roblox_id, None)
         _COOKIE_CACHE_TIME.pop(roblox_id, None)
+        await storage.drop_cookie_affinity(roblox_id)
         log.info(f"[CACHE] Cleared cache for {roblox_id}")
     else:
         _COOKIE_CACHE.clear()
@@ -912,40 +1586,118 @@ async def clear_cookie_cache(roblox_id: Optional[int] = None):
 async def get_full_inventory_public_like_private(roblox_id: int, cookies_limit: int | None = None, force_refresh: bool = False) -> dict:
     """Use the same full-inventory pipeline as private, but pick any working encrypted cookie from DB."""
     try:
-        limit = cookies_limit or (PUBLIC_MODE_MAX_COOKIES if 'PUBLIC_MODE_MAX_COOKIES' in globals() else 10)
+        limit = cookies_limit or PUBLIC_MODE_MAX_COOKIES
         log.info(f"[PUBLIC_LIKE_PRIV] Searching working cookie for {roblox_id} (limit={limit})")
-        # get encrypted cookies from storage
-        try:
-            cookies = await storage.get_multiple_cookies_quick(limit=limit)
-        except Exception as e:
-            log.warning(f"[PUBLIC_LIKE_PRIV] storage.get_multiple_cookies_quick failed: {e}")
-            cookies = []
-        if not cookies:
-            log.warning("[PUBLIC_LIKE_PRIV] No cookies available in DB")
-            return {"total": 0, "byCategory": {}}
-
-        # try cookies sequentially until one succeeds
-        for idx, enc_cookie in enumerate(cookies, start=1):
-            try:
-                log.info(f"[PUBLIC_LIKE_PRIV] Try cookie {idx}/{len(cookies)} for {roblox_id}")
-                result = await get_full_inventory_by_encrypted_cookie(enc_cookie, roblox_id, force_refresh=force_refresh)
-                total = int(result.get("total", 0) or 0) if isinstance(result, dict) else 0
-                if total > 0 and isinstance(result.get("byCategory"), dict) and result["byCategory"]:
-                    log.info(f"[PUBLIC_LIKE_PRIV] SUCCESS with cookie {idx}, items: {total}")
-                    return result
-                else:
-                    log.info(f"[PUBLIC_LIKE_PRIV] Cookie {idx} returned empty/hidden inventory")
-            except Exception as e:
-                log.warning(f"[PUBLIC_LIKE_PRIV] Cookie {idx} failed: {type(e).__name__}: {e}")
-                continue
-
-        log.warning(f"[PUBLIC_LIKE_PRIV] All cookies failed for {roblox_id}")
-        return {"total": 0, "byCategory": {}}
+        result = await _inventory_engine(roblox_id, _PublicCookieSource(roblox_id, limit), force_refresh=force_refresh)
+        if not result.get("byCategory"):
+            log.warning(f"[PUBLIC_LIKE_PRIV] All cookies failed for {roblox_id}")
+        return result
     except Exception as e:
         log.error(f"[PUBLIC_LIKE_PRIV] Unexpected error for {roblox_id}: {type(e).__name__}: {e}", exc_info=True)
         return {"total": 0, "byCategory": {}}
 
 
+# сборки, начатые iter_inventory и брошенные потребителем: досчитываются в кэш, держим ссылку до конца
+_INV_DETACHED: set = set()
+
+
+async def iter_inventory(roblox_id: int, tg_id: Optional[int] = None, *, cookie: Optional[str] = None,
+                         public: bool = False, force_refresh: bool = False) -> AsyncIterator[dict]:
+    """
+    Тот же инвентарь, что у get_full_inventory, но пачками по мере готовности цен:
+    {"category": ..., "items": [...], "complete": bool}. complete=True — все типы категории докачаны,
+    можно рисовать её лист (если сборку пришлось повторить другой кукой, хвост придёт ещё одной complete-пачкой).
+    Кука: cookie, иначе кука tg_id для roblox_id; public=True — куки из БД, как в public-режиме.
+    Из кэша и после delta-sync всё приходит сразу, по пачке на категорию.
+    Сборка идёт через _inventory_engine (кэш, singleflight): если генератор бросили на середине,
+    она не отменяется и доезжает до кэша.
+    """
+    if public:
+        source: _CookieSource = _PublicCookieSource(roblox_id, PUBLIC_MODE_MAX_COOKIES)
+    else:
+        if cookie is None and tg_id is not None:
+            try:
+                cookie = await storage.get_user_cookie_plain(tg_id, roblox_id)
+            except Exception:
+                cookie = None
+        if not cookie:
+            return
+        source = _CookieSource(cookie)
+
+    cat_of = {int(t): _canon_cat(ASSET_TYPE_TO_CATEGORY.get(int(t), "Other")) for t in _parse_asset_types_from_cfg()}
+    open_types: Dict[str, set] = {}
+    for t, c in cat_of.items():
+        if c:
+            open_types.setdefault(c, set()).add(t)
+    sent: Dict[str, set] = {}  # категория -> уже отданные assetId
+    closed: set = set()
+
+    def _fresh(cat: str, items: List[dict]) -> List[dict]:
+        seen = sent.setdefault(cat, set())
+        out = []
+        for it in items:
+            aid = int(it.get("assetId") or 0)
+            if aid not in seen:
+                seen.add(aid)
+                out.append(it)
+        return out
+
+    def _accept(at: int, items: List[dict], done: bool) -> Optional[dict]:
+        cat = cat_of.get(int(at)) or _canon_cat(ASSET_TYPE_TO_CATEGORY.get(int(at), "Other"))
+        if not cat:
+            return None
+        fresh = _fresh(cat, items)
+        complete = False
+        if done and cat not in closed:
+            open_types.get(cat, set()).discard(int(at))
+            if not open_types.get(cat):
+                closed.add(cat)
+                complete = True
+        if not fresh and not complete:
+            return None
+        return {"category": cat, "items": fresh, "complete": complete or cat in closed}
+
+    queue: asyncio.Queue = asyncio.Queue()
+    build = asyncio.ensure_future(_inventory_engine(
+        roblox_id, source, force_refresh=force_refresh,
+        on_batch=lambda at, items, done: queue.put_nowait((at, items, done)),
+    ))
+    getter: Optional[asyncio.Future] = None
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done_set, _ = await asyncio.wait({getter, build}, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done_set:
+                getter.cancel()
+                break
+            batch = _accept(*getter.result())
+            if batch:
+                yield batch
+        while not queue.empty():
+            batch = _accept(*queue.get_nowait())
+            if batch:
+                yield batch
+
+        # кэш/delta/повтор другой кукой: всё, чего ещё не отдали
+        result = build.result()
+        if isinstance(result, CompactInventory):
+            # по категории из колонок, без сборки и хранения всего byCategory на объекте из кэша
+            tail = ((cat, result.category_items(cat)) for cat in result.categories)
+        else:
+            tail = (result.get("byCategory") or {}).items()
+        for cat, items in tail:
+            fresh = _fresh(cat, items or [])
+            if fresh or (items and cat not in closed):
+                closed.add(cat)
+                yield {"category": cat, "items": fresh, "complete": True}
+    finally:
+        if getter is not None and not getter.done():
+            getter.cancel()
+        if not build.done():
+            _INV_DETACHED.add(build)
+            build.add_done_callback(_INV_DETACHED.discard)
+
+
 # ===================== ИСТОРИЯ ТРАТ (PRIVATE ONLY) =====================
 
 
@@ -1131,143 +1883,159 @@ async def _format_transaction(transaction: Dict[str, Any]) -> Optional[Dict[str,
         return None
 
 
-async def get_spending_history(uid: int, cookie: str, limit: int = 1000, use_cache: bool = None) -> List[Dict[str, Any]]:
-    """
-    История трат — максимально подробные логи по шагам.
-    """
-    import time as _t
-    start_all = _t.perf_counter()
-    if use_cache is None:
-        use_cache = ENABLE_SPENDING_CACHE
-    log.info(f"[SPENDING] START uid={uid} limit={limit} use_cache={use_cache}")
-
-    transactions: List[Dict[str, Any]] = []
-    cursor: Optional[str] = None
-    pages = 0
-    consecutive_errors = 0
-    cache_key = f"spending:{uid}:{limit}"
-    log.info(f"[SPENDING] cache={'ON' if (use_cache and ENABLE_SPENDING_CACHE) else 'OFF'} key={cache_key}")
-    if not ENABLE_SPENDING_CACHE:
-        log.warning("[SPENDING] Cache OFF: skip read & write; force live fetch")
-        try:
-            # ensure no stale file will be used elsewhere
-            import hashlib, os
-            _path = os.path.join(os.getenv("CACHE_DIR", "cache"), hashlib.sha1(cache_key.encode("utf-8")).hexdigest())
-            if os.path.exists(_path):
-                os.remove(_path)
-                log.info(f"[SPENDING] Removed existing cache file: {_path}")
-        except Exception as _e:
-            log.debug(f"[SPENDING] Cache file removal skipped: {_e}")
-
-    # Кэш
-    try:
-        if not getattr(CFG, "FORCE_REFRESH_SPENDING", True):
-            cached = await cache.get_json(cache_key, SPENDING_TTL)
-            if cached is not None:
-                log.info(f"[SPENDING] Cache {'HIT' if cached else 'EMPTY'} size={len(cached) if isinstance(cached, list) else 'N/A'} key={cache_key}")
-                if cached:
-                    return cached
-            else:
-                log.info(f"[SPENDING] Cache MISS key={cache_key}")
-    except Exception as e:
-        log.warning(f"[SPENDING] cache.get failed: {type(e).__name__}: {e}")
-
-    proxy = PROXY_POOL.any()
-    client = await get_client(proxy)
-    timeout = httpx.Timeout(8.0, connect=2.0, read=6.0)
-    url = ECON_TX_URL.format(uid=uid)
-    log.info(f"[SPENDING] HTTP begin url={url} proxy={proxy}")
+class SpendingAuthError(RuntimeError):
+    """Economy API отказал куке (401/403)."""
 
-    while pages < 2000 and len(transactions) < limit:
-        want = min(100, max(0, limit - len(transactions)))
-        params = {"transactionType": "Purchase", "limit": want, "cursor": cursor or "", "_": str(int(_t.time()*1000))}
-        pages += 1
-        t0 = _t.perf_counter()
-        log.info(f"[SPENDING] Page#{pages} request params={params}")
 
+async def _fetch_spending_page(uid: int, cookie: str, cursor: Optional[str]) -> tuple:
+    """Одна страница Purchase-транзакций (новые сначала): (data, next_cursor). 429 — повтор, 401/403 — SpendingAuthError."""
+    url = ECON_TX_URL.format(uid=uid)
+    timeout = httpx.Timeout(8.0, connect=2.0, read=6.0)
+    errors = 0
+    while True:
+        client = await get_client(PROXY_POOL.any())
+        t0 = time.time()
         try:
             headers = _cookie_headers(cookie)
-            headers.update({"Cache-Control":"no-cache","Pragma":"no-cache"})
-            r = await client.get(url, params=params, headers=headers, timeout=timeout)
-            dt = int((_t.perf_counter() - t0) * 1000)
-            clen = r.headers.get("Content-Length") or "?"
-            log.info(f"[SPENDING] Page#{pages} HTTP {r.status_code} in {dt}ms (len={clen})")
-
+            headers.update({"Cache-Control": "no-cache", "Pragma": "no-cache"})
+            r = await client.get(
+                url,
+                params={"transactionType": "Purchase", "limit": 100, "cursor": cursor or ""},
+                headers=headers,
+                timeout=timeout,
+            )
+            storage.note_cookie_result(cookie, r.status_code, (time.time() - t0) * 1000)
             if r.status_code == 429:
-                log.warning(f"[SPENDING] Page#{pages} 429 TooManyRequests -> sleep 1000ms")
+                log.warning("[SPENDING] 429 TooManyRequests -> sleep 1000ms")
                 await asyncio.sleep(1.0)
-                pages -= 1  # retry same page index next loop
                 continue
-
             if r.status_code in (401, 403):
-                log.error(f"[SPENDING] AUTH_FAIL status={r.status_code} (cookie invalid)")
-                return []
-
+                raise SpendingAuthError(f"Economy transactions auth failed: {r.status_code}")
             r.raise_for_status()
-            raw = r.text
-            try:
-                js = r.json() or {}
-            except Exception as je:
-                log.error(f"[SPENDING] JSON parse fail: {type(je).__name__}: {je} (first 300 chars: {raw[:300]!r})")
-                break
+            js = r.json() or {}
+            return js.get("data") or [], js.get("nextPageCursor")
+        except SpendingAuthError:
+            raise
+        except Exception as e:
+            errors += 1
+            log.warning(f"[SPENDING] page error ({errors}/3) uid={uid}: {type(e).__name__}: {e}")
+            if errors >= 3:
+                raise
+            await asyncio.sleep(0.5)
 
-            data = js.get("data") or []
-            if pages == 1 and data:
-                try:
-                    _tx = data[0]
-                    _sample = {
-                        'created': _tx.get('created'),
-                        'type': _tx.get('type'),
-                        'currency': _tx.get('currency'),
-                        'details_keys': list((_tx.get('details') or {}).keys()),
-                    }
-                    log.debug(f"[SPENDING] sample tx page1: {_sample}")
-                except Exception:
-                    pass
-            next_cursor = js.get("nextPageCursor")
-            log.info(f"[SPENDING] Page#{pages} data_items={len(data)} next_cursor={'yes' if next_cursor else 'no'}")
 
-            if not data:
-                log.info(f"[SPENDING] Page#{pages} empty -> stop")
-                break
+def _spending_tx_id(tx: Dict[str, Any]) -> str:
+    tid = tx.get("id") or tx.get("idHash") or tx.get("transactionId")
+    if tid:
+        return str(tid)
+    return hashlib.sha1(json.dumps(tx, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+async def _ledger_rows(data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    rows = []
+    for tx in data:
+        fmt = await _format_transaction(tx)
+        if fmt:
+            rows.append({
+                "tx_id": _spending_tx_id(tx),
+                "created": fmt.get("date"),
+                "amount": int(fmt.get("raw_amount") or 0),
+                "creator": fmt.get("creator"),
+                "row": fmt,
+            })
+    return rows
 
-            added = 0
-            for tx in data:
-                fmt = await _format_transaction(tx)
-                if fmt:
-                    transactions.append(fmt); added += 1
-            log.info(f"[SPENDING] Page#{pages} parsed_added={added} total={len(transactions)}")
 
-            cursor = next_cursor
-            if not cursor or len(transactions) >= limit:
+async def sync_spending_ledger(uid: int, cookie: str, *, min_interval: Optional[float] = None,
+                               max_pages: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Дотягивает локальный журнал трат (storage.spending_ledger) до текущего состояния.
+    Голова: страницы с начала (новые сначала) до первой уже известной транзакции — обычно одна страница.
+    Если голова упёрлась в лимит страниц раньше, место обрыва сохраняется в head_cursor, и следующий
+    вызов сначала закрывает этот разрыв. Хвост: пока журнал не полный (первая синхронизация прервалась),
+    докачивает старые страницы с resume_cursor. Состояние пишется после каждой страницы, так что
+    прерванная синхронизация (таймаут, отмена) продолжается со следующего вызова, а не с нуля.
+    min_interval — не ходить в API, если полный журнал синхронизировался не раньше стольких секунд назад.
+    Возвращает {"added", "pages", "complete"}; при отказе куки — SpendingAuthError.
+    """
+    every = SPENDING_SYNC_INTERVAL if min_interval is None else float(min_interval)
+    budget = SPENDING_SYNC_MAX_PAGES if max_pages is None else int(max_pages)
+    async with get_lock(f"spsync:{uid}"):
+        state = await storage.get_spending_sync(uid)
+        if state and state["complete"] and time.time() - state["synced_at"] < every:
+            return {"added": 0, "pages": 0, "complete": True}
+
+        t0 = time.perf_counter()
+        added = pages = 0
+        tail_cursor = state["resume_cursor"] if state else None
+        gap_cursor = state["head_cursor"] if state else None
+
+        # разрыв: прошлая голова оборвалась — докачиваем с head_cursor до уже известной части журнала
+        while gap_cursor and pages < budget:
+            data, next_cursor = await _fetch_spending_page(uid, cookie, gap_cursor)
+            pages += 1
+            rows = await _ledger_rows(data)
+            known = await storage.spending_known_ids(uid, [r["tx_id"] for r in rows])
+            end = not next_cursor or not data
+            if end:
+                tail_cursor = None
+            gap_cursor = None if (known or end) else next_cursor
+            added += await storage.add_spending_rows(uid, [r for r in rows if r["tx_id"] not in known],
+                                                     resume_cursor=tail_cursor, head_cursor=gap_cursor,
+                                                     complete=False)
+
+        # голова (разрыв закрыт: новые транзакции сверху смыкаются с журналом)
+        cursor: Optional[str] = None
+        head_done = False
+        while not gap_cursor and pages < budget:
+            data, next_cursor = await _fetch_spending_page(uid, cookie, cursor)
+            pages += 1
+            rows = await _ledger_rows(data)
+            known = await storage.spending_known_ids(uid, [r["tx_id"] for r in rows]) if state else set()
+            end = not next_cursor or not data
+            head_done = bool(known) or end
+            if end:
+                tail_cursor = None
+            elif state is None:
+                # первая синхронизация: журнала ещё нет, голова сразу продолжается хвостом
+                tail_cursor = next_cursor
+            # курсор хвоста не трогаем: прогресс головы — отдельно, в head_cursor
+            head_cursor = None if head_done or state is None else next_cursor
+            added += await storage.add_spending_rows(uid, [r for r in rows if r["tx_id"] not in known],
+                                                     resume_cursor=tail_cursor, head_cursor=head_cursor,
+                                                     complete=head_done and tail_cursor is None)
+            if head_done:
                 break
+            cursor = next_cursor
 
-        except Exception as e:
-            dt = int((_t.perf_counter() - t0) * 1000)
-            consecutive_errors += 1
-            log.error(f"[SPENDING] Page#{pages} ERROR after {dt}ms ({consecutive_errors}/3): {type(e).__name__}: {e}", exc_info=True)
-            if consecutive_errors >= 3:
-                log.error("[SPENDING] Abort — too many consecutive errors")
-                break
-            await asyncio.sleep(0.5)
+        # хвост (только если голова сомкнулась с журналом, иначе её продолжит следующий вызов)
+        while head_done and tail_cursor and pages < budget:
+            data, next_cursor = await _fetch_spending_page(uid, cookie, tail_cursor)
+            pages += 1
+            tail_cursor = None if (not next_cursor or not data) else next_cursor
+            added += await storage.add_spending_rows(uid, await _ledger_rows(data), resume_cursor=tail_cursor,
+                                                     complete=tail_cursor is None)
+        complete = head_done and tail_cursor is None
 
-    total_ms = int((_t.perf_counter() - start_all) * 1000)
-    log.info(f"[SPENDING] DONE uid={uid}: txs={len(transactions)} pages={pages} in {total_ms}ms")
+        log.info(f"[SPENDING] sync uid={uid} added={added} pages={pages} complete={complete} "
+                 f"in {int((time.perf_counter() - t0) * 1000)}ms")
+        return {"added": added, "pages": pages, "complete": complete}
 
-    try:
-        if use_cache and ENABLE_SPENDING_CACHE:
-            await cache.set_json(cache_key, transactions)
-            log.info(f"[SPENDING] Cached {len(transactions)} -> {cache_key}")
-        else:
-            log.info("[SPENDING] Cache disabled; skip save")
-    except Exception as e:
-        log.warning(f"[SPENDING] cache.set failed: {type(e).__name__}: {e}")
 
-    return transactions
+async def get_spending_history(uid: int, cookie: str, limit: int = 1000, use_cache: bool = None) -> List[Dict[str, Any]]:
+    """
+    История трат (новые сначала) — строки из get_spending_summary. use_cache и выключенный
+    FORCE_REFRESH_SPENDING разрешают не ходить в API, если полный журнал моложе SPENDING_TTL.
+    Кука отклонена — [] (как раньше).
+    """
+    summary = await get_spending_summary(uid, cookie, use_cache=use_cache)
+    if summary is None:
+        return []
+    return summary["rows"] if limit is None else summary["rows"][:limit]
 
 async def get_spending_history_by_encrypted_cookie(enc_cookie: str, roblox_id: int, limit: int = 1000, use_cache: bool = None) -> List[Dict[str, Any]]:
     try:
-        cookie = decrypt_text(enc_cookie)
+        cookie = await storage.decrypt_cookie_cached(enc_cookie)
         if not cookie:
             log.error(f"[SPENDING] decrypt failed for {roblox_id}")
             return []
@@ -1300,6 +2068,96 @@ def get_spending_statistics(transactions: List[Dict[str, Any]]) -> Dict[str, Any
     return transactions
 
 
+# ---- единая сводка трат: строки, итог, группы по плейсам, статистика — за один проход ----
+# uid -> (время сборки, (count, total) журнала, сводка); LRU на SPENDING_SUMMARY_MAX аккаунтов
+_SPENDING_SUMMARY: "OrderedDict[int, tuple]" = OrderedDict()
+
+
+def _spending_place(row: Dict[str, Any]) -> str:
+    return str(row.get("place") or row.get("creator") or row.get("source") or row.get("seller") or "")
+
+
+def _build_spending_summary(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Один проход по строкам журнала (новые сначала): итог, группы по плейсу/создателю (по убыванию суммы,
+    предметы в группе — по убыванию цены) и поля get_spending_statistics.
+    """
+    total = 0
+    buckets: Dict[str, list] = {}
+    for row in rows:
+        amount = int(row.get("raw_amount") or 0)
+        total += amount
+        place = _spending_place(row)
+        b = buckets.get(place)
+        if b is None:
+            b = buckets[place] = [0, []]
+        b[0] += amount
+        b[1].append(row)
+    order = sorted(buckets, key=lambda name: (-buckets[name][0], name.lower()))
+    count = len(rows)
+    return {
+        "rows": rows,
+        "total": total,
+        "count": count,
+        # (плейс, транзакций, сумма); пустое имя — создатель неизвестен
+        "places": [(name, len(buckets[name][1]), buckets[name][0]) for name in order],
+        "items_by_place": [sorted(buckets[name][1], key=lambda r: int(r.get("raw_amount") or 0), reverse=True)
+                           for name in order],
+        "stats": {
+            "total_spent": total,
+            "transaction_count": count,
+            "average_spent": (total // count) if count else 0,
+            "total_spent_formatted": f"{total} R$",
+        },
+    }
+
+
+async def get_spending_summary(uid: int, cookie: str, use_cache: bool = None) -> Optional[Dict[str, Any]]:
+    """
+    Всё о тратах одним объектом для всех экранов трат: {"rows", "total", "count", "places",
+    "items_by_place", "stats"}. Один проход синхронизации журнала (обычно одна страница API)
+    и одно чтение журнала; пока журнал не менялся, отдаётся та же сводка из памяти.
+    None — кука отклонена.
+    """
+    if use_cache is None:
+        use_cache = ENABLE_SPENDING_CACHE
+    lazy = use_cache and not getattr(CFG, "FORCE_REFRESH_SPENDING", True)
+    try:
+        await sync_spending_ledger(uid, cookie, min_interval=SPENDING_TTL if lazy else None)
+    except SpendingAuthError as e:
+        log.error(f"[SPENDING] AUTH_FAIL uid={uid}: {e}")
+        return None
+    except Exception as e:
+        log.warning(f"[SPENDING] sync failed uid={uid}: {type(e).__name__}: {e}")
+    total, count = await storage.get_spending_total(uid)
+    now = time.time()
+    hit = _SPENDING_SUMMARY.get(uid)
+    if hit is not None and hit[1] == (count, total) and now - hit[0] < SPENDING_SUMMARY_TTL:
+        _SPENDING_SUMMARY.move_to_end(uid)
+        return hit[2]
+    summary = _build_spending_summary(await storage.get_spending_rows(uid))
+    _SPENDING_SUMMARY[uid] = (now, (summary["count"], summary["total"]), summary)
+    _SPENDING_SUMMARY.move_to_end(uid)
+    while len(_SPENDING_SUMMARY) > max(1, SPENDING_SUMMARY_MAX):
+        _SPENDING_SUMMARY.popitem(last=False)
+    log.info(f"[SPENDING] summary uid={uid} rows={summary['count']} total={summary['total']} "
+             f"places={len(summary['places'])}")
+    return summary
+
+
+async def get_spending_summary_by_encrypted_cookie(enc_cookie: str, roblox_id: int,
+                                                   use_cache: bool = None) -> Optional[Dict[str, Any]]:
+    try:
+        cookie = await storage.decrypt_cookie_cached(enc_cookie)
+        if not cookie:
+            log.error(f"[SPENDING] decrypt failed for {roblox_id}")
+            return None
+        return await get_spending_summary(roblox_id, cookie, use_cache=use_cache)
+    except Exception as e:
+        log.error(f"[SPENDING] summary by enc cookie failed: {type(e).__name__}: {e}")
+        return None
+
+
 # Aggregates & place details
 PLACE_DETAILS_URL = "https://games.roblox.com/v1/places/multiget-place-details"
 GAMES_BY_UNIVERSE_URL = "https://games.roblox.com/v1/games"
@@ -1653,14 +2511,14 @@ async def analyze_gaming_habits(user_id: int, cookie: Optional[str] = None, *, e
     return result
 async def get_game_history_by_encrypted_cookie(enc_cookie: str, user_id: int, limit: int = 100) -> List[Dict]:
     try:
-        cookie = decrypt_text(enc_cookie)
+        cookie = await storage.decrypt_cookie_cached(enc_cookie)
     except Exception:
         cookie = None
     return await get_game_history(user_id, cookie=cookie, limit=limit)
 
 async def get_gaming_habits_by_encrypted_cookie(enc_cookie: str, user_id: int) -> Dict:
     try:
-        cookie = decrypt_text(enc_cookie)
+        cookie = await storage.decrypt_cookie_cached(enc_cookie)
     except Exception:
         cookie = None
     return await analyze_gaming_habits(user_id, cookie=cookie, enable_scrape=True)
@@ -1719,7 +2577,7 @@ async def get_universe_aggregates(universe_ids: List[int], cookie: Optional[str]
 
 async def get_recent_enriched_by_encrypted_cookie(enc_cookie: str, user_id: int, limit: int = 20, *, include_aggregates: bool = True) -> List[Dict[str, Any]]:
     try:
-        cookie = decrypt_text(enc_cookie)
+        cookie = await storage.decrypt_cookie_cached(enc_cookie)
     except Exception:
         cookie = None
 
@@ -2369,7 +3227,7 @@ async def calc_user_rap_from_inventory(user_id: int, *, cookie: Optional[str] =
             continue
         if not aid:
             continue
-        if _is_collectible(d):
+        if asset_meta.is_collectible(d):
             collectible_ids.append(aid)
             names[aid] = _pick_item_name(d) or d.get("name") or "Unknown"
 
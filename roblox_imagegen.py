@@ -4,7 +4,6 @@ from i18n import tr, get_current_lang
 
 from datetime import datetime as _dt2
 LOG_PRICE_PATH = os.path.join(os.path.dirname(__file__), "price_debug.log")
-PRICE_CSV_PATH = os.getenv('PRICE_CSV_PATH', os.path.join(os.path.dirname(__file__), 'prices.csv'))
 def _log_price_event(text: str):
     ts = _dt2.now().strftime("%Y-%m-%d %H:%M:%S")
     line = f"[{ts}] {text}"
@@ -101,7 +100,6 @@ def _err(prefix: str, e: Exception):
     logger.error(f"{prefix}: {type(e).__name__}: {e}", exc_info=True)
 
 _info(f"[imagegen] cwd={os.getcwd()} READY_ITEM_DIR={os.path.abspath(READY_ITEM_DIR)} DEBUG={DEBUG_IMAGEGEN}")
-_info(f"[prices] using CSV: {PRICE_CSV_PATH}")
 
 # =========================
 # External deps
@@ -109,6 +107,11 @@ _info(f"[prices] using CSV: {PRICE_CSV_PATH}")
 from http_shared import get_client, PROXY_POOL
 from config import CFG
 import cache
+import price_store
+import asset_meta
+import inventory_pricing
+
+_info(f"[prices] using price store: {price_store.PRICE_DB_PATH}")
 
 # =========================
 # Tunables
@@ -220,6 +223,13 @@ DEFAULT_TIER_BACKGROUNDS = {
 }
 
 
+def _tier_thresholds():
+    """(минимум, имя уровня) для пакетного inventory_pricing.tier_names и имя уровня ниже всех порогов."""
+    if RULES_JSON:
+        return [(r['min'], r['name']) for r in RULES_JSON], RULES_JSON[-1]['name']
+    return FALLBACK_THRESHOLDS, 'common'
+
+
 def _tier_by_price(price: int) -> str:
     if RULES_JSON:
         for r in RULES_JSON:
@@ -389,9 +399,20 @@ async def _fetch_thumbs(ids: List[int], size: str='150x150') -> Dict[int, Image.
             result[int(aid)] = imr
         else:
             left.append(int(aid))
-    _info(f"[thumb] input={len(ids)} local_hits={len(result)} need_fetch={len(left)} size={size}")
+    # URL превью из общего asset_meta — thumbnails API спрашиваем только о неизвестных
+    field = asset_meta.thumb_field(size)
+    known_urls: Dict[int, str] = {}
+    try:
+        for aid, rec in (await asyncio.to_thread(asset_meta.get_many, left, (field,))).items():
+            known_urls[aid] = rec[field]
+    except Exception as e:
+        _err("[thumb] asset_meta read fail", e)
+    _info(f"[thumb] input={len(ids)} local_hits={len(result)} known_urls={len(known_urls)} "
+          f"need_fetch={len(left) - len(known_urls)} size={size}")
     if not left:
         return result
+    left = [aid for aid in left if aid not in known_urls]
+    completed: Dict[int, str] = {}
 
     base = 'https://thumbnails.roblox.com/v1/assets'
     legacy = 'https://www.roblox.com/asset-thumbnail/image'
@@ -418,6 +439,8 @@ async def _fetch_thumbs(ids: List[int], size: str='150x150') -> Dict[int, Image.
                         urls[aid] = url
                     if state and state != 'Completed':
                         pending.append(aid)
+                    elif url:
+                        completed[aid] = url
                 return (urls, pending)
             urls, pending = parse(r.json())
             _dbg(f"[thumb] urls={len(urls)} pending={len(pending)}")
@@ -456,9 +479,14 @@ async def _fetch_thumbs(ids: List[int], size: str='150x150') -> Dict[int, Image.
             return await one_batch(b)
 
     maps = await asyncio.gather(*(guarded(b) for b in batches))
-    url_map: Dict[int, str] = {}
+    url_map: Dict[int, str] = dict(known_urls)
     for m in maps:
         url_map.update(m)
+    if completed:
+        try:
+            await asyncio.to_thread(asset_meta.put_many, {aid: {field: url} for aid, url in completed.items()})
+        except Exception as e:
+            _err("[thumb] asset_meta write fail", e)
 
     sem_dl = asyncio.Semaphore(THUMB_DL_CONCURRENCY)
 
@@ -531,52 +559,34 @@ def _read_ready_item(aid: int) -> Optional[Image.Image]:  # type: ignore[func-ov
                 _err(f"[local] open fail for {q}", e)
     return None
 
-# Cached prices.csv reader (30 min TTL)
-_PRICES_CACHE: Optional[Dict[int, Dict[str, Any]]] = None
-_PRICES_TS: float = 0.0
-_PRICES_MTIME: float = -1.0
-_PRICES_TTL_SEC = 1800  # 30 min
-
-def load_prices_csv_cached(path: str = PRICE_CSV_PATH) -> Dict[int, Dict[str, Any]]:
-    global _PRICES_CACHE, _PRICES_TS, _PRICES_MTIME
-    try:
-        mtime = os.path.getmtime(path)
-    except FileNotFoundError:
-        return {}
-    now = time.time()
-    if (_PRICES_CACHE is not None) and ((now - _PRICES_TS) < _PRICES_TTL_SEC) and (_PRICES_MTIME == mtime):
-        return _PRICES_CACHE
-
+# Цены для отрисовки из price_store (синхронный SQLite — вызывать через asyncio.to_thread)
+def load_price_map(items: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """
+    Цены из price_store для _enrich_with_csv: только по id этих предметов (itemId/assetId/collectible*/id)
+    и по их именам — вместо чтения всего prices.csv. Заодно засчитывает показ (фоновое обновление цен).
+    """
+    ids: set = set()
+    names: set = set()
+    shown: set = set()
+    for it in items:
+        aid = _to_int(it.get('assetId') or it.get('id') or 0)
+        if aid:
+            shown.add(aid)
+        for k in ('itemId', 'assetId', 'collectibleItemId', 'collectibleId', 'id'):
+            v = _to_int(it.get(k) or 0)
+            if v:
+                ids.add(v)
+        if it.get('name'):
+            names.add(str(it.get('name')).strip())
     out: Dict[int, Dict[str, Any]] = {}
-    import csv
     try:
-        with open(path, "r", encoding="utf-8-sig", newline="") as f:
-            reader = csv.DictReader(f)
-            if reader.fieldnames:
-                for row in reader:
-                    r = {(k or '').strip().lower(): (v or '').strip() for k, v in row.items()}
-                    id_raw = r.get("itemid") or r.get("collectibleitemid") or r.get("collectibleid") or r.get("assetid") or r.get("id")
-                    if not id_raw:
-                        continue
-                    aid = _to_int(id_raw)
-                    name = r.get("name", "")
-                    price_field = r.get("pricepicked") or r.get("price") or r.get("value") or r.get("cost")
-                    price_val = _to_int(price_field or 0)
-                    out[aid] = {"name": name, "priceInfo": {"value": price_val}}
-            else:
-                f.seek(0)
-                reader2 = csv.reader(f)
-                for row in reader2:
-                    if not row or len(row) < 3:
-                        continue
-                    aid = _to_int(row[0]); name = (row[1] or "").strip(); price_val = _to_int(row[2])
-                    out[aid] = {"name": name, "priceInfo": {"value": price_val}}
+        price_store.note_views(shown)
+        for aid, rec in price_store.get_many(ids).items():
+            out[aid] = {"name": rec['name'], "priceInfo": {"value": rec['price']}}
+        for rec in price_store.get_by_names(names).values():
+            out.setdefault(rec['assetId'], {"name": rec['name'], "priceInfo": {"value": rec['price']}})
     except Exception as e:
-        _err("[prices] read fail", e)
-
-    _PRICES_CACHE = out
-    _PRICES_TS = now
-    _PRICES_MTIME = mtime
+        _err("[prices] store read fail", e)
     return out
 # =========================
 # Helpers
@@ -789,10 +799,10 @@ def _get_pill_bg(pill_w: int, pill_h: int, radius: int) -> Image.Image:
     _PILL_BG_CACHE[key] = im
     return im
 
-def _tile_cache_key(it: Dict[str, Any], tile: int) -> str:
-    """Stable key for ready-to-use tile PNG."""
+def _tile_cache_key(it: Dict[str, Any], tile: int, price: Optional[int] = None) -> str:
+    """Stable key for ready-to-use tile PNG (price — из колонки _render_grid, если уже посчитана)."""
     aid = int(it.get('assetId') or 0)
-    price = _price_of(it)
+    price = _price_of(it) if price is None else int(price)
     name = str(it.get('name') or '').strip().upper()
     # small hash for long names
     name_h = hashlib.sha1(name.encode('utf-8', 'ignore')).hexdigest()[:10]
@@ -968,16 +978,18 @@ def _base_tile(tier: str, tile: int) -> Image.Image:
     _BASE_TILE_CACHE[key] = out
     return out
 
-def _render_tile(it: Dict[str, Any], thumb: Image.Image, tile: int) -> Image.Image:
+def _render_tile(it: Dict[str, Any], thumb: Image.Image, tile: int,
+                 price: Optional[int] = None, tier: Optional[str] = None) -> Image.Image:
     """CPU-bound tile render.
 
     Optimized for first-run speed:
     - reuse cached base tile (tier bg)
     - reuse cached layout (fonts/geometry)
     - reuse cached price pill background (rounded rect)
+    - price/tier берутся из колонок _render_grid, если переданы
     """
-    price = _price_of(it)
-    tier = _tier_by_price(price)
+    price = _price_of(it) if price is None else int(price)
+    tier = _tier_by_price(price) if tier is None else tier
     name = str(it.get('name') or it.get('assetId') or '').strip().upper()
 
     lay = _get_layout(tile) if '_get_layout' in globals() else _layout_for_tile(tile)
@@ -1222,10 +1234,53 @@ def _draw_footer(canvas: Image.Image, username: Optional[str], user_id: Optional
 # =========================
 # Grid rendering (square-ish layout)
 # =========================
-async def _render_grid(items: List[Dict[str, Any]], tile: int=150, title: str='Items', username: Optional[str]=None, user_id: Optional[int]=None) -> bytes:
+def _thumb_size_for_tile(tile: int) -> str:
+    # pick smallest reasonable thumb size for this tile unless forced
+    if THUMB_SIZE_FORCE:
+        return THUMB_SIZE
+    # cheap heuristic: 150->150, 250->250, else 420
+    if tile <= 150:
+        return '150x150'
+    if tile <= 250:
+        return '250x250'
+    return '420x420'
+
+
+class ThumbPrefetcher:
+    """
+    Качает превью пачками, пока инвентарь ещё грузится (см. roblox_client.iter_inventory):
+    add(items) на каждую пришедшую пачку, get(ids) — готовые картинки для _render_grid(thumbs=...).
+    """
+
+    def __init__(self, tile: int = 150):
+        self.size = _thumb_size_for_tile(tile)
+        self._jobs: List[tuple] = []  # (assetIds пачки, task)
+        self._queued: set = set()
+
+    def add(self, items: List[Dict[str, Any]]) -> None:
+        ids = [int(x['assetId']) for x in items if x.get('assetId') and int(x['assetId']) not in self._queued]
+        if ids:
+            self._queued.update(ids)
+            self._jobs.append((set(ids), asyncio.create_task(_fetch_thumbs(ids, size=self.size))))
+
+    async def get(self, ids: List[int]) -> Dict[int, Image.Image]:
+        want = {int(a) for a in ids}
+        jobs = [task for job_ids, task in self._jobs if job_ids & want]
+        out: Dict[int, Image.Image] = {}
+        for res in await asyncio.gather(*jobs, return_exceptions=True):
+            if isinstance(res, dict):
+                out.update({a: im for a, im in res.items() if a in want})
+        return out
+
+    def cancel(self) -> None:
+        for _, task in self._jobs:
+            task.cancel()
+
+
+async def _render_grid(items: List[Dict[str, Any]], tile: int=150, title: str='Items', username: Optional[str]=None, user_id: Optional[int]=None, thumbs: Optional[Dict[int, Image.Image]]=None) -> bytes:
     _build_image_index_cached()
-    price_map = load_prices_csv_cached(PRICE_CSV_PATH)
-    # обогащаем КАЖДЫЙ айтем ценой из CSV (itemId/collectibleItemId/assetId)
+    price_map = await asyncio.to_thread(load_price_map, items)
+    # обогащаем КАЖДЫЙ айтем ценой из price_store (itemId/collectibleItemId/assetId)
     items = [_enrich_with_csv(it, price_map) for it in items]
     n = len(items)
 
@@ -1247,23 +1302,22 @@ async def _render_grid(items: List[Dict[str, Any]], tile: int=150, title: str='I
         _info(f"[grid] placeholder rendered for empty items, bytes={len(blob)}")
         return blob
 
+    # цены — одной колонкой: по ней и сортировка, и уровни фона для всех плиток сразу
+    prices = inventory_pricing.price_column(items, fallback=False)
     if not KEEP_INPUT_ORDER:
-        items = sorted(items, key=lambda x: x.get('priceInfo', {}).get('value') or 0, reverse=True)
+        order = inventory_pricing.sort_order(prices)
+        items = [items[i] for i in order]
+        prices = [int(prices[i]) for i in order]
+    tiers = inventory_pricing.tier_names(prices, *_tier_thresholds())
     ids = [int(x['assetId']) for x in items if 'assetId' in x]
 
-    # pick smallest reasonable thumb size for this tile unless forced
-    if THUMB_SIZE_FORCE:
-        size = THUMB_SIZE
-    else:
-        # cheap heuristic: 150->150, 250->250, else 420
-        if tile <= 150:
-            size = '150x150'
-        elif tile <= 250:
-            size = '250x250'
-        else:
-            size = '420x420'
-    _info(f"[grid] start items={n} tile={tile} size={size}")
-    thumbs = await _fetch_thumbs(ids, size=size)
+    size = _thumb_size_for_tile(tile)
+    _info(f"[grid] start items={n} tile={tile} size={size} prefetched={len(thumbs or {})}")
+    # превью, скачанные заранее (ThumbPrefetcher), повторно не качаем
+    thumbs = dict(thumbs or {})
+    missing = [a for a in ids if a not in thumbs]
+    if missing:
+        thumbs.update(await _fetch_thumbs(missing, size=size))
 
     # --- square-ish grid: pick cols = ceil(sqrt(n)), rows = ceil(n/cols)
     if n == 0:
@@ -1301,15 +1355,8 @@ async def _render_grid(items: List[Dict[str, Any]], tile: int=150, title: str='I
 
     async def render_one(idx: int, it: Dict[str, Any]) -> tuple[int, Image.Image]:
         aid = int(it.get('assetId') or 0)
-
-        # tile key (prefer newest helper if exists)
-        try:
-            tkey = _tile_cache_key(it, tile)  # type: ignore
-        except Exception:
-            price = _price_of(it)
-            tier = _tier_by_price(price)
-            name = str(it.get('name') or '').strip().upper()
-            tkey = _tile_cache_key(aid, tile, tier, price, name)  # type: ignore
+        price, tier = int(prices[idx]), tiers[idx]
+        tkey = _tile_cache_key(it, tile, price)
 
         # RAM hit
         hit = _tile_mem_get(tkey)
@@ -1332,7 +1379,7 @@ async def _render_grid(items: List[Dict[str, Any]], tile: int=150, title: str='I
             thumb = Image.new('RGBA', (tile - 12, tile - 26), (70, 80, 96, 255))
 
         async with cpu_sem:
-            im = await asyncio.to_thread(_render_tile, it, thumb, tile)
+            im = await asyncio.to_thread(_render_tile, it, thumb, tile, price, tier)
 
         # encode + store (not holding cpu_sem)
         try:
@@ -1383,11 +1430,13 @@ async def generate_full_inventory_grid(
     pad: int = 6,
     username: Optional[str] = None,
     user_id: Optional[int] = None,
-    title: Optional[str] = None
+    title: Optional[str] = None,
+    thumbs: Optional[Dict[int, Any]] = None
 ) -> bytes:
     lang = get_current_lang()
     default_title = tr(lang, 'inventory.full_title')
-    return await _render_grid(items, tile=tile, title=(title or default_title), username=username, user_id=user_id)
+    return await _render_grid(items, tile=tile, title=(title or default_title), username=username, user_id=user_id,
+                              thumbs=thumbs)
 
 
 # Добавить в функцию generate_inventory_preview параметр is_public
@@ -1438,18 +1487,26 @@ async def generate_inventory_preview(
         username: Optional[str] = None,
         is_public: bool = False  # НОВЫЙ ПАРАМЕТР
 ) -> bytes:
-    if is_public:
-        from roblox_client import get_inventory_public_ultra_fast
-        data = await get_inventory_public_ultra_fast(roblox_id)
-    else:
-        from roblox_client import get_full_inventory
-        data = await get_full_inventory(tg_id, roblox_id)
-
+    # превью качаются, пока догружаются остальные страницы инвентаря
+    from roblox_client import iter_inventory, PUBLIC_MODE_TIMEOUT
+    prefetch = ThumbPrefetcher(tile=150)
     items: List[Dict[str, Any]] = []
-    for arr in (data.get('byCategory') or {}).values():
-        items.extend(arr)
+
+    async def _collect():
+        async for batch in iter_inventory(roblox_id, tg_id, public=is_public):
+            items.extend(batch['items'])
+            prefetch.add(batch['items'])
+
+    try:
+        await asyncio.wait_for(_collect(), timeout=PUBLIC_MODE_TIMEOUT if is_public else None)
+    except asyncio.TimeoutError:
+        _info(f"[grid] preview timeout for {roblox_id}, items so far={len(items)}")
+    except Exception as e:
+        _err(f"[grid] preview inventory failed for {roblox_id}", e)
+    thumbs = await prefetch.get([int(x['assetId']) for x in items if x.get('assetId')])
     lang = get_current_lang()
-    return await _render_grid(items, tile=150, title=tr(lang, 'inventory.title'), username=username, user_id=tg_id)
+    return await _render_grid(items, tile=150, title=tr(lang, 'inventory.title'), username=username, user_id=tg_id,
+                              thumbs=thumbs)
 
 
 import re as _re_cat
@@ -1513,7 +1570,7 @@ async def generate_category_sheets(
         from roblox_client import get_full_inventory
         data = await get_full_inventory(tg_id, roblox_id)
         items = (data.get('byCategory') or {}).get(category, [])
-    price_map = load_prices_csv_cached()
+    price_map = await asyncio.to_thread(load_price_map, items)
     items = [_enrich_with_csv(x, price_map) for x in items]
     if limit and limit > 0:
         items = items[:limit]
@@ -1533,8 +1590,9 @@ async def generate_rap_sheet(tg_id: int, roblox_id: int, *, cookie: Optional[str
     from roblox_client import calc_user_rap
     data = await calc_user_rap(roblox_id, cookie=cookie)
     items = data.get("items") or []
-    price_map = load_prices_csv_cached()
-    items = [_enrich_with_csv({"assetId": it.get("assetId"), "name": it.get("name"), "priceInfo": {"value": it.get("rap", 0)}}, price_map) for it in items]
+    norm = [{"assetId": it.get("assetId"), "name": it.get("name"), "priceInfo": {"value": it.get("rap", 0)}} for it in items]
+    price_map = await asyncio.to_thread(load_price_map, norm)
+    items = [_enrich_with_csv(x, price_map) for x in norm]
     lang = get_current_lang()
     ttl = title or tr(lang, "rap.title")
     return await _render_grid(items, tile=tile, title=ttl, username=None, user_id=tg_id)
@@ -1543,9 +1601,9 @@ async def generate_offsale_sheet(tg_id: int, roblox_id: int, *, cookie: Optional
     from roblox_client import get_offsale_collectibles
     data = await get_offsale_collectibles(roblox_id, cookie=cookie)
     items = data or []
-    price_map = load_prices_csv_cached()
     # Use RAP as price value for rendering
     norm = [{"assetId": it.get("assetId"), "name": it.get("name"), "priceInfo": {"value": it.get("rap", 0)}} for it in items]
+    price_map = await asyncio.to_thread(load_price_map, norm)
     items = [_enrich_with_csv(x, price_map) for x in norm]
     lang = get_current_lang()
     ttl = title or tr(lang, "offsale.title")
@@ -24,6 +24,9 @@ from roblox_client import (
     get_full_inventory_with_cookie,
 )
 
+import asset_meta
+import storage
+
 # Image rendering (same style as inventory)
 try:
     import roblox_imagegen as imggen
@@ -48,35 +51,17 @@ def _coerce_int(v) -> int:
             return 0
 
 
-def _is_collectible(detail: dict) -> bool:
-    """
-    Return True only if itemRestrictions explicitly mark the item as Collectible.
-    We ignore collectibleItemId, collectibleId and assetTypeShort heuristics
-    to avoid overcounting.
-    """
-    if not isinstance(detail, dict):
-        return False
-    restr = detail.get("itemRestrictions") or []
-    if not isinstance(restr, list):
-        return False
-    try:
-        return any(str(x).strip().lower() == "collectible" for x in restr)
-    except Exception:
-        return False
-
-
 async def _catalog_details(asset_ids: List[int], cookie: Optional[str]) -> List[dict]:
-    # Prefer your client's batch details when available
+    # Always live catalog details: sale status (isForSale, lowestResalePrice) is not kept in the stores.
+    # Batches are shared with concurrent callers; fetched details still update the price/asset stores.
     t0 = time.time()
     try:
-        from roblox_client import _catalog_batch_fast as details_batch
-        items = [{"itemType": "Asset", "id": int(a)} for a in asset_ids]
-        out: List[dict] = []
-        for i in range(0, len(items), 100):
-            chunk = items[i:i + 100]
-            rows = await details_batch(chunk, cookie, retries=2)
-            if rows:
-                out.extend(rows)
+        from roblox_client import _CATALOG_AGG, _store_prices_bulk
+        out: List[dict] = await _CATALOG_AGG.fetch([int(a) for a in asset_ids], cookie)
+        try:
+            _store_prices_bulk(out)
+        except Exception as e:
+            log.debug(f"[details] store write failed: {e}")
         log.debug(f"[details] ok items={len(asset_ids)} rows={len(out)} dt={time.time()-t0:.3f}s")
         return out
     except Exception as e:
@@ -99,7 +84,9 @@ async def _resale_data(asset_id: int, cookie: Optional[str]) -> dict:
     try:
         async with httpx.AsyncClient(timeout=HTTP_T) as cli:
             headers = {"Cookie": f".ROBLOSECURITY={cookie}"} if cookie else None
+            t0 = time.time()
             r = await cli.get(url, headers=headers)
+            storage.note_cookie_result(cookie, r.status_code, (time.time() - t0) * 1000)
             if r.status_code >= 400:
                 return {}
             return r.json() or {}
@@ -169,7 +156,7 @@ async def inventory_collectibles(uid: int, cookie: Optional[str]) -> Dict[str, A
 
     # Pull catalog details only once; thumbnail + restrictions + etc.
     details = await _catalog_details(uniq, cookie)
-    col = [d for d in details if _is_collectible(d)]
+    col = [d for d in details if asset_meta.is_collectible(d)]
     items = [
         {
             "assetId": _coerce_int(d.get("id") or d.get("assetId")),
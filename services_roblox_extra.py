@@ -3,6 +3,8 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import os
+import time
 from typing import Dict, Any, List, Optional
 
 import httpx
@@ -127,8 +129,14 @@ async def get_past_usernames(uid: int, page: int = 1, per_page: int = 15) -> Dic
 
 # ---------------------------- Revenue (Sales) ----------------------------
 
+REVENUE_FETCH_LIMIT = 100  # rows per economy request; UI page size only slices the buffer
+REVENUE_MAX_PAGES = int(os.getenv('REVENUE_MAX_PAGES', '500'))  # safety cap on one cursor chain
+REVENUE_FEED_TTL = int(os.getenv('REVENUE_FEED_TTL', '300'))  # buffer older than this is re-walked, sec
+REVENUE_PREFETCH_DELAY = float(os.getenv('REVENUE_PREFETCH_DELAY', '0.2'))  # pause between background pages, sec
+
+
 async def _fetch_revenue_page(uid: int, cookie: str, cursor: Optional[str], per_page: int) -> Dict[str, Any]:
-    """Fetch one Economy 'Sale' page. Returns dict {rows, next_cursor} or raises on fatal auth."""
+    """Fetch one Economy 'Sale' page. Returns dict {rows, next[, failed]} or raises on fatal auth."""
     proxy = PROXY_POOL.any() if PROXY_POOL else None
     client = await get_client(proxy)
     limit = _quantize_limit(per_page)
@@ -167,12 +175,101 @@ async def _fetch_revenue_page(uid: int, cookie: str, cursor: Optional[str], per_
         raise
     except Exception as e:
         logger.exception("revenue_page failed: %s", e)
-        return {"rows": [], "next": None}
+        # not the end of the chain: the feed keeps its cursor and resumes on the next request
+        return {"rows": [], "next": cursor, "failed": True}
+
+
+class _RevenueFeed:
+    """
+    All-time Sales of one account: the cursor chain is walked once in the background,
+    rows accumulate in a buffer with a running total, pages are slices of that buffer.
+    """
+
+    def __init__(self, uid: int, cookie: str):
+        self.uid = int(uid)
+        self.cookie = cookie
+        self.rows: List[Dict[str, Any]] = []
+        self.total_sum = 0
+        self.cursor: Optional[str] = None
+        self.pages_fetched = 0
+        self.complete = False  # chain walked to the end (or to REVENUE_MAX_PAGES)
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self._task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def stale(self, now: float) -> bool:
+        return not self.running and now - self.created >= REVENUE_FEED_TTL
+
+    def start(self) -> None:
+        """Starts (or resumes after a failed page) the background walk."""
+        if self.complete or self.error or self.running:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    def _notify(self) -> None:
+        ev, self._changed = self._changed, asyncio.Event()
+        ev.set()
+
+    async def _run(self) -> None:
+        try:
+            while self.pages_fetched < REVENUE_MAX_PAGES:
+                resp = await _fetch_revenue_page(self.uid, self.cookie, self.cursor, REVENUE_FETCH_LIMIT)
+                if resp.get("failed"):
+                    return
+                rows = resp.get("rows") or []
+                self.rows.extend(rows)
+                self.total_sum += sum(int(x.get("raw_amount") or 0) for x in rows)
+                self.cursor = resp.get("next")
+                self.pages_fetched += 1
+                if not self.cursor:
+                    self.complete = True
+                    return
+                self._notify()
+                if REVENUE_PREFETCH_DELAY > 0:
+                    await asyncio.sleep(REVENUE_PREFETCH_DELAY)
+            logger.warning("revenue uid=%s: stopped at %s pages", self.uid, self.pages_fetched)
+            self.complete = True
+        except PermissionError:
+            self.error = "auth_required"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("revenue prefetch uid=%s failed: %s", self.uid, e)
+        finally:
+            logger.debug("revenue uid=%s: %s rows, %s pages, complete=%s",
+                         self.uid, len(self.rows), self.pages_fetched, self.complete)
+            self._notify()
+
+    async def wait_rows(self, need: int) -> None:
+        """Waits until the buffer holds `need` rows or the walk stops (end, auth error, failed page)."""
+        self.start()
+        while len(self.rows) < need and self.running:
+            await self._changed.wait()
+
+
+_REVENUE_FEEDS: Dict[int, _RevenueFeed] = {}
+
+
+def _revenue_feed(uid: int, cookie: str) -> _RevenueFeed:
+    now = time.time()
+    for k in [k for k, f in _REVENUE_FEEDS.items() if f.stale(now)]:
+        del _REVENUE_FEEDS[k]
+    feed = _REVENUE_FEEDS.get(int(uid))
+    if feed is None or feed.cookie != cookie:
+        feed = _REVENUE_FEEDS[int(uid)] = _RevenueFeed(uid, cookie)
+    return feed
+
 
 async def get_revenue(uid: int, enc_cookie: str, page: int = 1, per_page: int = 25) -> Dict[str, Any]:
     """
-    Paged revenue (Sales) view.
-    Returns dict with keys: rows, page, pages, has_prev, has_next, summary_sum
+    Paged revenue (Sales) view over the account's revenue buffer.
+    Returns dict with keys: rows, page, pages, has_prev, has_next, summary_sum (this page),
+    total_sum / total_count (all time so far), complete (False while the background walk is still running).
     On missing/invalid cookie -> {"error": "auth_required"}.
     """
     logger.debug("get_revenue uid=%s page=%s per_page=%s", uid, page, per_page)
@@ -186,62 +283,37 @@ async def get_revenue(uid: int, enc_cookie: str, page: int = 1, per_page: int =
     if not cookie:
         return {"error": "auth_required"}
 
-    # cursor paging via cache
-    pp = _quantize_limit(per_page)
+    pp = max(1, int(per_page or 25))
     page = max(1, int(page))
-    cursor_key = f"rev:cursor:{int(uid)}:pp{pp}"
-    cursors: List[Optional[str]] = [None]  # cursor[1] is for page=1 start
     try:
-        saved = await cache.get_json(cursor_key, 60*60)
-        if isinstance(saved, list) and saved:
-            cursors = saved
-    except Exception:
-        pass
-
-    # ensure cursors list long enough
-    while len(cursors) <= page:
-        cursors.append(None)
-
-    # walk pages until desired page, saving cursors along the way
-    cur = cursors[page-1]
-    if page == 1:
-        cur = None
-
-    summary_sum = 0
-    rows: List[Dict[str, Any]] = []
-
-    try:
-        resp = await _fetch_revenue_page(uid, cookie, cur, pp)
-        rows = resp.get("rows", [])
-        nxt = resp.get("next")
-        # store cursor for next page index
-        if len(cursors) <= page:
-            cursors.extend([None] * (page - len(cursors) + 1))
-        cursors[page] = nxt
-        try:
-            await cache.set_json(cursor_key, cursors, 60*60)  # positional ttl arg
-        except Exception:
-            pass
-
-        # we can't know total pages without traversing, so infer has_next by presence of next cursor
-        has_next = bool(nxt)
-        has_prev = page > 1
-        # compute summary sum for shown page (if нужно all-time — понадобился бы проход)
-        summary_sum = sum(int(x.get("raw_amount", 0)) for x in rows)
-
+        feed = _revenue_feed(uid, cookie)
+        # one row past the page tells whether there is a next one
+        await feed.wait_rows(page * pp + 1)
+        if feed.error:
+            _REVENUE_FEEDS.pop(int(uid), None)
+            return {"error": feed.error}
+
+        known_pages = max(1, (len(feed.rows) + pp - 1) // pp)
+        if feed.complete:
+            page = min(page, known_pages)
+        start = (page - 1) * pp
+        rows = feed.rows[start:start + pp]
+        has_next = len(feed.rows) > start + pp or not feed.complete
         return {
             "rows": rows,
             "page": page,
-            "pages": page + (1 if has_next else 0),
-            "has_prev": has_prev,
+            "pages": known_pages if feed.complete else max(known_pages, page + (1 if has_next else 0)),
+            "has_prev": page > 1,
             "has_next": has_next,
-            "summary_sum": summary_sum,
+            "summary_sum": sum(int(x.get("raw_amount", 0)) for x in rows),
+            "total_sum": feed.total_sum,
+            "total_count": len(feed.rows),
+            "complete": feed.complete,
         }
-    except PermissionError:
-        return {"error": "auth_required"}
     except Exception as e:
         logger.exception("get_revenue failed: %s", e)
-        return {"rows": [], "page": page, "pages": page, "has_prev": page > 1, "has_next": False, "summary_sum": 0}
+        return {"rows": [], "page": page, "pages": page, "has_prev": page > 1, "has_next": False, "summary_sum": 0,
+                "total_sum": 0, "total_count": 0, "complete": False}
 
 # ---------------------------- Favorite games passthrough ----------------------------
 
@@ -1,18 +1,142 @@
 
 import aiosqlite
+import asyncio
+import hashlib
 import json
 import logging
+import statistics
 from pathlib import Path
-from typing import Optional, Dict, List, Tuple, Any
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, List, Tuple, Any, AsyncIterator
 from datetime import datetime, timedelta
 import os
+import time
 
-from util.crypto import decrypt_text
+from util.crypto import decrypt_text_async, decrypt_many
 
 DB_PATH = Path(os.getenv('AUTH_DB', 'data/authorized.db'))
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 DB_STR = str(DB_PATH)
 
+# Раздельные файлы, чтобы частые записи кэша и метрик не делили блокировку записи с логином/куками:
+#   auth      — authorized_users, user_cookies, account_snapshots(+history)
+#   cache     — user_cache, spending_ledger(+sync) (перекачивается из API, если файл потерян)
+#   telemetry — bot_users (last_seen пишется на каждое сообщение), metrics_events(+daily), stats_daily, cookie_health
+CACHE_DB_PATH = Path(os.getenv('CACHE_DB', 'data/cache.db'))
+CACHE_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+CACHE_DB_STR = str(CACHE_DB_PATH)
+
+TELEMETRY_DB_PATH = Path(os.getenv('TELEMETRY_DB', 'data/telemetry.db'))
+TELEMETRY_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+TELEMETRY_DB_STR = str(TELEMETRY_DB_PATH)
+
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', '10'))  # сек
+
+
+class _SqlitePool:
+    """
+    Пул соединений к одному файлу SQLite. Соединение выдаётся в монопольное пользование
+    (транзакции не перемешиваются), PRAGMA выполняются один раз при открытии.
+    ATTACH соседних файлов тут сознательно нет: BEGIN IMMEDIATE берёт блокировку записи
+    на все подключённые БД, и разделение файлов потеряло бы смысл.
+    """
+
+    def __init__(self, path: str, size: int, pragmas: List[str]):
+        self.path = path
+        self.size = max(1, int(size))
+        self.pragmas = pragmas
+        self._idle: List[aiosqlite.Connection] = []
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def _open(self) -> aiosqlite.Connection:
+        conn = aiosqlite.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT)
+        conn.daemon = True  # простаивающие соединения пула не должны держать процесс при выходе
+        db = await conn
+        for pragma in self.pragmas:
+            await db.execute(f'PRAGMA {pragma}')
+        return db
+
+    async def _bind(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is self._loop:
+            return
+        # новый event loop (скрипты с asyncio.run): семафор старого цикла здесь не работает
+        idle, self._idle = self._idle, []
+        self._loop = loop
+        self._sem = asyncio.Semaphore(self.size)
+        for db in idle:
+            try:
+                await db.close()
+            except Exception:
+                pass
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        await self._bind()
+        async with self._sem:
+            db = self._idle.pop() if self._idle else await self._open()
+            healthy = True
+            try:
+                yield db
+            finally:
+                db.row_factory = None
+                try:
+                    # незакоммиченное откатываем — как было при закрытии отдельного соединения
+                    if db.in_transaction:
+                        await db.rollback()
+                except Exception:
+                    healthy = False
+                if healthy and len(self._idle) < self.size:
+                    self._idle.append(db)
+                else:
+                    try:
+                        await db.close()
+                    except Exception:
+                        pass
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for db in idle:
+            try:
+                await db.close()
+            except Exception:
+                pass
+
+
+_auth_pool = _SqlitePool(
+    DB_STR, int(os.getenv('AUTH_DB_POOL', '4')),
+    ['journal_mode=WAL', 'synchronous=FULL'],
+)
+_cache_pool = _SqlitePool(
+    CACHE_DB_STR, int(os.getenv('CACHE_DB_POOL', '4')),
+    # кэш можно потерять при сбое — он перестраивается сам
+    ['journal_mode=WAL', 'synchronous=OFF', 'temp_store=MEMORY'],
+)
+_telemetry_pool = _SqlitePool(
+    TELEMETRY_DB_STR, int(os.getenv('TELEMETRY_DB_POOL', '2')),
+    # auto_vacuum действует только на новом файле, для старого см. migrate_enable_incremental_vacuum
+    ['auto_vacuum=INCREMENTAL', 'journal_mode=WAL', 'synchronous=NORMAL'],
+)
+
+
+def _auth_db():
+    return _auth_pool.connection()
+
+
+def _cache_db():
+    return _cache_pool.connection()
+
+
+def _telemetry_db():
+    return _telemetry_pool.connection()
+
+
+async def close_db() -> None:
+    """Закрывает соединения всех пулов (при остановке бота/скрипта)."""
+    for pool in (_auth_pool, _cache_pool, _telemetry_pool):
+        await pool.close()
+
 CREATE_USERS_SQL = '''
 CREATE TABLE IF NOT EXISTS authorized_users (
   telegram_id INTEGER NOT NULL,
@@ -65,6 +189,89 @@ CREATE TABLE IF NOT EXISTS user_cache (
 );
 '''
 
+# Локальный журнал трат (Purchase-транзакции economy API) по аккаунту; row — готовая строка истории
+CREATE_SPENDING_LEDGER_SQL = '''
+CREATE TABLE IF NOT EXISTS spending_ledger (
+    roblox_id INTEGER NOT NULL,
+    tx_id     TEXT NOT NULL,
+    created   TEXT,
+    amount    INTEGER NOT NULL DEFAULT 0,
+    creator   TEXT,
+    row       TEXT NOT NULL,
+    PRIMARY KEY (roblox_id, tx_id)
+) WITHOUT ROWID;
+'''
+
+# Состояние синхронизации журнала: resume_cursor — откуда докачивать старые страницы (хвост),
+# head_cursor — где оборвался проход с начала, не дойдя до уже известных транзакций (разрыв)
+CREATE_SPENDING_SYNC_SQL = '''
+CREATE TABLE IF NOT EXISTS spending_sync (
+    roblox_id     INTEGER PRIMARY KEY,
+    resume_cursor TEXT,
+    head_cursor   TEXT,
+    complete      INTEGER NOT NULL DEFAULT 0,
+    synced_at     REAL
+);
+'''
+
+# История снапшотов (append-only) с прореживанием: raw -> hourly -> daily
+CREATE_SNAPSHOT_HISTORY_SQL = '''
+CREATE TABLE IF NOT EXISTS account_snapshot_history (
+  roblox_id     INTEGER NOT NULL,
+  ts            INTEGER NOT NULL,
+  inventory_val INTEGER DEFAULT 0,
+  total_spent   INTEGER DEFAULT 0,
+  resolution    INTEGER DEFAULT 0,
+  PRIMARY KEY (roblox_id, ts)
+);
+'''
+
+# Здоровье кук для паблик-режима (ключ — sha256 от расшифрованной куки, см. cookie_fingerprint)
+CREATE_COOKIE_HEALTH_SQL = '''
+CREATE TABLE IF NOT EXISTS cookie_health (
+  cookie_hash           TEXT PRIMARY KEY,
+  last_success_at       REAL,
+  last_failure_at       REAL,
+  consecutive_failures  INTEGER DEFAULT 0,
+  rate_limited_count    INTEGER DEFAULT 0,
+  last_rate_limited_at  REAL,
+  latency_samples       TEXT DEFAULT '[]',
+  median_latency_ms     INTEGER,
+  updated_at            TEXT DEFAULT CURRENT_TIMESTAMP
+);
+'''
+
+# Какая кука (cookie_hash) последней отдала инвентарь этого roblox_id в паблик-режиме
+CREATE_COOKIE_AFFINITY_SQL = '''
+CREATE TABLE IF NOT EXISTS cookie_affinity (
+  roblox_id   INTEGER PRIMARY KEY,
+  cookie_hash TEXT NOT NULL,
+  hits        INTEGER DEFAULT 1,
+  updated_at  REAL NOT NULL
+);
+'''
+
+# Свёрнутые старые metrics_events: одна строка на (день, событие, пользователь)
+CREATE_METRICS_DAILY_SQL = '''
+CREATE TABLE IF NOT EXISTS metrics_events_daily (
+  day         TEXT NOT NULL,
+  event       TEXT NOT NULL,
+  telegram_id INTEGER NOT NULL DEFAULT 0,
+  cnt         INTEGER DEFAULT 0,
+  PRIMARY KEY (day, event, telegram_id)
+);
+'''
+
+# Дневные счётчики для админ-статистики (поддерживаются инкрементально, см. _bump_stat)
+CREATE_STATS_DAILY_SQL = '''
+CREATE TABLE IF NOT EXISTS stats_daily (
+  day    TEXT NOT NULL,
+  metric TEXT NOT NULL,
+  value  INTEGER DEFAULT 0,
+  PRIMARY KEY (day, metric)
+);
+'''
+
 # НОВАЯ таблица для хранения всех пользователей бота
 CREATE_BOT_USERS_SQL = '''
 CREATE TABLE IF NOT EXISTS bot_users (
@@ -82,7 +289,7 @@ CREATE TABLE IF NOT EXISTS bot_users (
 async def migrate_add_is_active_column():
     """Добавляет колонку is_active если её нет"""
     try:
-        async with aiosqlite.connect(DB_STR) as db:
+        async with _auth_db() as db:
             # Проверяем существует ли колонка
             cur = await db.execute("PRAGMA table_info(user_cookies)")
             columns = await cur.fetchall()
@@ -98,7 +305,7 @@ async def migrate_add_is_active_column():
 async def migrate_add_updated_at_to_snapshots():
     """Добавляет колонку updated_at в account_snapshots, если её нет"""
     try:
-        async with aiosqlite.connect(DB_STR) as db:
+        async with _auth_db() as db:
             cur = await db.execute("PRAGMA table_info(account_snapshots)")
             columns = await cur.fetchall()
             column_names = [col[1] for col in columns]
@@ -113,24 +320,182 @@ async def migrate_add_updated_at_to_snapshots():
     except Exception as e:
         logging.error(f"Migration updated_at failed: {e}")
 
+async def migrate_add_cookie_hash_column():
+    """Добавляет user_cookies.cookie_hash (для join с cookie_health) и заполняет его для старых строк"""
+    try:
+        async with _auth_db() as db:
+            cur = await db.execute("PRAGMA table_info(user_cookies)")
+            column_names = [col[1] for col in await cur.fetchall()]
+            if 'cookie_hash' not in column_names:
+                await db.execute('ALTER TABLE user_cookies ADD COLUMN cookie_hash TEXT')
+                logging.info("Added cookie_hash column to user_cookies")
+            # поиск куки по cookie_hash (cookie_affinity)
+            await db.execute('CREATE INDEX IF NOT EXISTS idx_user_cookies_hash ON user_cookies(cookie_hash)')
+
+            cur = await db.execute(
+                'SELECT telegram_id, roblox_id, enc_roblosecurity FROM user_cookies WHERE cookie_hash IS NULL'
+            )
+            rows = await cur.fetchall()
+            # расшифровка всей таблицы — пачками в пуле потоков, не в event loop
+            plains = await decrypt_many([enc for _, _, enc in rows])
+            updates = [
+                (cookie_fingerprint(plain), tg_id, rid)
+                for (tg_id, rid, _), plain in zip(rows, plains) if plain is not None
+            ]
+            if updates:
+                await db.executemany(
+                    'UPDATE user_cookies SET cookie_hash=? WHERE telegram_id=? AND roblox_id=?', updates
+                )
+            await db.commit()
+    except Exception as e:
+        logging.error(f"Migration cookie_hash failed: {e}")
+
+async def migrate_add_spending_head_cursor():
+    """Добавляет spending_sync.head_cursor (прогресс головы отдельно от курсора хвоста), если его нет"""
+    try:
+        async with _cache_db() as db:
+            cur = await db.execute("PRAGMA table_info(spending_sync)")
+            column_names = [col[1] for col in await cur.fetchall()]
+            if 'head_cursor' not in column_names:
+                await db.execute('ALTER TABLE spending_sync ADD COLUMN head_cursor TEXT')
+                await db.commit()
+                logging.info("Added head_cursor column to spending_sync")
+    except Exception as e:
+        logging.error(f"Migration spending head_cursor failed: {e}")
+
+async def migrate_enable_incremental_vacuum():
+    """Переводит БД в auto_vacuum=INCREMENTAL (разовый полный VACUUM), чтобы чистка metrics_events отдавала место"""
+    try:
+        async with _telemetry_db() as db:
+            cur = await db.execute('PRAGMA auto_vacuum')
+            mode = (await cur.fetchone())[0]
+            if mode != 2:
+                await db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                await db.execute('VACUUM')
+                logging.info("Enabled incremental auto_vacuum")
+    except Exception as e:
+        logging.error(f"Migration auto_vacuum failed: {e}")
+
+# таблицы, переехавшие из authorized.db в отдельные файлы: имя -> (путь, DDL)
+_MOVED_TABLES = {
+    'user_cache': (CACHE_DB_STR, CREATE_CACHE_SQL),
+    'bot_users': (TELEMETRY_DB_STR, CREATE_BOT_USERS_SQL),
+    'metrics_events': (TELEMETRY_DB_STR, CREATE_METRICS_SQL),
+    'metrics_events_daily': (TELEMETRY_DB_STR, CREATE_METRICS_DAILY_SQL),
+    'stats_daily': (TELEMETRY_DB_STR, CREATE_STATS_DAILY_SQL),
+    'cookie_health': (TELEMETRY_DB_STR, CREATE_COOKIE_HEALTH_SQL),
+}
+
+
+async def migrate_split_databases():
+    """Разовый перенос user_cache/телеметрии из authorized.db в отдельные файлы (копия + DROP в одной транзакции)."""
+    moved = 0
+    try:
+        async with aiosqlite.connect(DB_STR, timeout=SQLITE_BUSY_TIMEOUT) as db:
+            for table, (path, _) in _MOVED_TABLES.items():
+                if os.path.abspath(path) == os.path.abspath(DB_STR):
+                    continue
+                cur = await db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,))
+                if await cur.fetchone() is None:
+                    continue
+                await db.execute('ATTACH DATABASE ? AS dst', (path,))
+                try:
+                    cur = await db.execute(f'PRAGMA main.table_info({table})')
+                    src_cols = [c[1] for c in await cur.fetchall()]
+                    cur = await db.execute(f'PRAGMA dst.table_info({table})')
+                    dst_cols = {c[1] for c in await cur.fetchall()}
+                    cols = ', '.join(c for c in src_cols if c in dst_cols)
+                    await db.execute('BEGIN IMMEDIATE')
+                    # если в новом файле уже что-то есть (бот успел поработать) — не дублируем
+                    await db.execute(f'INSERT OR IGNORE INTO dst.{table} ({cols}) SELECT {cols} FROM main.{table}')
+                    await db.execute(f'DROP TABLE main.{table}')
+                    await db.commit()
+                    moved += 1
+                    logging.info(f"[STORAGE] moved {table} -> {path}")
+                finally:
+                    await db.execute('DETACH DATABASE dst')
+            if moved:
+                await db.execute('VACUUM')
+    except Exception as e:
+        logging.error(f"Migration split databases failed: {e}")
+
+
 async def init_db():
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _auth_db() as db:
         await db.execute(CREATE_USERS_SQL)
-        await db.execute(CREATE_METRICS_SQL)
+        # для GROUP BY roblox_id / keyset-пагинации по roblox_id (PK начинается с telegram_id)
+        await db.execute('CREATE INDEX IF NOT EXISTS idx_authorized_users_roblox ON authorized_users(roblox_id)')
         await db.execute(CREATE_SNAPSHOTS_SQL)
+        await db.execute(CREATE_SNAPSHOT_HISTORY_SQL)
         await db.execute(CREATE_COOKIES_SQL)
+        await db.commit()
+    async with _cache_db() as db:
         await db.execute(CREATE_CACHE_SQL)
+        await db.execute(CREATE_SPENDING_LEDGER_SQL)
+        await db.execute(
+            'CREATE INDEX IF NOT EXISTS idx_spending_ledger_created ON spending_ledger(roblox_id, created DESC)'
+        )
+        await db.execute(CREATE_SPENDING_SYNC_SQL)
+        await db.commit()
+    async with _telemetry_db() as db:
+        await db.execute(CREATE_METRICS_SQL)
         await db.execute(CREATE_BOT_USERS_SQL)
+        await db.execute(CREATE_COOKIE_HEALTH_SQL)
+        await db.execute(CREATE_COOKIE_AFFINITY_SQL)
+        await db.execute(CREATE_STATS_DAILY_SQL)
+        await db.execute(CREATE_METRICS_DAILY_SQL)
         await db.commit()
 
     # Запускаем миграцию
+    await migrate_split_databases()
     await migrate_add_is_active_column()
     await migrate_add_updated_at_to_snapshots()
+    await migrate_add_cookie_hash_column()
+    await migrate_add_spending_head_cursor()
+    await migrate_enable_incremental_vacuum()
+
+    # первичное заполнение stats_daily из уже накопленных данных
+    async with _telemetry_db() as db:
+        cur = await db.execute('SELECT 1 FROM stats_daily LIMIT 1')
+        empty = await cur.fetchone() is None
+    if empty:
+        await rollup_stats_daily()
+
+
+# ====== STATS_DAILY ======
+# метрики: users_new, users_active, owners_delta (сумма = пользователи с аккаунтами),
+# cookies_saved (активные пары telegram_id+roblox_id в user_cookies, по дню saved_at),
+# event:<имя события из metrics_events>
+
+async def _bump_stat(db: aiosqlite.Connection, metric: str, delta: int = 1, day: Optional[str] = None) -> None:
+    """Инкремент счётчика за день day (по умолчанию — сегодня), в транзакции вызывающего."""
+    await db.execute('''
+        INSERT INTO stats_daily (day, metric, value) VALUES (COALESCE(?, date('now','localtime')), ?, ?)
+        ON CONFLICT(day, metric) DO UPDATE SET value = value + excluded.value
+    ''', (day, metric, int(delta)))
+
+
+async def _record_stat(metric: str, delta: int = 1, day: Optional[str] = None) -> None:
+    """Инкремент счётчика из кода, который пишет в auth-БД: отдельная короткая транзакция в telemetry.
+    Расхождение при сбое между двумя коммитами правится rollup_stats_daily()."""
+    try:
+        async with _telemetry_db() as db:
+            await _bump_stat(db, metric, delta, day)
+            await db.commit()
+    except Exception as e:
+        logging.error(f"[STORAGE] _record_stat({metric}) error: {e}")
 
 async def track_bot_user(telegram_id: int, username: str = None, first_name: str = None, last_name: str = None,
                          language_code: str = 'en'):
-    """Сохраняет/обновляет информацию о пользователе бота"""
-    async with aiosqlite.connect(DB_STR) as db:
+    """Сохраняет/обновляет информацию о пользователе бота (+ счётчики users_new/users_active)"""
+    async with _telemetry_db() as db:
+        # IMMEDIATE — чтобы два параллельных апдейта не посчитали юзера дважды
+        await db.execute('BEGIN IMMEDIATE')
+        cur = await db.execute(
+            "SELECT date(last_seen,'localtime') = date('now','localtime') FROM bot_users WHERE telegram_id=?",
+            (telegram_id,)
+        )
+        prev = await cur.fetchone()
         await db.execute('''
             INSERT INTO bot_users (telegram_id, username, first_name, last_name, last_seen, language_code)
             VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
@@ -141,12 +506,16 @@ async def track_bot_user(telegram_id: int, username: str = None, first_name: str
                 last_seen = CURRENT_TIMESTAMP,
                 language_code = excluded.language_code
         ''', (telegram_id, username, first_name, last_name, language_code))
+        if prev is None:
+            await _bump_stat(db, 'users_new')
+        if prev is None or not prev[0]:
+            await _bump_stat(db, 'users_active')
         await db.commit()
 
 
 async def get_all_bot_users() -> List[Tuple[int, str, str]]:
     """Возвращает список всех пользователей бота для рассылки (telegram_id, username, first_name)"""
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _telemetry_db() as db:
         cur = await db.execute('SELECT telegram_id, username, first_name FROM bot_users ORDER BY first_seen DESC')
         rows = await cur.fetchall()
         return [(row[0], row[1] or '', row[2] or '') for row in rows]
@@ -154,13 +523,16 @@ async def get_all_bot_users() -> List[Tuple[int, str, str]]:
 
 async def get_bot_users_count() -> int:
     """Возвращает общее количество пользователей бота"""
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _telemetry_db() as db:
         cur = await db.execute('SELECT COUNT(*) FROM bot_users')
         return (await cur.fetchone())[0]
 
 
 async def upsert_user(telegram_id: int, roblox_id: int, username: str, created_at: Optional[str]) -> None:
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _auth_db() as db:
+        await db.execute('BEGIN IMMEDIATE')
+        cur = await db.execute('SELECT 1 FROM authorized_users WHERE telegram_id=? LIMIT 1', (telegram_id,))
+        had_accounts = await cur.fetchone() is not None
         await db.execute(
             '''
             INSERT OR REPLACE INTO authorized_users (telegram_id, roblox_id, username, created_at)
@@ -169,10 +541,12 @@ async def upsert_user(telegram_id: int, roblox_id: int, username: str, created_a
             (telegram_id, roblox_id, username, created_at)
         )
         await db.commit()
+    if not had_accounts:
+        await _record_stat('owners_delta')
 
 
 async def get_user(telegram_id: int, roblox_id: int) -> Optional[Dict]:
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _auth_db() as db:
         cur = await db.execute(
             'SELECT username, created_at, linked_at FROM authorized_users WHERE telegram_id=? AND roblox_id=?',
             (telegram_id, roblox_id)
@@ -185,7 +559,7 @@ async def get_user(telegram_id: int, roblox_id: int) -> Optional[Dict]:
 
 async def get_user_by_roblox_id(roblox_id: int) -> Optional[Dict[str, Any]]:
     """Возвращает последнюю запись пользователя по roblox_id из authorized_users."""
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _auth_db() as db:
         cur = await db.execute('''
             SELECT telegram_id, username, created_at, linked_at
             FROM authorized_users
@@ -207,7 +581,7 @@ async def get_user_by_roblox_id(roblox_id: int) -> Optional[Dict[str, Any]]:
 async def list_users(telegram_id: int) -> List[Tuple[int, str]]:
     """Вернёт список (roblox_id, username) для клавиатуры."""
     try:
-        async with aiosqlite.connect(DB_STR) as db:
+        async with _auth_db() as db:
             cur = await db.execute(
                 "SELECT roblox_id, COALESCE(username, '') FROM authorized_users WHERE telegram_id=? ORDER BY linked_at DESC",
                 (telegram_id,)
@@ -222,7 +596,7 @@ async def list_users(telegram_id: int) -> List[Tuple[int, str]]:
 
 async def list_all_owners() -> List[int]:
     """Список всех tg id, у кого есть привязанные аккаунты."""
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _auth_db() as db:
         cur = await db.execute('SELECT DISTINCT telegram_id FROM authorized_users')
         rows = await cur.fetchall()
         return [int(r[0]) for r in rows]
@@ -230,25 +604,115 @@ async def list_all_owners() -> List[int]:
 
 async def get_all_users() -> List[Tuple[int]]:
     """Бэкапный метод для рассылки — просто возвращает все tg id из bot_users."""
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _telemetry_db() as db:
         cur = await db.execute('SELECT telegram_id FROM bot_users')
         return await cur.fetchall()
 
 
+# ====== DECRYPTED COOKIE VAULT ======
+COOKIE_VAULT_TTL = int(os.getenv('COOKIE_VAULT_TTL', '600'))  # сек
+
+# (telegram_id, roblox_id) -> (expires_at, enc, plain); enc храним, чтобы не отдать расшифровку от старой куки
+_cookie_vault: Dict[Tuple[int, int], Tuple[float, str, str]] = {}
+_vault_by_enc: Dict[str, Tuple[int, int]] = {}
+
+
+def _vault_get(key: Tuple[int, int], enc: str) -> Optional[str]:
+    hit = _cookie_vault.get(key)
+    if not hit:
+        return None
+    expires_at, enc_cached, plain = hit
+    if enc_cached != enc or expires_at < time.time():
+        _vault_drop(*key)
+        return None
+    return plain
+
+
+def _vault_put(key: Tuple[int, int], enc: str, plain: str) -> None:
+    _vault_drop(*key)
+    _cookie_vault[key] = (time.time() + COOKIE_VAULT_TTL, enc, plain)
+    _vault_by_enc[enc] = key
+
+
+def _vault_drop(telegram_id: int, roblox_id: int) -> None:
+    hit = _cookie_vault.pop((int(telegram_id), int(roblox_id)), None)
+    if hit:
+        _vault_by_enc.pop(hit[1], None)
+
+
+async def _decrypt_rows(rows: List[Tuple[int, int, str]]) -> List[Tuple[int, int, str, Optional[str]]]:
+    """(tg, rid, enc) -> (tg, rid, enc, plain|None): из vault, промахи — одной пачкой в пуле потоков."""
+    out: List[Tuple[int, int, str, Optional[str]]] = []
+    misses: List[int] = []
+    for tg_id, rid, enc in rows:
+        key = (int(tg_id), int(rid))
+        out.append((key[0], key[1], enc, _vault_get(key, enc)))
+        if out[-1][3] is None:
+            misses.append(len(out) - 1)
+    if misses:
+        plains = await decrypt_many([out[i][2] for i in misses])
+        for i, plain in zip(misses, plains):
+            tg_id, rid, enc, _ = out[i]
+            if plain is None:
+                logging.error(f"[STORAGE] decrypt cookie fail tg={tg_id} rid={rid}")
+                continue
+            _vault_put((tg_id, rid), enc, plain)
+            out[i] = (tg_id, rid, enc, plain)
+    return out
+
+
+async def decrypt_cookie_cached(enc: str) -> Optional[str]:
+    """Расшифровка одной enc-куки: из vault, если она там есть, иначе вне event loop (без кэширования)."""
+    key = _vault_by_enc.get(enc)
+    if key:
+        plain = _vault_get(key, enc)
+        if plain is not None:
+            return plain
+    res = await decrypt_many([enc])
+    return res[0]
+
+
 async def save_encrypted_cookie(telegram_id: int, roblox_id: int, enc_cookie: str) -> None:
-    async with aiosqlite.connect(DB_STR) as db:
+    try:
+        cookie_hash = cookie_fingerprint(await decrypt_text_async(enc_cookie))
+    except Exception:
+        cookie_hash = None
+    async with _auth_db() as db:
+        await db.execute('BEGIN IMMEDIATE')
+        cur = await db.execute(
+            'SELECT is_active FROM user_cookies WHERE telegram_id=? AND roblox_id=?',
+            (telegram_id, roblox_id)
+        )
+        row = await cur.fetchone()
+        was_active = bool(row and row[0])
+        # upsert, а не REPLACE: saved_at остаётся датой первого сохранения (по ней считает rollup_stats_daily)
         await db.execute(
             '''
-            INSERT OR REPLACE INTO user_cookies (telegram_id, roblox_id, enc_roblosecurity, is_active)
-            VALUES (?, ?, ?, TRUE)
+            INSERT INTO user_cookies (telegram_id, roblox_id, enc_roblosecurity, is_active, cookie_hash)
+            VALUES (?, ?, ?, TRUE, ?)
+            ON CONFLICT(telegram_id, roblox_id) DO UPDATE SET
+                enc_roblosecurity = excluded.enc_roblosecurity,
+                is_active = TRUE,
+                cookie_hash = excluded.cookie_hash
             ''',
-            (telegram_id, roblox_id, enc_cookie)
+            (telegram_id, roblox_id, enc_cookie, cookie_hash)
         )
+        day = None
+        if not was_active:
+            cur = await db.execute(
+                "SELECT date(saved_at,'localtime') FROM user_cookies WHERE telegram_id=? AND roblox_id=?",
+                (telegram_id, roblox_id)
+            )
+            day = (await cur.fetchone())[0]
         await db.commit()
+    _vault_drop(telegram_id, roblox_id)
+    # повторное сохранение активной куки (ежедневное обновление) — не новая кука, как и в rollup_stats_daily
+    if not was_active:
+        await _record_stat('cookies_saved', 1, day)
 
 
 async def get_encrypted_cookie(telegram_id: int, roblox_id: int) -> Optional[str]:
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _auth_db() as db:
         cur = await db.execute(
             'SELECT enc_roblosecurity FROM user_cookies WHERE telegram_id=? AND roblox_id=? AND is_active = TRUE',
             (telegram_id, roblox_id)
@@ -264,7 +728,18 @@ async def delete_cookie(telegram_id: int, roblox_id: int) -> None:
       - связку аккаунта из authorized_users
       - снапшот этого аккаунта из account_snapshots
     """
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _auth_db() as db:
+        await db.execute('BEGIN IMMEDIATE')
+        cur = await db.execute(
+            'SELECT COUNT(*), SUM(roblox_id = ?) FROM authorized_users WHERE telegram_id=?',
+            (roblox_id, telegram_id)
+        )
+        n_accounts, n_this = await cur.fetchone()
+        cur = await db.execute(
+            "SELECT date(saved_at,'localtime') FROM user_cookies WHERE telegram_id=? AND roblox_id=? AND is_active = TRUE",
+            (telegram_id, roblox_id)
+        )
+        active_cookie = await cur.fetchone()
         # кука
         await db.execute(
             'DELETE FROM user_cookies WHERE telegram_id=? AND roblox_id=?',
@@ -280,24 +755,42 @@ async def delete_cookie(telegram_id: int, roblox_id: int) -> None:
             'DELETE FROM account_snapshots WHERE roblox_id=?',
             (roblox_id,)
         )
-
+        await db.execute(
+            'DELETE FROM account_snapshot_history WHERE roblox_id=?',
+            (roblox_id,)
+        )
         await db.commit()
+    _vault_drop(telegram_id, roblox_id)
+    # последний аккаунт пользователя — он больше не считается "с аккаунтами"
+    if n_accounts == 1 and n_this:
+        await _record_stat('owners_delta', -1)
+    if active_cookie:
+        await _record_stat('cookies_saved', -1, active_cookie[0])
 
 
 
 async def deactivate_cookie(telegram_id: int, roblox_id: int) -> None:
     """Деактивирует куки (помечает как неактивную)"""
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _auth_db() as db:
+        await db.execute('BEGIN IMMEDIATE')
+        cur = await db.execute(
+            "SELECT date(saved_at,'localtime') FROM user_cookies WHERE telegram_id=? AND roblox_id=? AND is_active = TRUE",
+            (telegram_id, roblox_id)
+        )
+        active_cookie = await cur.fetchone()
         await db.execute(
             'UPDATE user_cookies SET is_active = FALSE WHERE telegram_id=? AND roblox_id=?',
             (telegram_id, roblox_id)
         )
         await db.commit()
+    _vault_drop(telegram_id, roblox_id)
+    if active_cookie:
+        await _record_stat('cookies_saved', -1, active_cookie[0])
 
 
 async def get_cached_data(roblox_id: int, key: str) -> Optional[Any]:
     """Получить данные из кэша"""
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _cache_db() as db:
         cur = await db.execute(
             "SELECT cache_data FROM user_cache WHERE roblox_id=? AND cache_key=? AND expires_at > datetime('now')",
             (roblox_id, key)
@@ -311,7 +804,7 @@ async def get_cached_data(roblox_id: int, key: str) -> Optional[Any]:
 async def set_cached_data(roblox_id: int, key: str, data: Any, ttl_minutes: int = 5) -> None:
     """Сохранить данные в кэш"""
     expires_at = datetime.now() + timedelta(minutes=ttl_minutes)
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _cache_db() as db:
         await db.execute(
             '''
             INSERT OR REPLACE INTO user_cache (roblox_id, cache_key, cache_data, expires_at)
@@ -324,24 +817,104 @@ async def set_cached_data(roblox_id: int, key: str, data: Any, ttl_minutes: int
 
 async def clear_user_cache(roblox_id: int) -> None:
     """Очистить кэш пользователя (при изменении данных)"""
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _cache_db() as db:
         await db.execute('DELETE FROM user_cache WHERE roblox_id=?', (roblox_id,))
         await db.commit()
 
 
 async def log_event(event: str, telegram_id: int | None, roblox_id: int | None) -> None:
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _telemetry_db() as db:
         await db.execute(
             'INSERT INTO metrics_events(event, telegram_id, roblox_id) VALUES (?, ?, ?)',
             (event, telegram_id, roblox_id)
         )
+        await _bump_stat(db, f'event:{event}')
         await db.commit()
 
 
 # ====== SNAPSHOTS API ======
+_SQL_CHUNK = 500  # лимит параметров в одном IN (...) — держим с запасом под SQLITE_MAX_VARIABLE_NUMBER
+
+
+def _chunks(seq: List[Any], size: int = _SQL_CHUNK):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+HISTORY_RAW_DAYS = int(os.getenv('SNAPSHOT_HISTORY_RAW_DAYS', '7'))
+HISTORY_HOURLY_DAYS = int(os.getenv('SNAPSHOT_HISTORY_HOURLY_DAYS', '90'))
+HISTORY_COMPACT_EVERY = int(os.getenv('SNAPSHOT_HISTORY_COMPACT_EVERY', '3600'))  # сек
+_history_compacted_at = 0.0
+
+_INSERT_HISTORY_SQL = '''
+    INSERT OR REPLACE INTO account_snapshot_history (roblox_id, ts, inventory_val, total_spent, resolution)
+    VALUES (?, ?, ?, ?, 0)
+'''
+
+
+async def _downsample_history(db: aiosqlite.Connection, older_than_ts: int, bucket: int) -> int:
+    """Схлопывает точки с разрешением < bucket старше older_than_ts в одну (последнюю) точку на bucket."""
+    # SQLite: голые колонки при MAX() берутся из строки с максимальным ts — это и есть последняя точка в бакете
+    cur = await db.execute('''
+        SELECT roblox_id, (ts / ?) * ?, MAX(ts), inventory_val, total_spent
+        FROM account_snapshot_history
+        WHERE resolution < ? AND ts < ?
+        GROUP BY roblox_id, ts / ?
+    ''', (bucket, bucket, bucket, older_than_ts, bucket))
+    rows = await cur.fetchall()
+    if not rows:
+        return 0
+    await db.execute(
+        'DELETE FROM account_snapshot_history WHERE resolution < ? AND ts < ?',
+        (bucket, older_than_ts)
+    )
+    await db.executemany('''
+        INSERT OR REPLACE INTO account_snapshot_history (roblox_id, ts, inventory_val, total_spent, resolution)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(int(r[0]), int(r[1]), int(r[3] or 0), int(r[4] or 0), bucket) for r in rows])
+    return len(rows)
+
+
+async def compact_snapshot_history(force: bool = False) -> int:
+    """Прореживание истории: raw за HISTORY_RAW_DAYS, дальше почасово до HISTORY_HOURLY_DAYS, потом подневно.
+    Без force запускается не чаще раза в HISTORY_COMPACT_EVERY секунд."""
+    global _history_compacted_at
+    now = time.time()
+    if not force and now - _history_compacted_at < HISTORY_COMPACT_EVERY:
+        return 0
+    _history_compacted_at = now
+
+    # границы выравниваем по бакетам, чтобы бакет не разрезался на raw и агрегат
+    hourly_cut = int(now - HISTORY_RAW_DAYS * 86400) // 3600 * 3600
+    daily_cut = int(now - HISTORY_HOURLY_DAYS * 86400) // 86400 * 86400
+    try:
+        async with _auth_db() as db:
+            n = await _downsample_history(db, hourly_cut, 3600)
+            n += await _downsample_history(db, daily_cut, 86400)
+            await db.commit()
+    except Exception as e:
+        logging.error(f"[compact_snapshot_history] failed: {e}")
+        return 0
+    if n:
+        logging.info(f"[compact_snapshot_history] buckets={n}")
+    return n
+
+
+async def schedule_snapshot_compaction(interval: Optional[int] = None) -> None:
+    """Фоновая задача: раз в interval секунд прореживает account_snapshot_history (не на пути записи снапшота)."""
+    every = HISTORY_COMPACT_EVERY if interval is None else int(interval)
+    while True:
+        try:
+            await compact_snapshot_history(force=True)
+        except Exception:
+            logging.exception("[compact_snapshot_history] failed")
+        await asyncio.sleep(every)
+
+
 async def upsert_account_snapshot(roblox_id: int, inventory_val: int = 0, total_spent: int = 0) -> None:
-    """Создаёт/обновляет снапшот по roblox_id."""
-    async with aiosqlite.connect(DB_STR) as db:
+    """Создаёт/обновляет снапшот по roblox_id и дописывает точку в account_snapshot_history."""
+    inv, spent = int(inventory_val or 0), int(total_spent or 0)
+    async with _auth_db() as db:
         await db.execute('''
             INSERT INTO account_snapshots (roblox_id, inventory_val, total_spent, updated_at)
             VALUES (?, ?, ?, CURRENT_TIMESTAMP)
@@ -349,12 +922,58 @@ async def upsert_account_snapshot(roblox_id: int, inventory_val: int = 0, total_
                 inventory_val = excluded.inventory_val,
                 total_spent   = excluded.total_spent,
                 updated_at    = CURRENT_TIMESTAMP
-        ''', (roblox_id, int(inventory_val or 0), int(total_spent or 0)))
+        ''', (roblox_id, inv, spent))
+        await db.execute(_INSERT_HISTORY_SQL, (roblox_id, int(time.time()), inv, spent))
         await db.commit()
 
 
+def _history_row(r) -> Dict[str, Any]:
+    return {
+        'ts': int(r[1]),
+        'inventory_val': int(r[2] or 0),
+        'total_spent': int(r[3] or 0),
+        'resolution': int(r[4] or 0),
+    }
+
+
+async def get_snapshot_history_many(roblox_ids: List[int], since_ts: Optional[int] = None,
+                                    until_ts: Optional[int] = None) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Ряды истории для нескольких аккаунтов: {roblox_id: [{ts, inventory_val, total_spent, resolution}, ...]}.
+    Точки отсортированы по ts; читаем только по индексу (roblox_id, ts), без обращений к Roblox.
+    """
+    ids = sorted({int(x) for x in roblox_ids})
+    out: Dict[int, List[Dict[str, Any]]] = {rid: [] for rid in ids}
+    if not ids:
+        return out
+    lo = int(since_ts) if since_ts is not None else 0
+    hi = int(until_ts) if until_ts is not None else 2 ** 62
+    async with _auth_db() as db:
+        for part in _chunks(ids):
+            marks = ','.join('?' * len(part))
+            cur = await db.execute(
+                f'''
+                SELECT roblox_id, ts, inventory_val, total_spent, resolution
+                FROM account_snapshot_history
+                WHERE roblox_id IN ({marks}) AND ts >= ? AND ts <= ?
+                ORDER BY roblox_id, ts
+                ''',
+                (*part, lo, hi)
+            )
+            for r in await cur.fetchall():
+                out[int(r[0])].append(_history_row(r))
+    return out
+
+
+async def get_snapshot_history(roblox_id: int, since_ts: Optional[int] = None,
+                               until_ts: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Ряд истории одного аккаунта (см. get_snapshot_history_many)."""
+    res = await get_snapshot_history_many([roblox_id], since_ts, until_ts)
+    return res.get(int(roblox_id), [])
+
+
 async def get_account_snapshot(roblox_id: int) -> Optional[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _auth_db() as db:
         cur = await db.execute('''
             SELECT roblox_id, inventory_val, total_spent, updated_at
             FROM account_snapshots WHERE roblox_id = ?
@@ -370,99 +989,265 @@ async def get_account_snapshot(roblox_id: int) -> Optional[Dict[str, Any]]:
         }
 
 
-async def snapshot_all_for_user(telegram_id: int, reason: str = 'manual') -> int:
-    """Создаёт снапшоты для всех аккаунтов пользователя."""
-    try:
-        async with aiosqlite.connect(DB_STR) as db:
-            cur = await db.execute('SELECT roblox_id FROM authorized_users WHERE telegram_id=?', (telegram_id,))
-            rows = await cur.fetchall()
-            rids = [int(r[0]) for r in rows]
-    except Exception as e:
-        logging.error(f"[snapshot_all_for_user] cannot fetch accounts: {e}")
+async def _bulk_snapshot_pairs(db: aiosqlite.Connection, pairs: List[Tuple[int, int]]) -> int:
+    """
+    Пакетный снапшот для списка (telegram_id, roblox_id):
+      - один SELECT по user_cache (файл кэша) на все кэшированные суммы,
+      - один SELECT по account_snapshots на все старые снапшоты,
+      - один executemany на все апсерты.
+    """
+    rids = sorted({rid for _, rid in pairs})
+    if not rids:
         return 0
 
-    count = 0
-    for rid in rids:
-        inv_key = f'inv_sum_v1_{telegram_id}_{rid}'
-        inv = await get_cached_data(rid, inv_key)
+    cached: Dict[Tuple[int, str], Any] = {}
+    old: Dict[int, Tuple[int, int]] = {}
+    async with _cache_db() as cdb:
+        for part in _chunks(rids):
+            marks = ','.join('?' * len(part))
+            cur = await cdb.execute(
+                f"""
+                SELECT roblox_id, cache_key, cache_data FROM user_cache
+                WHERE roblox_id IN ({marks})
+                  AND (cache_key = 'acc_spent_robux_v1' OR substr(cache_key, 1, 11) = 'inv_sum_v1_')
+                  AND expires_at > datetime('now')
+                """,
+                part
+            )
+            for rid, key, data in await cur.fetchall():
+                try:
+                    cached[(int(rid), key)] = json.loads(data)
+                except Exception:
+                    continue
+
+    for part in _chunks(rids):
+        marks = ','.join('?' * len(part))
+        cur = await db.execute(
+            f'SELECT roblox_id, inventory_val, total_spent FROM account_snapshots WHERE roblox_id IN ({marks})',
+            part
+        )
+        for rid, inv_val, spent in await cur.fetchall():
+            old[int(rid)] = (int(inv_val or 0), int(spent or 0))
+
+    rows: Dict[int, Tuple[int, int, int]] = {}
+    for tg_id, rid in pairs:
+        old_inv, old_spent = old.get(rid, (0, 0))
+
+        inv = cached.get((rid, f'inv_sum_v1_{tg_id}_{rid}'))
         if not isinstance(inv, int):
-            old = await get_account_snapshot(rid)
-            inv = old.get('inventory_val') if old else 0
+            # у другого владельца этого rid могла оказаться свежая сумма
+            prev = rows.get(rid)
+            inv = prev[1] if prev else old_inv
 
-        spent = await get_cached_data(rid, 'acc_spent_robux_v1')
+        spent = cached.get((rid, 'acc_spent_robux_v1'))
         try:
             spent = int(spent) if spent is not None else None
         except Exception:
             spent = None
         if spent is None:
-            old = await get_account_snapshot(rid)
-            spent = old.get('total_spent') if old else 0
+            spent = old_spent
 
-        await upsert_account_snapshot(rid, int(inv or 0), int(spent or 0))
-        count += 1
+        rows[rid] = (rid, int(inv or 0), int(spent or 0))
+
+    await db.executemany('''
+        INSERT INTO account_snapshots (roblox_id, inventory_val, total_spent, updated_at)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(roblox_id) DO UPDATE SET
+            inventory_val = excluded.inventory_val,
+            total_spent   = excluded.total_spent,
+            updated_at    = CURRENT_TIMESTAMP
+    ''', list(rows.values()))
+    now_ts = int(time.time())
+    await db.executemany(_INSERT_HISTORY_SQL, [(rid, now_ts, inv, spent) for rid, inv, spent in rows.values()])
+    await db.commit()
+    return len(rows)
+
+
+async def snapshot_all_for_user(telegram_id: int, reason: str = 'manual') -> int:
+    """Создаёт снапшоты для всех аккаунтов пользователя (одно соединение к auth-БД, пакетная запись)."""
+    try:
+        async with _auth_db() as db:
+            cur = await db.execute('SELECT roblox_id FROM authorized_users WHERE telegram_id=?', (telegram_id,))
+            pairs = [(telegram_id, int(r[0])) for r in await cur.fetchall()]
+            count = await _bulk_snapshot_pairs(db, pairs)
+    except Exception as e:
+        logging.error(f"[snapshot_all_for_user] user={telegram_id} failed: {e}")
+        return 0
 
     logging.info(f"[snapshot_all_for_user] user={telegram_id} reason={reason} saved={count}")
     return count
 
 
-async def admin_stats() -> dict:
-    async with aiosqlite.connect(DB_STR) as db:
-        # Users
-        cur = await db.execute('SELECT COUNT(*) FROM bot_users')
-        total_users = (await cur.fetchone())[0]
+async def snapshot_all_accounts(reason: str = 'manual') -> int:
+    """Создаёт снапшоты для всех привязанных аккаунтов всех пользователей (для админского экспорта)."""
+    try:
+        async with _auth_db() as db:
+            cur = await db.execute('SELECT telegram_id, roblox_id FROM authorized_users')
+            pairs = [(int(r[0]), int(r[1])) for r in await cur.fetchall()]
+            count = await _bulk_snapshot_pairs(db, pairs)
+    except Exception as e:
+        logging.error(f"[snapshot_all_accounts] failed: {e}")
+        return 0
+
+    logging.info(f"[snapshot_all_accounts] reason={reason} saved={count}")
+    return count
+
+
+async def rollup_stats_daily() -> int:
+    """
+    Полный пересчёт stats_daily из базовых таблиц (bot_users, authorized_users, user_cookies, metrics_events).
+    Нужен для первичного заполнения и для сверки, если счётчики разошлись.
+    users_active за прошлые дни восстановить нельзя — берётся только сегодняшний.
+    """
+    # auth-таблицы живут в другом файле: агрегаты читаем отдельно, пишем одной транзакцией в telemetry
+    async with _auth_db() as db:
+        cur = await db.execute('''
+            SELECT date('now','localtime'), 'owners_delta', COUNT(DISTINCT telegram_id) FROM authorized_users
+        ''')
+        auth_rows = list(await cur.fetchall())
+        cur = await db.execute('''
+            SELECT date(saved_at,'localtime'), 'cookies_saved', COUNT(*) FROM user_cookies
+            WHERE is_active = TRUE GROUP BY 1
+        ''')
+        auth_rows += list(await cur.fetchall())
+
+    async with _telemetry_db() as db:
+        await db.execute('BEGIN IMMEDIATE')
+        await db.execute('DELETE FROM stats_daily')
+        await db.execute('''
+            INSERT INTO stats_daily (day, metric, value)
+            SELECT date(first_seen,'localtime'), 'users_new', COUNT(*) FROM bot_users GROUP BY 1
+        ''')
+        await db.execute('''
+            INSERT INTO stats_daily (day, metric, value)
+            SELECT date('now','localtime'), 'users_active', COUNT(*) FROM bot_users
+            WHERE date(last_seen,'localtime') = date('now','localtime')
+        ''')
+        await db.executemany('INSERT INTO stats_daily (day, metric, value) VALUES (?, ?, ?)', auth_rows)
+        await db.execute('''
+            INSERT INTO stats_daily (day, metric, value)
+            SELECT date(created_at,'localtime'), 'event:' || event, COUNT(*) FROM metrics_events GROUP BY 1, 2
+        ''')
+        # события, уже свёрнутые compact_metrics_events (день может быть свёрнут частично)
+        await db.execute('''
+            INSERT INTO stats_daily (day, metric, value)
+            SELECT day, 'event:' || event, SUM(cnt) FROM metrics_events_daily WHERE 1 GROUP BY 1, 2
+            ON CONFLICT(day, metric) DO UPDATE SET value = value + excluded.value
+        ''')
+        await db.commit()
+        cur = await db.execute('SELECT COUNT(*) FROM stats_daily')
+        n = (await cur.fetchone())[0]
+    logging.info(f"[rollup_stats_daily] rows={n}")
+    return n
 
-        cur = await db.execute("SELECT COUNT(*) FROM bot_users WHERE date(first_seen)=date('now','localtime')")
-        new_today = (await cur.fetchone())[0]
 
-        cur = await db.execute("SELECT COUNT(*) FROM bot_users WHERE date(last_seen)=date('now','localtime')")
-        active_today = (await cur.fetchone())[0]
+# ====== METRICS RETENTION ======
+METRICS_RETENTION_DAYS = int(os.getenv('METRICS_RETENTION_DAYS', '30'))
+METRICS_COMPACT_BATCH = int(os.getenv('METRICS_COMPACT_BATCH', '2000'))
+METRICS_COMPACT_INTERVAL = int(os.getenv('METRICS_COMPACT_INTERVAL', str(6 * 3600)))  # сек
+METRICS_VACUUM_PAGES = int(os.getenv('METRICS_VACUUM_PAGES', '2000'))
 
-        # Users with linked accounts
-        cur = await db.execute('SELECT COUNT(*) FROM (SELECT DISTINCT telegram_id FROM authorized_users)')
-        users_with_accounts = (await cur.fetchone())[0]
 
-        # Checks (overall)
-        cur = await db.execute("SELECT COUNT(*) FROM metrics_events WHERE event='check'")
-        checks_total = (await cur.fetchone())[0]
-        cur = await db.execute("SELECT COUNT(*) FROM metrics_events WHERE event='check' AND date(created_at)=date('now','localtime')")
-        checks_today = (await cur.fetchone())[0]
+async def compact_metrics_events(retention_days: Optional[int] = None, batch: Optional[int] = None) -> int:
+    """
+    Сворачивает metrics_events старше retention_days в metrics_events_daily (день/событие/пользователь)
+    и удаляет сырые строки пачками по batch — каждая пачка в своей короткой транзакции,
+    чтобы не держать блокировку записи. В конце — PRAGMA incremental_vacuum.
+    Возвращает число удалённых сырых строк.
+    """
+    days = METRICS_RETENTION_DAYS if retention_days is None else int(retention_days)
+    size = METRICS_COMPACT_BATCH if batch is None else max(1, int(batch))
+    removed = 0
+    async with _telemetry_db() as db:
+        cur = await db.execute("SELECT datetime('now', ?)", (f'-{days} days',))
+        cutoff = (await cur.fetchone())[0]
+        last_id = 0
+        while True:
+            # старые строки лежат в начале по id, так что обход по PK без индекса на created_at дешёвый
+            cur = await db.execute('''
+                SELECT id, date(created_at,'localtime'), event, COALESCE(telegram_id, 0)
+                FROM metrics_events
+                WHERE id > ? AND created_at < ?
+                ORDER BY id
+                LIMIT ?
+            ''', (last_id, cutoff, size))
+            rows = await cur.fetchall()
+            if not rows:
+                break
+
+            agg: Dict[Tuple[str, str, int], int] = {}
+            for _, day, event, tg_id in rows:
+                k = (day, event, int(tg_id))
+                agg[k] = agg.get(k, 0) + 1
+
+            await db.executemany('''
+                INSERT INTO metrics_events_daily (day, event, telegram_id, cnt) VALUES (?, ?, ?, ?)
+                ON CONFLICT(day, event, telegram_id) DO UPDATE SET cnt = cnt + excluded.cnt
+            ''', [(d, e, t, c) for (d, e, t), c in agg.items()])
+            await db.execute(
+                'DELETE FROM metrics_events WHERE id BETWEEN ? AND ? AND created_at < ?',
+                (rows[0][0], rows[-1][0], cutoff)
+            )
+            await db.commit()
 
-        # Split by category
-        cur = await db.execute("SELECT COUNT(*) FROM metrics_events WHERE event='profile_check'")
-        profile_total = (await cur.fetchone())[0]
-        cur = await db.execute("SELECT COUNT(*) FROM metrics_events WHERE event='profile_check' AND date(created_at)=date('now','localtime')")
-        profile_today = (await cur.fetchone())[0]
+            removed += len(rows)
+            last_id = rows[-1][0]
+            if len(rows) < size:
+                break
+            await asyncio.sleep(0)  # отдаём цикл событий между пачками
 
-        cur = await db.execute("SELECT COUNT(*) FROM metrics_events WHERE event='inventory_check'")
-        inventory_total = (await cur.fetchone())[0]
-        cur = await db.execute("SELECT COUNT(*) FROM metrics_events WHERE event='inventory_check' AND date(created_at)=date('now','localtime')")
-        inventory_today = (await cur.fetchone())[0]
+        if removed:
+            # через execute прагма делает один шаг и освобождает одну страницу; executescript прогоняет её целиком
+            await db.executescript(f'PRAGMA incremental_vacuum({int(METRICS_VACUUM_PAGES)});')
 
-        cur = await db.execute("SELECT COUNT(*) FROM metrics_events WHERE event='favorites_check'")
-        favorites_total = (await cur.fetchone())[0]
-        cur = await db.execute("SELECT COUNT(*) FROM metrics_events WHERE event='favorites_check' AND date(created_at)=date('now','localtime')")
-        favorites_today = (await cur.fetchone())[0]
+    logging.info(f"[compact_metrics_events] retention={days}d removed={removed}")
+    return removed
 
-        cur = await db.execute("SELECT COUNT(*) FROM metrics_events WHERE event='spending_check'")
-        spending_total = (await cur.fetchone())[0]
-        cur = await db.execute("SELECT COUNT(*) FROM metrics_events WHERE event='spending_check' AND date(created_at)=date('now','localtime')")
-        spending_today = (await cur.fetchone())[0]
+
+async def schedule_metrics_compaction(interval: Optional[int] = None) -> None:
+    """Фоновая задача: раз в interval секунд сворачивает и чистит metrics_events."""
+    every = METRICS_COMPACT_INTERVAL if interval is None else int(interval)
+    while True:
+        try:
+            await compact_metrics_events()
+        except Exception:
+            logging.exception("[compact_metrics_events] failed")
+        await asyncio.sleep(every)
+
+
+async def admin_stats() -> dict:
+    """Админ-статистика из stats_daily: O(дней * метрик), без сканов по bot_users/metrics_events."""
+    async with _telemetry_db() as db:
+        cur = await db.execute('''
+            SELECT metric,
+                   SUM(value),
+                   SUM(CASE WHEN day = date('now','localtime') THEN value ELSE 0 END)
+            FROM stats_daily
+            GROUP BY metric
+        ''')
+        totals: Dict[str, int] = {}
+        today: Dict[str, int] = {}
+        for metric, total, td in await cur.fetchall():
+            totals[metric] = int(total or 0)
+            today[metric] = int(td or 0)
 
     return {
-        'total_users': total_users,
-        'new_today': new_today,
-        'active_today': active_today,
-        'users_with_accounts': users_with_accounts,
-        'checks_total': checks_total,
-        'checks_today': checks_today,
-        'profile_total': profile_total,
-        'profile_today': profile_today,
-        'inventory_total': inventory_total,
-        'inventory_today': inventory_today,
-        'favorites_total': favorites_total,
-        'favorites_today': favorites_today,
-        'spending_total': spending_total,
-        'spending_today': spending_today,
+        'total_users': totals.get('users_new', 0),
+        'new_today': today.get('users_new', 0),
+        'active_today': today.get('users_active', 0),
+        'users_with_accounts': totals.get('owners_delta', 0),
+        'cookies_total': totals.get('cookies_saved', 0),
+        'cookies_today': today.get('cookies_saved', 0),
+        'checks_total': totals.get('event:check', 0),
+        'checks_today': today.get('event:check', 0),
+        'profile_total': totals.get('event:profile_check', 0),
+        'profile_today': today.get('event:profile_check', 0),
+        'inventory_total': totals.get('event:inventory_check', 0),
+        'inventory_today': today.get('event:inventory_check', 0),
+        'favorites_total': totals.get('event:favorites_check', 0),
+        'favorites_today': today.get('event:favorites_check', 0),
+        'spending_total': totals.get('event:spending_check', 0),
+        'spending_today': today.get('event:spending_check', 0),
     }
 
 # --- ВНИЗ ФАЙЛА (после init_db/остальных функций) ---
@@ -472,7 +1257,7 @@ async def list_accounts_distinct() -> list[dict]:
     Берём из authorized_users + account_snapshots."""
     rows: list[dict] = []
     try:
-        async with aiosqlite.connect(DB_STR) as db:
+        async with _auth_db() as db:
             db.row_factory = aiosqlite.Row
             cur = await db.execute(
                 """
@@ -497,7 +1282,7 @@ async def get_any_encrypted_cookie_by_roblox_id(roblox_id: int) -> str | None:
     """Возвращает любую актуальную зашифрованную куку по roblox_id (последнюю по времени).
     Берём из user_cookies."""
     try:
-        async with aiosqlite.connect(DB_STR) as db:
+        async with _auth_db() as db:
             cur = await db.execute(
                 """
                 SELECT enc_roblosecurity
@@ -519,7 +1304,7 @@ async def export_snapshot_rows_for_user(telegram_id: int) -> list[tuple[str,int,
     (username, roblox_id, inventory_val, total_spent)
     Только те RID пользователя, по которым есть запись в account_snapshots.
     """
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _auth_db() as db:
         cur = await db.execute(
             """
             SELECT COALESCE(au.username, ''), au.roblox_id, 
@@ -534,7 +1319,7 @@ async def export_snapshot_rows_for_user(telegram_id: int) -> list[tuple[str,int,
 
 async def get_user_cookie_enc(telegram_id: int, roblox_id: int) -> str | None:
     """Возвращает enc_roblosecurity по RID для конкретного telegram_id (если активная есть)."""
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _auth_db() as db:
         cur = await db.execute(
             """SELECT enc_roblosecurity
                FROM user_cookies
@@ -550,7 +1335,7 @@ async def get_user_cookie_plain(telegram_id: int, roblox_id: int) -> str | None:
     Возвращает РАСШИФРОВАННУЮ roblosecurity для указанного юзера и RID.
     Берём последнюю активную запись. Если не нашли/не расшифровали — None.
     """
-    async with aiosqlite.connect(DB_STR) as db:
+    async with _auth_db() as db:
         cur = await db.execute(
             """SELECT enc_roblosecurity
                FROM user_cookies
@@ -559,63 +1344,295 @@ async def get_user_cookie_plain(telegram_id: int, roblox_id: int) -> str | None:
             (telegram_id, roblox_id)
         )
         row = await cur.fetchone()
-        if not row or not row[0]:
-            return None
-        enc = row[0]
-        try:
-            return decrypt_text(enc)
-        except Exception as e:
-            logging.error(f"[storage] decrypt cookie fail tg={telegram_id} rid={roblox_id}: {e}")
-            return None
+    if not row or not row[0]:
+        return None
+    (_, _, _, plain), = await _decrypt_rows([(telegram_id, roblox_id, row[0])])
+    return plain
+
+# ====== COOKIE HEALTH ======
+COOKIE_AFFINITY_TTL = int(os.getenv('COOKIE_AFFINITY_TTL', str(7 * 86400)))  # сек
+COOKIE_HEALTH_FLUSH_DELAY = float(os.getenv('COOKIE_HEALTH_FLUSH_DELAY', '5'))  # сек
+COOKIE_HEALTH_RATE_LIMIT_WINDOW = int(os.getenv('COOKIE_HEALTH_RATE_LIMIT_WINDOW', '600'))  # сек
+_LATENCY_SAMPLES = 21
+
+# накопленные в памяти результаты запросов: cookie_hash -> дельта, сбрасываются пачкой в cookie_health
+_health_pending: Dict[str, Dict[str, Any]] = {}
+_health_flush_task: Optional[asyncio.Task] = None
+# отложенный и синхронный (get_multiple_cookies_quick) сброс не должны идти параллельно:
+# оба читают счётчики и пишут INSERT OR REPLACE, второй затёр бы первый.
+# Lock привязан к циклу событий — создаётся лениво и заново для каждого нового цикла (asyncio.run в скриптах)
+_health_flush_lock: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Lock]] = None
+
+
+def _get_health_flush_lock() -> asyncio.Lock:
+    global _health_flush_lock
+    loop = asyncio.get_running_loop()
+    if _health_flush_lock is None or _health_flush_lock[0] is not loop:
+        _health_flush_lock = (loop, asyncio.Lock())
+    return _health_flush_lock[1]
+
+
+def cookie_fingerprint(cookie: str) -> str:
+    """Стабильный ключ куки для cookie_health (сама кука в таблицу не попадает)."""
+    return hashlib.sha256((cookie or '').strip().encode('utf-8')).hexdigest()[:32]
+
+
+def note_cookie_result(cookie: Optional[str], status: int, latency_ms: Optional[float] = None) -> None:
+    """
+    Учитывает результат запроса с кукой: 2xx — успех, 429 — rate limit, 401/403 — отказ.
+    Остальные статусы о куке ничего не говорят и игнорируются. Запись в БД — отложенная, пачкой.
+    """
+    if not cookie:
+        return
+    now = time.time()
+    d = _health_pending.setdefault(cookie_fingerprint(cookie), {
+        'last_success_at': None, 'last_failure_at': None, 'had_success': False,
+        'fails_since_success': 0, 'rate_limited': 0, 'last_rate_limited_at': None, 'latencies': [],
+    })
+    if 200 <= status < 300:
+        d['last_success_at'] = now
+        d['had_success'] = True
+        d['fails_since_success'] = 0
+        if latency_ms is not None:
+            d['latencies'].append(int(latency_ms))
+    elif status == 429:
+        d['rate_limited'] += 1
+        d['last_rate_limited_at'] = now
+    elif status in (401, 403):
+        d['last_failure_at'] = now
+        d['fails_since_success'] += 1
+    else:
+        return
+    _schedule_cookie_health_flush()
+
+
+def _schedule_cookie_health_flush() -> None:
+    global _health_flush_task
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    # задача чужого (уже закрытого) цикла этот цикл не сбросит — планируем свою
+    if _health_flush_task is not None and not _health_flush_task.done() and _health_flush_task.get_loop() is loop:
+        return
+
+    async def _later():
+        global _health_flush_task
+        await asyncio.sleep(COOKIE_HEALTH_FLUSH_DELAY)
+        await flush_cookie_health()
+        # результаты, пришедшие во время записи, не смогли запланировать сброс (эта задача ещё шла)
+        _health_flush_task = None
+        if _health_pending:
+            _schedule_cookie_health_flush()
+
+    _health_flush_task = loop.create_task(_later())
+
+
+async def flush_cookie_health() -> int:
+    """Сливает накопленные результаты в cookie_health одним executemany (сбросы идут по одному)."""
+    async with _get_health_flush_lock():
+        return await _flush_cookie_health_locked()
+
+
+async def _flush_cookie_health_locked() -> int:
+    global _health_pending
+    if not _health_pending:
+        return 0
+    pending, _health_pending = _health_pending, {}
+    keys = list(pending.keys())
+    try:
+        async with _telemetry_db() as db:
+            existing: Dict[str, tuple] = {}
+            for part in _chunks(keys):
+                marks = ','.join('?' * len(part))
+                cur = await db.execute(
+                    f'''
+                    SELECT cookie_hash, last_success_at, last_failure_at, consecutive_failures,
+                           rate_limited_count, last_rate_limited_at, latency_samples
+                    FROM cookie_health WHERE cookie_hash IN ({marks})
+                    ''',
+                    part
+                )
+                for r in await cur.fetchall():
+                    existing[r[0]] = r
+
+            rows = []
+            for key, d in pending.items():
+                _, ok_at, fail_at, consec, rl_cnt, rl_at, samples = existing.get(
+                    key, (key, None, None, 0, 0, None, '[]'))
+                try:
+                    lat = [int(x) for x in json.loads(samples or '[]')]
+                except Exception:
+                    lat = []
+                lat = (lat + d['latencies'])[-_LATENCY_SAMPLES:]
+                consec = d['fails_since_success'] if d['had_success'] else int(consec or 0) + d['fails_since_success']
+                rows.append((
+                    key,
+                    d['last_success_at'] or ok_at,
+                    d['last_failure_at'] or fail_at,
+                    consec,
+                    int(rl_cnt or 0) + d['rate_limited'],
+                    d['last_rate_limited_at'] or rl_at,
+                    json.dumps(lat),
+                    int(statistics.median(lat)) if lat else None,
+                ))
+            await db.executemany('''
+                INSERT OR REPLACE INTO cookie_health (
+                    cookie_hash, last_success_at, last_failure_at, consecutive_failures,
+                    rate_limited_count, last_rate_limited_at, latency_samples, median_latency_ms, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', rows)
+            await db.commit()
+            return len(rows)
+    except Exception as e:
+        logging.error(f"[STORAGE] flush_cookie_health() error: {e}")
+        return 0
+
 
 async def get_multiple_cookies_quick(limit: int = 5) -> list[str]:
     """
-    Возвращает массив последних активных enc_roblosecurity из user_cookies.
+    Возвращает массив активных enc_roblosecurity из user_cookies, лучшие по cookie_health — первыми:
+    сначала куки с последним успешным запросом, потом неизвестные, потом получившие 429
+    за COOKIE_HEALTH_RATE_LIMIT_WINDOW, потом падающие; внутри — по числу отказов подряд,
+    медианной задержке и дате сохранения.
     Используется в паблик-режиме, где важна скорость и не важна привязка к tg_id.
     """
+    await flush_cookie_health()
     try:
-        async with aiosqlite.connect(DB_STR) as db:
+        async with _auth_db() as db:
             cur = await db.execute(
                 """
-                SELECT enc_roblosecurity
+                SELECT telegram_id, roblox_id, enc_roblosecurity, cookie_hash
                 FROM user_cookies
                 WHERE is_active = TRUE
                 ORDER BY datetime(saved_at) DESC
-                LIMIT ?
-                """,
-                (limit,)
+                """
             )
-            rows = await cur.fetchall()
-            return [r[0] for r in rows if r and r[0]]
+            cookies = [r for r in await cur.fetchall() if r and r[2]]
+
+        # cookie_health лежит в telemetry-БД: JOIN между файлами не делаем, ранжируем в памяти
+        health: Dict[str, tuple] = {}
+        hashes = sorted({r[3] for r in cookies if r[3]})
+        async with _telemetry_db() as db:
+            for part in _chunks(hashes):
+                marks = ','.join('?' * len(part))
+                cur = await db.execute(
+                    f'''
+                    SELECT cookie_hash, last_success_at, consecutive_failures, last_rate_limited_at, median_latency_ms
+                    FROM cookie_health WHERE cookie_hash IN ({marks})
+                    ''',
+                    part
+                )
+                for r in await cur.fetchall():
+                    health[r[0]] = r
     except Exception as e:
         logging.error(f"[STORAGE] get_multiple_cookies_quick() error: {e}")
         return []
 
+    rl_since = time.time() - COOKIE_HEALTH_RATE_LIMIT_WINDOW
+
+    def _rank(row) -> tuple:
+        h = health.get(row[3])
+        if h is None:
+            return 1, 0, 1000000000
+        _, ok_at, consec, rl_at, median = h
+        consec = int(consec or 0)
+        # 429 говорит о нагрузке, а не о самой куке: штраф только пока он свежий, потом кука как неизвестная
+        if consec > 0:
+            tier = 3
+        elif (rl_at or 0) > rl_since:
+            tier = 2
+        else:
+            tier = 0 if ok_at is not None else 1
+        return tier, consec, median if median is not None else 1000000000
+
+    # сортировка устойчивая: при равном здоровье сохраняется порядок "свежие сохранённые — первыми"
+    rows = [r[:3] for r in sorted(cookies, key=_rank)[:limit]]
+    # прогреваем vault: вызывающие потом расшифруют эти enc через decrypt_cookie_cached без крипты
+    await _decrypt_rows(rows)
+    return [r[2] for r in rows]
+
+
+async def get_multiple_plain_cookies_quick(limit: int = 5) -> list[str]:
+    """То же, что get_multiple_cookies_quick, но сразу расшифрованные (через vault)."""
+    out: list[str] = []
+    for enc in await get_multiple_cookies_quick(limit):
+        plain = await decrypt_cookie_cached(enc)
+        if plain:
+            out.append(plain)
+    return out
+
+
+async def get_cookie_affinity(roblox_id: int) -> Optional[str]:
+    """
+    enc_roblosecurity куки, которая последней отдала инвентарь roblox_id (не старше COOKIE_AFFINITY_TTL).
+    None — привязки нет, она устарела или кука уже неактивна.
+    """
+    try:
+        async with _telemetry_db() as db:
+            cur = await db.execute(
+                'SELECT cookie_hash FROM cookie_affinity WHERE roblox_id=? AND updated_at>=?',
+                (int(roblox_id), time.time() - COOKIE_AFFINITY_TTL)
+            )
+            row = await cur.fetchone()
+        if not row:
+            return None
+        async with _auth_db() as db:
+            cur = await db.execute(
+                'SELECT enc_roblosecurity FROM user_cookies WHERE cookie_hash=? AND is_active = TRUE LIMIT 1',
+                (row[0],)
+            )
+            row = await cur.fetchone()
+        return row[0] if row and row[0] else None
+    except Exception as e:
+        logging.error(f"[STORAGE] get_cookie_affinity({roblox_id}) error: {e}")
+        return None
+
+
+async def set_cookie_affinity(roblox_id: int, cookie: str) -> None:
+    """Запоминает, что расшифрованная cookie видит инвентарь roblox_id (повтор той же куки — hits+1)."""
+    try:
+        async with _telemetry_db() as db:
+            await db.execute(
+                '''
+                INSERT INTO cookie_affinity (roblox_id, cookie_hash, hits, updated_at) VALUES (?, ?, 1, ?)
+                ON CONFLICT(roblox_id) DO UPDATE SET
+                    hits = CASE WHEN cookie_hash = excluded.cookie_hash THEN hits + 1 ELSE 1 END,
+                    cookie_hash = excluded.cookie_hash,
+                    updated_at = excluded.updated_at
+                ''',
+                (int(roblox_id), cookie_fingerprint(cookie), time.time())
+            )
+            await db.commit()
+    except Exception as e:
+        logging.error(f"[STORAGE] set_cookie_affinity({roblox_id}) error: {e}")
+
+
+async def drop_cookie_affinity(roblox_id: int) -> None:
+    """Забывает привязку (кука перестала видеть инвентарь этого roblox_id)."""
+    try:
+        async with _telemetry_db() as db:
+            await db.execute('DELETE FROM cookie_affinity WHERE roblox_id=?', (int(roblox_id),))
+            await db.commit()
+    except Exception as e:
+        logging.error(f"[STORAGE] drop_cookie_affinity({roblox_id}) error: {e}")
+
+
 async def get_all_cookies() -> list[str]:
     """
     Возвращает расшифрованные .ROBLOSECURITY из user_cookies (только активные).
     """
-    cookies: list[str] = []
     try:
-        async with aiosqlite.connect(DB_STR) as db:
+        async with _auth_db() as db:
             cur = await db.execute(
-                "SELECT enc_roblosecurity FROM user_cookies WHERE is_active = TRUE"
+                "SELECT telegram_id, roblox_id, enc_roblosecurity FROM user_cookies WHERE is_active = TRUE"
             )
-            rows = await cur.fetchall()
+            rows = [r for r in await cur.fetchall() if r[2]]
     except Exception as e:
         logging.error(f"[STORAGE] get_all_cookies() db error: {e}")
         return []
 
-    for (enc,) in rows:
-        if not enc:
-            continue
-        try:
-            cookies.append(decrypt_text(enc))
-        except Exception as e:
-            logging.error(f"[STORAGE] get_all_cookies() decrypt fail: {e}")
-            continue
-
-    return cookies
+    return [plain for _, _, _, plain in await _decrypt_rows(rows) if plain]
 
 async def get_all_plain_cookies() -> list[str]:
     """
@@ -623,31 +1640,21 @@ async def get_all_plain_cookies() -> list[str]:
     Каждая строка = отдельная кука.
     """
     try:
-        async with aiosqlite.connect(DB_STR) as db:
+        async with _auth_db() as db:
             cur = await db.execute(
                 """
-                SELECT enc_roblosecurity
+                SELECT telegram_id, roblox_id, enc_roblosecurity
                 FROM user_cookies
                 WHERE is_active = TRUE
                 ORDER BY datetime(saved_at) DESC
                 """
             )
-            rows = await cur.fetchall()
+            rows = [r for r in await cur.fetchall() if r[2]]
     except Exception as e:
         logging.error(f"[STORAGE] get_all_plain_cookies() db error: {e}")
         return []
 
-    cookies: list[str] = []
-    for (enc) in rows:
-        if not enc:
-            continue
-        try:
-            cookies.append(decrypt_text(enc))
-        except Exception as e:
-            logging.error(f"[STORAGE] decrypt in get_all_plain_cookies() failed: {e}")
-            continue
-
-    return cookies
+    return [plain for _, _, _, plain in await _decrypt_rows(rows) if plain]
 
 
 import aiosqlite
@@ -664,7 +1671,7 @@ async def get_all_cookies_with_ids() -> List[Tuple[int, int, str]]:
       список кортежей (telegram_id, roblox_id, enc_roblosecurity)
     """
     try:
-        async with aiosqlite.connect(DB_STR) as db:
+        async with _auth_db() as db:
             cur = await db.execute(
                 """
                 SELECT telegram_id, roblox_id, enc_roblosecurity
@@ -692,3 +1699,214 @@ async def get_all_cookies_with_ids() -> List[Tuple[int, int, str]]:
             continue
 
     return result
+
+
+# ====== SPENDING LEDGER ======
+
+async def get_spending_sync(roblox_id: int) -> Optional[dict]:
+    """{resume_cursor, head_cursor, complete, synced_at} или None — журнал ещё ни разу не синхронизировался."""
+    try:
+        async with _cache_db() as db:
+            cur = await db.execute(
+                'SELECT resume_cursor, head_cursor, complete, synced_at FROM spending_sync WHERE roblox_id=?',
+                (int(roblox_id),)
+            )
+            row = await cur.fetchone()
+        if not row:
+            return None
+        return {'resume_cursor': row[0], 'head_cursor': row[1], 'complete': bool(row[2]),
+                'synced_at': float(row[3] or 0)}
+    except Exception as e:
+        logging.error(f"[STORAGE] get_spending_sync({roblox_id}) error: {e}")
+        return None
+
+
+async def spending_known_ids(roblox_id: int, tx_ids: List[str]) -> set:
+    """Какие из tx_ids уже есть в журнале."""
+    known: set = set()
+    if not tx_ids:
+        return known
+    async with _cache_db() as db:
+        for part in _chunks(list(tx_ids)):
+            marks = ','.join('?' * len(part))
+            cur = await db.execute(
+                f'SELECT tx_id FROM spending_ledger WHERE roblox_id=? AND tx_id IN ({marks})',
+                (int(roblox_id), *part)
+            )
+            known.update(r[0] for r in await cur.fetchall())
+    return known
+
+
+async def add_spending_rows(roblox_id: int, rows: List[dict], *, resume_cursor: Optional[str] = None,
+                            head_cursor: Optional[str] = None, complete: Optional[bool] = None) -> int:
+    """
+    Дописывает транзакции в журнал (повтор tx_id игнорируется) и, если complete задан, — состояние
+    синхронизации; всё в одной транзакции. rows — {tx_id, created, amount, creator, row}.
+    """
+    rid = int(roblox_id)
+    async with _cache_db() as db:
+        before = db.total_changes
+        if rows:
+            await db.executemany(
+                '''
+                INSERT OR IGNORE INTO spending_ledger (roblox_id, tx_id, created, amount, creator, row)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ''',
+                [(rid, str(r['tx_id']), r.get('created'), int(r.get('amount') or 0), r.get('creator'),
+                  json.dumps(r['row'], ensure_ascii=False)) for r in rows]
+            )
+        added = db.total_changes - before
+        if complete is not None:
+            await db.execute(
+                '''
+                INSERT INTO spending_sync (roblox_id, resume_cursor, head_cursor, complete, synced_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(roblox_id) DO UPDATE SET
+                    resume_cursor = excluded.resume_cursor,
+                    head_cursor = excluded.head_cursor,
+                    complete = excluded.complete,
+                    synced_at = excluded.synced_at
+                ''',
+                (rid, resume_cursor, head_cursor, 1 if complete else 0, time.time())
+            )
+        await db.commit()
+    return added
+
+
+async def get_spending_rows(roblox_id: int, limit: Optional[int] = None, offset: int = 0) -> List[dict]:
+    """Строки истории из журнала, новые сначала."""
+    try:
+        async with _cache_db() as db:
+            cur = await db.execute(
+                'SELECT row FROM spending_ledger WHERE roblox_id=? ORDER BY created DESC, tx_id DESC LIMIT ? OFFSET ?',
+                (int(roblox_id), -1 if limit is None else int(limit), int(offset))
+            )
+            return [json.loads(r[0]) for r in await cur.fetchall()]
+    except Exception as e:
+        logging.error(f"[STORAGE] get_spending_rows({roblox_id}) error: {e}")
+        return []
+
+
+async def get_spending_total(roblox_id: int) -> Tuple[int, int]:
+    """(сумма потраченного, число транзакций) по журналу."""
+    try:
+        async with _cache_db() as db:
+            cur = await db.execute(
+                'SELECT COALESCE(SUM(amount), 0), COUNT(*) FROM spending_ledger WHERE roblox_id=?',
+                (int(roblox_id),)
+            )
+            row = await cur.fetchone()
+        return int(row[0] or 0), int(row[1] or 0)
+    except Exception as e:
+        logging.error(f"[STORAGE] get_spending_total({roblox_id}) error: {e}")
+        return 0, 0
+
+
+# ====== STREAMING (keyset-пагинация по первичному ключу) ======
+# Каждая пачка читается целиком и соединение возвращается в пул до yield, так что между пачками
+# чтение не держит ни блокировку БД, ни соединение, а параллельные UPDATE/DELETE строк
+# (рефреш кук, удаление) не сбивают обход.
+STREAM_CHUNK = int(os.getenv('STORAGE_STREAM_CHUNK', '500'))
+
+
+async def iter_bot_users(chunk: int = STREAM_CHUNK) -> AsyncIterator[List[Tuple[int, str, str]]]:
+    """Пачки (telegram_id, username, first_name) из bot_users по возрастанию telegram_id."""
+    last = None
+    while True:
+        async with _telemetry_db() as db:
+            cur = await db.execute(
+                'SELECT telegram_id, username, first_name FROM bot_users '
+                'WHERE telegram_id > COALESCE(?, -9223372036854775808) ORDER BY telegram_id LIMIT ?',
+                (last, chunk)
+            )
+            rows = await cur.fetchall()
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield [(int(r[0]), r[1] or '', r[2] or '') for r in rows]
+        if len(rows) < chunk:
+            return
+
+
+async def iter_bot_user_ids(chunk: int = STREAM_CHUNK) -> AsyncIterator[List[int]]:
+    """Пачки telegram_id всех пользователей бота (для рассылки)."""
+    async for rows in iter_bot_users(chunk):
+        yield [r[0] for r in rows]
+
+
+async def iter_owner_ids(chunk: int = STREAM_CHUNK) -> AsyncIterator[List[int]]:
+    """Пачки уникальных telegram_id из authorized_users (идём по PK, DISTINCT не нужен)."""
+    last = None
+    while True:
+        async with _auth_db() as db:
+            cur = await db.execute(
+                'SELECT telegram_id FROM authorized_users '
+                'WHERE telegram_id > COALESCE(?, -9223372036854775808) '
+                'GROUP BY telegram_id ORDER BY telegram_id LIMIT ?',
+                (last, chunk)
+            )
+            rows = await cur.fetchall()
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield [int(r[0]) for r in rows]
+        if len(rows) < chunk:
+            return
+
+
+async def iter_cookies_with_ids(chunk: int = STREAM_CHUNK) -> AsyncIterator[List[Tuple[int, int, str]]]:
+    """Пачки активных кук (telegram_id, roblox_id, enc_roblosecurity) по PK (telegram_id, roblox_id)."""
+    last = (-9223372036854775808, -9223372036854775808)
+    while True:
+        async with _auth_db() as db:
+            cur = await db.execute(
+                'SELECT telegram_id, roblox_id, enc_roblosecurity FROM user_cookies '
+                'WHERE (telegram_id, roblox_id) > (?, ?) AND is_active = TRUE '
+                'ORDER BY telegram_id, roblox_id LIMIT ?',
+                (last[0], last[1], chunk)
+            )
+            rows = await cur.fetchall()
+        if not rows:
+            return
+        last = (rows[-1][0], rows[-1][1])
+        out = [(int(r[0]), int(r[1]), str(r[2])) for r in rows if r[2]]
+        if out:
+            yield out
+        if len(rows) < chunk:
+            return
+
+
+async def iter_plain_cookies_with_ids(chunk: int = STREAM_CHUNK) -> AsyncIterator[List[Tuple[int, int, str, Optional[str]]]]:
+    """Как iter_cookies_with_ids, но каждая пачка расшифрована (vault + пул потоков)."""
+    async for rows in iter_cookies_with_ids(chunk):
+        yield await _decrypt_rows(rows)
+
+
+async def iter_accounts_distinct(chunk: int = STREAM_CHUNK) -> AsyncIterator[List[dict]]:
+    """Пачки list_accounts_distinct(): {roblox_id, username, inventory_val} по убыванию roblox_id."""
+    last = None
+    while True:
+        async with _auth_db() as db:
+            db.row_factory = aiosqlite.Row
+            cur = await db.execute(
+                """
+                SELECT
+                    au.roblox_id                        AS roblox_id,
+                    MAX(COALESCE(au.username, ''))      AS username,
+                    COALESCE(s.inventory_val, 0)        AS inventory_val
+                FROM authorized_users au
+                LEFT JOIN account_snapshots s ON s.roblox_id = au.roblox_id
+                WHERE au.roblox_id < COALESCE(?, 9223372036854775807)
+                GROUP BY au.roblox_id
+                ORDER BY au.roblox_id DESC
+                LIMIT ?
+                """,
+                (last, chunk)
+            )
+            rows = [dict(r) for r in await cur.fetchall()]
+        if not rows:
+            return
+        last = rows[-1]['roblox_id']
+        yield rows
+        if len(rows) < chunk:
+            return
@@ -1,8 +1,15 @@
-from typing import Optional
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 from cryptography.fernet import Fernet, InvalidToken
 from config import CFG
 fernet = Fernet(CFG.FERNET_KEY.encode())
 
+# Fernet (HMAC + AES) — синхронный; пачки гоняем в пуле потоков, а не в event loop
+_pool = ThreadPoolExecutor(max_workers=int(os.getenv('CRYPTO_THREADS', '2')), thread_name_prefix='fernet')
+_CHUNK = 64
+
 def encrypt_text(plaintext: str) -> str:
     return fernet.encrypt(plaintext.encode()).decode()
 
@@ -10,4 +17,28 @@ def decrypt_text(token_str: str) -> str:
     try:
         return fernet.decrypt(token_str.encode()).decode()
     except InvalidToken as e:
-        raise ValueError('Invalid encryption token or wrong FERNET_KEY') from e
\ No newline at end of file
+        raise ValueError('Invalid encryption token or wrong FERNET_KEY') from e
+
+def _decrypt_chunk(tokens: List[str]) -> List[Optional[str]]:
+    out: List[Optional[str]] = []
+    for tok in tokens:
+        try:
+            out.append(decrypt_text(tok))
+        except Exception:
+            out.append(None)
+    return out
+
+async def decrypt_text_async(token_str: str) -> str:
+    """decrypt_text вне event loop."""
+    return await asyncio.get_running_loop().run_in_executor(_pool, decrypt_text, token_str)
+
+async def decrypt_many(tokens: List[str]) -> List[Optional[str]]:
+    """Пакетная расшифровка в пуле потоков; порядок сохраняется, нерасшифрованные — None."""
+    if not tokens:
+        return []
+    loop = asyncio.get_running_loop()
+    parts = await asyncio.gather(*[
+        loop.run_in_executor(_pool, _decrypt_chunk, tokens[i:i + _CHUNK])
+        for i in range(0, len(tokens), _CHUNK)
+    ])
+    return [p for part in parts for p in part]